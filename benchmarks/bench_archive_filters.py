@@ -0,0 +1,99 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark extract_archive match time against file filter size.
+
+Every filter size is extracted twice: once with the patterns passed as separate
+arguments and once with the patterns passed in a list file.
+
+Usage:
+    python -m benchmarks.bench_archive_filters [--files 5000] [--sizes 10,100,1000,5000]
+"""
+
+import argparse
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from unittest.mock import patch
+
+from openrelik_worker_common import archive_utils
+
+
+def create_archives(folder: str, file_count: int) -> dict:
+    """Creates a tgz and a zip archive with file_count small files."""
+    names = [f"dir{i % 100}/file{i}.txt" for i in range(file_count)]
+    tgz_path = os.path.join(folder, "bench.tgz")
+    with tarfile.open(tgz_path, "w:gz") as tar:
+        for name in names:
+            info = tarfile.TarInfo(name)
+            info.size = 1
+            tar.addfile(info, io.BytesIO(b"x"))
+    zip_path = os.path.join(folder, "bench.zip")
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        for name in names:
+            archive.writestr(name, b"x")
+    return {"tgz": tgz_path, "zip": zip_path}
+
+
+def run_extraction(archive_path: str, file_filter: list, folder: str) -> float:
+    """Returns the wall time of a single filtered extraction."""
+    input_file = {"path": archive_path, "display_name": os.path.basename(archive_path)}
+    log_file = os.path.join(folder, "bench.log")
+    start = time.perf_counter()
+    _, export_folder = archive_utils.extract_archive(
+        input_file, folder, log_file, file_filter
+    )
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(export_folder)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--sizes", default="10,100,1000,5000")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    with tempfile.TemporaryDirectory() as folder:
+        archives = create_archives(folder, max(args.files, max(sizes)))
+        formats = ["tgz"] + (["zip"] if shutil.which("7z") else [])
+
+        print(f"{'format':<8}{'patterns':>10}{'argv (s)':>12}{'list file (s)':>16}")
+        for archive_format in formats:
+            with patch("shutil.which", return_value=True):
+                for size in sizes:
+                    # Every pattern matches exactly one member, tar fails on misses.
+                    file_filter = [f"file{i}.txt" for i in range(size)]
+                    timings = []
+                    for threshold in (len(file_filter), 0):
+                        with patch.object(
+                            archive_utils, "FILE_FILTER_LISTFILE_THRESHOLD", threshold
+                        ):
+                            try:
+                                timings.append(
+                                    f"{run_extraction(archives[archive_format], file_filter, folder):.3f}"
+                                )
+                            except OSError as e:
+                                timings.append(f"error ({e.errno})")
+                    print(
+                        f"{archive_format:<8}{size:>10}{timings[0]:>12}{timings[1]:>16}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
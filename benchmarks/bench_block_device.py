@@ -0,0 +1,130 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark BlockDevice setup, mount and umount time against partition count.
+
+External commands are answered by a FakeRunner, so no root or block devices are
+needed. Every command takes --latency-ms. The overhead column is the total wall
+time of a second run without command latency, i.e. the orchestration cost alone.
+
+Usage:
+    python -m benchmarks.bench_block_device [--partitions 1,4,16,64] [--latency-ms 5]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from openrelik_worker_common import mount_utils
+from openrelik_worker_common.command_utils import FakeRunner
+
+DEVICE = "/dev/loopbench"
+PARTITION_SIZE = 1024 * 1024 * 1024
+
+
+def fake_host(partition_count: int, latency: float) -> FakeRunner:
+    """Returns a FakeRunner emulating a loop device with partition_count ext4 partitions."""
+    name = os.path.basename(DEVICE)
+    lsblk = {
+        "blockdevices": [
+            {
+                "name": name,
+                "size": PARTITION_SIZE * (partition_count + 1),
+                "children": [
+                    {"name": f"{name}p{n}", "size": PARTITION_SIZE}
+                    for n in range(1, partition_count + 1)
+                ],
+            }
+        ]
+    }
+    blkid = "\n\n".join(
+        f"DEVNAME=/dev/{name}p{n}\nTYPE=ext4" for n in range(1, partition_count + 1)
+    )
+    runner = FakeRunner()
+    runner.add(["/usr/bin/grep"], latency=latency)
+    runner.add(["sudo", "losetup"], stdout=f"{DEVICE}\n", latency=latency)
+    runner.add(["sudo", "lsblk"], stdout=json.dumps(lsblk), latency=latency)
+    runner.add(["sudo", "blkid"], stdout=blkid, latency=latency)
+    runner.add(["sudo", "mount"], latency=latency)
+    runner.add(["sudo", "umount"], latency=latency)
+    return runner
+
+
+def run_sync(image_path: str, folder: str, runner: FakeRunner) -> list:
+    """Returns the wall time of BlockDevice setup, mount and umount."""
+    bd = mount_utils.BlockDevice(image_path, min_partition_size=1, runner=runner)
+    bd.mountroot = folder
+    bd.registry_dir = folder
+    timings = []
+    for phase in (bd.setup, bd.mount, bd.umount):
+        start = time.perf_counter()
+        phase()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_async(image_path: str, folder: str, runner: FakeRunner) -> list:
+    """Returns the wall time of AsyncBlockDevice setup, mount and umount."""
+    bd = mount_utils.AsyncBlockDevice(image_path, min_partition_size=1, runner=runner)
+    bd.mountroot = folder
+    bd.registry_dir = folder
+
+    async def run():
+        timings = []
+        for phase in (bd.setup_async, bd.mount_async, bd.umount_async):
+            start = time.perf_counter()
+            await phase()
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--partitions", default="1,4,16,64")
+    parser.add_argument("--latency-ms", type=float, default=5)
+    args = parser.parse_args()
+    partition_counts = [int(count) for count in args.partitions.split(",")]
+    latency = args.latency_ms / 1000
+
+    with tempfile.TemporaryDirectory() as folder:
+        image_path = os.path.join(folder, "bench.img")
+        with open(image_path, "wb") as fh:
+            fh.write(b"\0" * 4096)
+
+        print(
+            f"{'variant':<8}{'partitions':>12}{'setup (s)':>12}{'mount (s)':>12}"
+            f"{'umount (s)':>12}{'overhead (s)':>14}"
+        )
+        with patch("shutil.which", return_value=True):
+            for variant, run in (("sync", run_sync), ("async", run_async)):
+                for partition_count in partition_counts:
+                    runner = fake_host(partition_count, latency)
+                    timings = run(image_path, folder, runner)
+                    runner = fake_host(partition_count, latency)
+                    runner.latency_scale = 0
+                    overhead = sum(run(image_path, folder, runner))
+                    print(
+                        f"{variant:<8}{partition_count:>12}"
+                        + "".join(f"{timing:>12.3f}" for timing in timings)
+                        + f"{overhead:>14.4f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
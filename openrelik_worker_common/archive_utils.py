@@ -13,27 +13,317 @@
 # limitations under the License.
 """Helper methods for archives."""
 
+import fcntl
+import fnmatch
+import gzip
+import hashlib
+import io
+import json
+import logging
 import os
+import re
 import shutil
+import signal
 import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, suppress
+from pathlib import PurePosixPath
 from uuid import uuid4
 
+from .command_utils import record_command, submit_with_context
+from .file_utils import OutputFile, create_output_file
+
+# Filters with more patterns than this are passed to 7z/tar in a list file instead of
+# as separate arguments, to stay below ARG_MAX.
+FILE_FILTER_LISTFILE_THRESHOLD = 100
+
+# Name of the member listing the archive contents in archives made by create_archive.
+MANIFEST_MEMBER_NAME = "openrelik_manifest.json"
+
+# Share of the available memory an archive may use when extracted to a memory folder.
+MEMORY_BUDGET_FRACTION = 0.25
+
+# Minimum number of seconds between two progress callback invocations.
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionProgress:
+    """Progress of a running extraction.
+
+    Attributes:
+        percent: Percentage done as reported by 7z, None for tar.
+        bytes: Bytes processed so far. For 7z this is the share of the archive that has
+            been read, for tar the size of the extracted members.
+        files: Number of members extracted so far.
+        elapsed: Seconds since the extraction started.
+        rate: Bytes processed per second since the extraction started.
+    """
+
+    def __init__(self):
+        """Initialize an ExtractionProgress object."""
+        self.percent = None
+        self.bytes = 0
+        self.files = 0
+        self.elapsed = 0.0
+        self.rate = 0.0
+
+    def to_dict(self) -> dict:
+        """Return a dictionary representation of the ExtractionProgress object.
+
+        Returns:
+            A dictionary containing the attributes of the ExtractionProgress object.
+        """
+        return {
+            "percent": self.percent,
+            "bytes": self.bytes,
+            "files": self.files,
+            "elapsed": self.elapsed,
+            "rate": self.rate,
+        }
+
+
+class ExtractionBudget:
+    """Limits that guard archive extraction against zip bombs and full disks.
+
+    The limits are checked against the archive listing before extraction starts and
+    against the export folder while the archive is being extracted. A limit set to None
+    is not enforced.
+
+    Attributes:
+        max_bytes: Maximum total uncompressed size in bytes.
+        max_files: Maximum number of extracted files.
+        max_ratio: Maximum ratio between the uncompressed size and the archive size.
+        check_interval: Seconds between two export folder checks during extraction.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int | None = None,
+        max_files: int | None = None,
+        max_ratio: float | None = None,
+        check_interval: float = 2.0,
+    ):
+        """Initialize an ExtractionBudget object.
+
+        Args:
+            max_bytes: Maximum total uncompressed size in bytes (optional).
+            max_files: Maximum number of extracted files (optional).
+            max_ratio: Maximum uncompressed to archive size ratio (optional).
+            check_interval: Seconds between export folder checks, default 2.
+        """
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_ratio = max_ratio
+        self.check_interval = check_interval
+
+    def check(self, total_bytes: int, files: int, archive_size: int) -> str | None:
+        """Checks extraction totals against the budget.
+
+        Args:
+            total_bytes: Total uncompressed size in bytes.
+            files: Number of files.
+            archive_size: Size of the archive in bytes.
+
+        Returns:
+            str: A description of the exceeded limit, or None if within budget.
+        """
+        if self.max_bytes is not None and total_bytes > self.max_bytes:
+            return f"size {total_bytes} exceeds {self.max_bytes} bytes"
+        if self.max_files is not None and files > self.max_files:
+            return f"file count {files} exceeds {self.max_files} files"
+        if self.max_ratio is not None:
+            ratio = total_bytes / max(archive_size, 1)
+            if ratio > self.max_ratio:
+                return f"compression ratio {ratio:.1f} exceeds {self.max_ratio}"
+        return None
+
+
+def list_archive(input_file: dict, archive_password: str | None = None) -> list[dict]:
+    """Lists the members of an archive without extracting it.
+
+    Args:
+      input_file(dict): Input file dict.
+      archive_password(str | None): Password of the input archives (optional).
+
+    Returns:
+      list: A dict per member with path, size, is_dir and encrypted keys.
+
+    Raises:
+      RuntimeError: If the archive could not be listed.
+    """
+    if "path" not in input_file or "display_name" not in input_file:
+        raise RuntimeError("input_file parameter malformed")
+
+    input_path = input_file.get("path")
+    if input_file.get("display_name").endswith((".tgz", ".tar.gz")):
+        command = ["tar", "--numeric-owner", "-tvzf", input_path]
+    else:
+        command = ["7z", "l", "-slt", input_path]
+        if archive_password is not None:
+            command.append(f"-p{archive_password}")
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        command, capture_output=True, check=False, stdin=subprocess.DEVNULL
+    )
+    record_command(
+        command,
+        time.perf_counter() - start,
+        process.returncode,
+        len(process.stdout) + len(process.stderr),
+    )
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"Error listing archive {input_path}: {process.stderr.decode(errors='replace')}"
+        )
+
+    output = process.stdout.decode("utf-8", errors="surrogateescape")
+    if command[0] == "tar":
+        return _parse_tar_listing(output)
+    return _parse_7z_listing(output)
+
+
+def find_archive_password(
+    input_file: dict, candidates: list[str], max_workers: int = 4
+) -> str | None:
+    """Finds the password of an encrypted archive from a list of candidates.
+
+    Candidates are tested in parallel with a cheap check instead of a full extraction:
+    7z t on the smallest encrypted member, or a 7z listing for archives with encrypted
+    headers. For ZipCrypto archives candidates failing zipfile's password check byte
+    are dropped before running 7z.
+
+    Args:
+      input_file(dict): Input file dict.
+      candidates(list): Candidate passwords.
+      max_workers(int): Maximum number of candidates tested at the same time.
+
+    Returns:
+      str | None: The working candidate, or None if the archive isn't encrypted.
+
+    Raises:
+      RuntimeError: If the archive is encrypted and none of the candidates worked.
+    """
+    if "path" not in input_file or "display_name" not in input_file:
+        raise RuntimeError("input_file parameter malformed")
+
+    input_path = input_file.get("path")
+    if input_file.get("display_name").endswith((".tgz", ".tar.gz")):
+        return None
+
+    all_candidates = candidates
+    try:
+        members = list_archive(input_file)
+    except RuntimeError:
+        # The listing itself needs a password, the headers are encrypted.
+        member = None
+    else:
+        encrypted = [m for m in members if m["encrypted"] and not m["is_dir"]]
+        if not encrypted:
+            return None
+        member = min(encrypted, key=lambda m: m["size"])["path"]
+        candidates = _zip_password_candidates(input_path, member, candidates)
+
+    def test_candidate(candidate: str) -> bool:
+        if member is None:
+            command = ["7z", "l", "-slt", input_path, f"-p{candidate}"]
+        else:
+            command = ["7z", "t", input_path, f"-p{candidate}", "-y", "-spd", member]
+        start = time.perf_counter()
+        process = subprocess.run(
+            command, capture_output=True, check=False, stdin=subprocess.DEVNULL
+        )
+        record_command(
+            command,
+            time.perf_counter() - start,
+            process.returncode,
+            len(process.stdout) + len(process.stderr),
+        )
+        return process.returncode == 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            submit_with_context(executor, test_candidate, c): c
+            for c in dict.fromkeys(candidates)
+        }
+        for future in as_completed(futures):
+            if future.result():
+                password = futures[future]
+                for pending in futures:
+                    pending.cancel()
+                logger.info(
+                    f"Archive password candidate {all_candidates.index(password)} "
+                    f"worked for {input_path}"
+                )
+                return password
+
+    logger.error(f"None of the archive password candidates worked for {input_path}")
+    raise RuntimeError("None of the archive password candidates worked.")
+
 
 def extract_archive(
-    input_file: dict, output_folder: str, log_file: str, file_filter: list = [], archive_password: str | None = None
+    input_file: dict,
+    output_folder: str,
+    log_file: str,
+    file_filter: list = [],
+    archive_password: str | list[str] | None = None,
+    progress_callback: Callable[[ExtractionProgress], None] | None = None,
+    timeout: float | None = None,
+    stall_timeout: float | None = None,
+    budget: ExtractionBudget | None = None,
+    memory_folder: str | None = None,
+    memory_budget: int | None = None,
 ) -> tuple[str, str]:
     """Unpacks an archive.
 
+    If a progress_callback, timeout or stall_timeout is given the 7z/tar output is
+    streamed and parsed while it is written to log_file. An extraction that runs longer
+    than timeout seconds, or doesn't produce output for stall_timeout seconds, is killed
+    and its partial output removed.
+
+    If a budget is given the archive listing is checked against it before extraction,
+    and the export folder is checked every budget.check_interval seconds during
+    extraction. Exceeding the budget aborts the extraction and removes partial output.
+
+    If a memory_folder, e.g. /dev/shm or another tmpfs mount, is given the archive is
+    extracted there when the archive listing fits in memory_budget and the free space
+    of memory_folder. Otherwise, or when extracting to memory fails, the archive is
+    extracted to output_folder. The returned export folder may then be in
+    memory_folder instead of output_folder, the caller owns it and must move or remove
+    it to free the memory, e.g. with shutil.rmtree once the files are processed.
+
     Args:
       input_file(dict): Input file dict.
       output_folder(string): OpenRelik output_folder.
       log_file(string): Log file path.
       file_filter(list): List of file patterns to extract (optional).
-      archive_password(str | None): Password of the input archives (optional). 
+      archive_password(str | list | None): Password of the input archives, or a list
+          of candidate passwords to test with find_archive_password (optional).
+      progress_callback(callable): Called with an ExtractionProgress at most every
+          PROGRESS_INTERVAL_SECONDS (optional).
+      timeout(float | None): Maximum number of seconds the extraction may take (optional).
+      stall_timeout(float | None): Maximum number of seconds without extractor
+          output (optional).
+      budget(ExtractionBudget | None): Size, file count and ratio limits (optional).
+      memory_folder(str | None): Memory-backed folder to extract small archives to
+          (optional).
+      memory_budget(int | None): Maximum number of bytes to extract to memory_folder,
+          defaults to MEMORY_BUDGET_FRACTION of the available memory.
 
     Return:
       command(string): The executed command string.
       export_folder: Root folder path to the unpacked archive.
+
+    Raises:
+      RuntimeError: If extraction failed, timed out or exceeded the budget.
     """
     if "path" not in input_file or "display_name" not in input_file:
         raise RuntimeError("input_file parameter malformed")
@@ -44,10 +334,597 @@ def extract_archive(
     if not shutil.which("7z"):
         raise RuntimeError("7z executable not found!")
 
-    export_folder = os.path.join(output_folder, uuid4().hex)
-    os.makedirs(export_folder)
+    if isinstance(archive_password, list):
+        archive_password = find_archive_password(input_file, archive_password)
+
+    file_filter = _normalize_file_filter(file_filter)
+
+    members = None
+    if budget:
+        members = list_archive(input_file, archive_password)
+        _check_listing_budget(input_file, members, file_filter, budget)
+
+    extraction_folders = [output_folder]
+    if memory_folder and _fits_in_memory_folder(
+        input_file, members, file_filter, archive_password, memory_folder, memory_budget
+    ):
+        extraction_folders.insert(0, memory_folder)
+
+    filter_list_file = None
+    if len(file_filter) > FILE_FILTER_LISTFILE_THRESHOLD:
+        filter_list_file = _write_filter_list_file(file_filter, output_folder)
+
+    monitored = bool(progress_callback or timeout or stall_timeout or budget)
+    is_tar = input_filename.endswith((".tgz", ".tar.gz"))
+
+    try:
+        for extraction_folder in extraction_folders:
+            export_folder = os.path.join(extraction_folder, uuid4().hex)
+            os.makedirs(export_folder)
+            command = _build_extract_command(
+                input_path,
+                export_folder,
+                is_tar,
+                archive_password,
+                file_filter,
+                filter_list_file,
+                monitored,
+            )
+            if monitored:
+                ret = _run_monitored_extraction(
+                    command,
+                    log_file,
+                    input_path,
+                    export_folder,
+                    is_tar,
+                    progress_callback,
+                    timeout,
+                    stall_timeout,
+                    budget,
+                )
+            else:
+                start = time.perf_counter()
+                with open(log_file, "wb") as out:
+                    ret = subprocess.call(command, stdout=out, stderr=out)
+                record_command(
+                    command,
+                    time.perf_counter() - start,
+                    ret,
+                    os.path.getsize(log_file),
+                )
+            if ret == 0 or extraction_folder == output_folder:
+                break
+            logger.warning(
+                f"Extraction to memory folder {extraction_folder} failed, "
+                f"falling back to {output_folder}"
+            )
+            shutil.rmtree(export_folder, ignore_errors=True)
+    finally:
+        if filter_list_file:
+            os.remove(filter_list_file)
+    if ret != 0:
+        raise RuntimeError("7zip or tar execution error.")
+
+    return (" ".join(command), export_folder)
+
+
+def extract_archive_to_output_files(
+    input_file: dict,
+    output_folder: str,
+    log_file: str,
+    file_filter: list = [],
+    archive_password: str | list[str] | None = None,
+    data_type: str | None = None,
+    digest_algorithm: str | None = None,
+    **kwargs,
+) -> tuple[str, list[OutputFile]]:
+    """Unpacks an archive and returns the extracted files as OutputFiles.
+
+    The extracted files are collected in a single os.scandir pass over the export folder
+    and moved into output_folder, so workers don't need to walk the tree again and call
+    create_output_file for every file. The emptied export folder is removed afterwards.
+
+    Args:
+      input_file(dict): Input file dict.
+      output_folder(string): OpenRelik output_folder.
+      log_file(string): Log file path.
+      file_filter(list): List of file patterns to extract (optional).
+      archive_password(str | list | None): Password of the input archives, or a list
+          of candidate passwords (optional).
+      data_type(str | None): Data type to set on the output files (optional).
+      digest_algorithm(str | None): hashlib algorithm name, e.g. "sha256", to compute
+          a digest for every extracted file (optional).
+      **kwargs: Other extract_archive options, e.g. budget, timeout, stall_timeout,
+          progress_callback or memory_folder.
+
+    Return:
+      command(string): The executed command string.
+      output_files(list): OutputFile instances with original_path and size set.
+    """
+    command, export_folder = extract_archive(
+        input_file, output_folder, log_file, file_filter, archive_password, **kwargs
+    )
+
+    output_files = []
+    try:
+        for entry, relative_path in _scan_files(export_folder):
+            output_file = create_output_file(
+                output_folder,
+                display_name=entry.name,
+                data_type=data_type,
+                original_path=f"/{relative_path}",
+                source_file_id=input_file.get("id"),
+            )
+            output_file.size = entry.stat(follow_symlinks=False).st_size
+            if digest_algorithm:
+                with open(entry.path, "rb") as fh:
+                    output_file.digest = hashlib.file_digest(
+                        fh, digest_algorithm
+                    ).hexdigest()
+            shutil.move(entry.path, output_file.path)
+            output_files.append(output_file)
+    finally:
+        shutil.rmtree(export_folder, ignore_errors=True)
+
+    return (command, output_files)
+
+
+def create_archive(
+    output_folder: str,
+    files: list[OutputFile] | str,
+    display_name: str = "archive",
+    compress: bool = True,
+    compress_threads: int = 1,
+    data_type: str | None = None,
+) -> tuple[OutputFile, list[dict]]:
+    """Packs files into a single tar or tar.gz output file.
+
+    The files are streamed into the archive one by one, so workers producing many small
+    files can pass on one output file instead. A JSON manifest of the members is added
+    as the last member, MANIFEST_MEMBER_NAME, and returned.
+
+    Args:
+      output_folder(string): OpenRelik output_folder.
+      files(list | string): OutputFile instances, or a folder to pack recursively.
+      display_name(string): Display name of the archive without extension.
+      compress(bool): Create a tar.gz instead of a tar, default True.
+      compress_threads(int): Number of pigz threads, if pigz is installed and more
+          than one thread is requested (optional).
+      data_type(str | None): Data type of the archive output file (optional).
+
+    Returns:
+      output_file(OutputFile): The archive output file, with size set.
+      manifest(list): A dict per member with name, size and original_path keys.
+    """
+    if isinstance(files, str):
+        members = [
+            (entry.path, relative_path, f"/{relative_path}")
+            for entry, relative_path in _scan_files(files)
+        ]
+    else:
+        members = []
+        names = set()
+        for file in files:
+            name = _member_name(file.original_path or "") or _member_name(
+                file.display_name
+            )
+            name = name or file.uuid
+            if name in names:
+                folder, filename = os.path.split(name)
+                name = os.path.join(folder, f"{file.uuid}_{filename}")
+            names.add(name)
+            members.append((file.path, name, file.original_path))
+
+    output_file = create_output_file(
+        output_folder,
+        display_name=display_name,
+        extension="tar.gz" if compress else "tar",
+        data_type=data_type,
+    )
+
+    try:
+        manifest = _write_archive(output_file.path, members, compress, compress_threads)
+    except BaseException:
+        # Don't leave a truncated archive behind.
+        with suppress(OSError):
+            os.remove(output_file.path)
+        raise
+
+    output_file.size = os.path.getsize(output_file.path)
+    return (output_file, manifest)
+
+
+def _member_name(path: str) -> str:
+    """Returns a relative archive member name for a path.
+
+    The path is normalized and the root and leading ".." components are dropped, so
+    members never extract outside of the extraction folder.
+
+    Args:
+      path(string): Original path or display name of a file.
+
+    Returns:
+      name(string): Member name, empty if nothing is left of the path.
+    """
+    parts = PurePosixPath(os.path.normpath(path)).parts
+    return "/".join(part for part in parts if part not in ("/", ".", ".."))
+
+
+def _write_archive(
+    path: str, members: list, compress: bool, compress_threads: int
+) -> list[dict]:
+    """Streams the members and the manifest into a tar or tar.gz file.
+
+    Args:
+      path(string): Path of the archive to write.
+      members(list): (path, name, original_path) tuples.
+      compress(bool): Create a tar.gz instead of a tar.
+      compress_threads(int): Number of pigz threads.
+
+    Returns:
+      manifest(list): A dict per member with name, size and original_path keys.
+
+    Raises:
+      RuntimeError: If pigz failed.
+    """
+    manifest = []
+    pigz = None
+    with open(path, "wb") as out:
+        if compress and compress_threads > 1 and shutil.which("pigz"):
+            pigz_start = time.perf_counter()
+            pigz = subprocess.Popen(
+                ["pigz", "-p", str(compress_threads), "-c"],
+                stdin=subprocess.PIPE,
+                stdout=out,
+            )
+            stream = pigz.stdin
+        elif compress:
+            stream = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6)
+        else:
+            stream = out
+
+        try:
+            with tarfile.open(fileobj=stream, mode="w|") as tar:
+                for path, name, original_path in members:
+                    tar.add(path, arcname=name, recursive=False)
+                    manifest.append(
+                        {
+                            "name": name,
+                            "size": os.path.getsize(path),
+                            "original_path": original_path,
+                        }
+                    )
+                data = json.dumps(manifest, indent=2).encode("utf-8")
+                info = tarfile.TarInfo(MANIFEST_MEMBER_NAME)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+        finally:
+            if stream is not out:
+                stream.close()
+            if pigz:
+                pigz.wait()
+                record_command(
+                    pigz.args,
+                    time.perf_counter() - pigz_start,
+                    pigz.returncode,
+                    os.fstat(out.fileno()).st_size,
+                )
+                if pigz.returncode != 0:
+                    raise RuntimeError("pigz execution error.")
+    return manifest
+
+
+class ExtractionCache:
+    """Node-local cache of extracted archives.
+
+    Cache entries are keyed by the archive digest, the file filter and whether a
+    password was given. A cache hit serves a hardlinked copy of the cached export folder,
+    so the cache folder should be on the same filesystem as the output folders. Files
+    served from the cache share their inode with the cache entry and must not be
+    modified in place, moving or deleting them is fine.
+
+    Entries are evicted least recently used first once the cache grows beyond
+    max_bytes. A per-key file lock makes sure concurrent workers on the same node
+    extract each archive only once.
+
+    Usage:
+        ```
+        cache = ExtractionCache(max_bytes=100 * 1024**3)
+        command, export_folder = cache.extract_archive(
+            input_file, output_folder, log_file, file_filter
+        )
+        ```
+    """
+
+    DEFAULT_MAX_BYTES = 50 * 1024**3  #: Default 50 GB
+
+    def __init__(
+        self, cache_dir: str | None = None, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        """Initialize an ExtractionCache object.
 
-    if input_filename.endswith((".tgz", ".tar.gz")):
+        Args:
+            cache_dir: Cache folder, defaults to OPENRELIK_EXTRACTION_CACHE_DIR or a
+                folder in the system temporary directory.
+            max_bytes: Maximum total size of the cached entries, default DEFAULT_MAX_BYTES.
+        """
+        self.cache_dir = (
+            cache_dir
+            or os.getenv("OPENRELIK_EXTRACTION_CACHE_DIR")
+            or os.path.join(tempfile.gettempdir(), "openrelik-extraction-cache")
+        )
+        self.max_bytes = max_bytes
+        self.entries_dir = os.path.join(self.cache_dir, "entries")
+        self.locks_dir = os.path.join(self.cache_dir, "locks")
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+    def extract_archive(
+        self,
+        input_file: dict,
+        output_folder: str,
+        log_file: str,
+        file_filter: list = [],
+        archive_password: str | list[str] | None = None,
+        digest: str | None = None,
+        **kwargs,
+    ) -> tuple[str, str]:
+        """Unpacks an archive, serving a copy from the cache if it was unpacked before.
+
+        Args:
+          input_file(dict): Input file dict.
+          output_folder(string): OpenRelik output_folder.
+          log_file(string): Log file path.
+          file_filter(list): List of file patterns to extract (optional).
+          archive_password(str | list | None): Password of the input archives, or a
+              list of candidate passwords (optional).
+          digest(str | None): SHA-256 hex digest of the archive, computed if not given.
+          **kwargs: Other extract_archive options, used on a cache miss.
+
+        Return:
+          command(string): The command string that created the cache entry.
+          export_folder: Root folder path to the unpacked archive.
+        """
+        if "path" not in input_file or "display_name" not in input_file:
+            raise RuntimeError("input_file parameter malformed")
+
+        if not digest:
+            with open(input_file.get("path"), "rb") as fh:
+                digest = hashlib.file_digest(fh, "sha256").hexdigest()
+        key = self._key(digest, file_filter, archive_password is not None)
+        entry_dir = os.path.join(self.entries_dir, key)
+        meta_path = os.path.join(entry_dir, "meta.json")
+
+        with self._lock(key):
+            if os.path.isfile(meta_path):
+                with open(meta_path, "r", encoding="utf-8") as fh:
+                    meta = json.load(fh)
+                os.utime(meta_path)
+                logger.info(f"Extraction cache hit {key} for {input_file.get('path')}")
+                with open(log_file, "w", encoding="utf-8") as fh:
+                    fh.write(f"Served from extraction cache entry {key}\n")
+            else:
+                meta = self._populate(
+                    key,
+                    input_file,
+                    log_file,
+                    file_filter,
+                    archive_password,
+                    **kwargs,
+                )
+            export_folder = os.path.join(output_folder, uuid4().hex)
+            _link_tree(os.path.join(entry_dir, "files"), export_folder)
+
+        self.evict(keep=key)
+        return (meta["command"], export_folder)
+
+    def evict(self, keep: str | None = None) -> list[str]:
+        """Evicts least recently used entries until the cache fits in max_bytes.
+
+        Entries that are locked by another worker are skipped.
+
+        Args:
+            keep: Key of an entry that must not be evicted (optional).
+
+        Returns:
+            list: Keys of the evicted entries.
+        """
+        entries = []
+        for key in os.listdir(self.entries_dir):
+            meta_path = os.path.join(self.entries_dir, key, "meta.json")
+            try:
+                with open(meta_path, "r", encoding="utf-8") as fh:
+                    size = json.load(fh)["size"]
+                entries.append((os.stat(meta_path).st_mtime, key, size))
+            except (OSError, ValueError, KeyError):
+                # Entry is being populated or removed.
+                continue
+
+        total = sum(size for _, _, size in entries)
+        evicted = []
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                with self._lock(key, blocking=False):
+                    shutil.rmtree(os.path.join(self.entries_dir, key))
+            except BlockingIOError:
+                continue
+            logger.info(f"Evicted extraction cache entry {key}")
+            total -= size
+            evicted.append(key)
+        return evicted
+
+    def _populate(
+        self,
+        key: str,
+        input_file: dict,
+        log_file: str,
+        file_filter: list,
+        archive_password: str | list[str] | None,
+        **kwargs,
+    ) -> dict:
+        """Extracts an archive into a new cache entry and returns its metadata."""
+        entry_dir = os.path.join(self.entries_dir, key)
+        staging_dir = os.path.join(self.cache_dir, f"staging-{uuid4().hex}")
+        os.makedirs(staging_dir)
+        export_folder = None
+        try:
+            command, export_folder = extract_archive(
+                input_file,
+                staging_dir,
+                log_file,
+                file_filter,
+                archive_password,
+                **kwargs,
+            )
+            size, files = _folder_usage(export_folder)
+            meta = {"command": command, "size": size, "files": files}
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.makedirs(entry_dir)
+            # The export folder is outside of the cache if it was extracted to a
+            # memory_folder, shutil.move copies it across file systems.
+            shutil.move(export_folder, os.path.join(entry_dir, "files"))
+            # meta.json is written last, it marks the entry as complete.
+            with open(
+                os.path.join(entry_dir, "meta.json"), "w", encoding="utf-8"
+            ) as fh:
+                json.dump(meta, fh)
+        except BaseException:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            raise
+        finally:
+            if export_folder:
+                shutil.rmtree(export_folder, ignore_errors=True)
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        logger.info(
+            f"Extraction cache entry {key} created for {input_file.get('path')}"
+        )
+        return meta
+
+    @staticmethod
+    def _key(digest: str, file_filter: list, has_password: bool) -> str:
+        """Returns the cache key for an archive digest, filter and password presence."""
+        key = json.dumps(
+            [digest, sorted(_normalize_file_filter(file_filter)), has_password]
+        )
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _lock(self, key: str, blocking: bool = True) -> Iterator[None]:
+        """Holds an exclusive node-local file lock for a cache key.
+
+        Raises:
+            BlockingIOError: If blocking is False and the lock is held elsewhere.
+        """
+        with open(os.path.join(self.locks_dir, f"{key}.lock"), "w") as fh:
+            fcntl.flock(
+                fh, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            )
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class _ExtractionOutputParser:
+    """Parses streamed 7z (-bsp1 -bb1) or tar (-v) output into an ExtractionProgress."""
+
+    SEVENZIP_PERCENT_RE = re.compile(rb"(\d+)%(?:\s+(\d+))?")
+    SEPARATORS_RE = re.compile(rb"[\r\n\b]")
+
+    def __init__(self, input_path: str, export_folder: str, is_tar: bool):
+        """Initialize the parser.
+
+        Args:
+            input_path: Path to the archive being extracted.
+            export_folder: Folder the archive is extracted to.
+            is_tar: True for tar output, False for 7z output.
+        """
+        self.export_folder = export_folder
+        self.is_tar = is_tar
+        self.progress = ExtractionProgress()
+        self._archive_size = os.path.getsize(input_path) if not is_tar else 0
+        self._buffer = b""
+        self._last_member = None
+        self._listed_files = 0
+
+    def feed(self, data: bytes) -> None:
+        """Parses a chunk of extractor output.
+
+        Args:
+            data: Output bytes, segments may be split across chunks.
+        """
+        segments = self.SEPARATORS_RE.split(self._buffer + data)
+        self._buffer = segments.pop()
+        for segment in segments:
+            self._parse_segment(segment.strip())
+
+    def close(self) -> None:
+        """Parses the remaining buffered output once the extractor exited."""
+        self.feed(b"\n")
+        self._account_last_member()
+
+    def _parse_segment(self, segment: bytes) -> None:
+        """Updates the progress with a single line of output."""
+        if not segment:
+            return
+        if self.is_tar:
+            self._account_last_member()
+            if not segment.endswith(b"/"):
+                self._last_member = segment
+                self.progress.files += 1
+            return
+        if segment.startswith(b"- "):
+            self._listed_files += 1
+            self.progress.files = max(self.progress.files, self._listed_files)
+            return
+        match = self.SEVENZIP_PERCENT_RE.match(segment)
+        if match:
+            self.progress.percent = int(match.group(1))
+            self.progress.bytes = self._archive_size * self.progress.percent // 100
+            if match.group(2):
+                self.progress.files = max(self.progress.files, int(match.group(2)))
+
+    def _account_last_member(self) -> None:
+        """Adds the size of the previous, now complete, tar member."""
+        if self._last_member is None:
+            return
+        member_path = os.path.join(self.export_folder, os.fsdecode(self._last_member))
+        self._last_member = None
+        try:
+            self.progress.bytes += os.lstat(member_path).st_size
+        except OSError:
+            pass
+
+
+def _build_extract_command(
+    input_path: str,
+    export_folder: str,
+    is_tar: bool,
+    archive_password: str | None,
+    file_filter: list[str],
+    filter_list_file: str | None,
+    monitored: bool,
+) -> list[str]:
+    """Builds the 7z or tar command to extract an archive to export_folder.
+
+    Args:
+      input_path(string): Path to the archive.
+      export_folder(string): Folder to extract to.
+      is_tar(bool): True to extract with tar, False to extract with 7z.
+      archive_password(str | None): Password of the archive.
+      file_filter(list): Normalized list of file patterns.
+      filter_list_file(str | None): List file with the file patterns.
+      monitored(bool): True if the output is streamed to _run_monitored.
+
+    Returns:
+      list: The extraction command.
+    """
+    if is_tar:
         command = [
             "tar",
             "-vxzf",
@@ -55,10 +932,21 @@ def extract_archive(
             "-C",
             f"{export_folder}",
         ]
-        if file_filter:
+        if filter_list_file:
+            command.extend(
+                [
+                    "--recursion",
+                    "--no-anchored",
+                    "--wildcards",
+                    "--verbatim-files-from",
+                    "-T",
+                    filter_list_file,
+                ]
+            )
+        elif file_filter:
             command.extend(["--recursion", "--no-anchored"])
             for pattern in file_filter:
-                command.extend(["--wildcards", pattern.strip()])
+                command.extend(["--wildcards", pattern])
     else:
         command = [
             "7z",
@@ -68,15 +956,495 @@ def extract_archive(
         ]
         if archive_password is not None:
             command.append(f"-p{archive_password}")
-        if file_filter:
+        if monitored:
+            # Report progress percentages and extracted file names on stdout.
+            command.extend(["-bsp1", "-bb1"])
+        if filter_list_file:
+            command.extend(["-r", "-scsUTF-8", f"@{filter_list_file}"])
+        elif file_filter:
             command.append("-r")
-            for pattern in file_filter:
-                command.append(pattern.strip())
+            command.extend(file_filter)
+    return command
+
+
+def _run_monitored_extraction(
+    command: list[str],
+    log_file: str,
+    input_path: str,
+    export_folder: str,
+    is_tar: bool,
+    progress_callback: Callable[[ExtractionProgress], None] | None,
+    timeout: float | None,
+    stall_timeout: float | None,
+    budget: ExtractionBudget | None,
+) -> int:
+    """Runs an extraction with _run_monitored, removing partial output on errors.
+
+    Returns:
+      int: The extractor return code.
+
+    Raises:
+      RuntimeError: If the extraction timed out or exceeded the budget.
+    """
+    parser = _ExtractionOutputParser(input_path, export_folder, is_tar)
+    check = None
+    if budget:
+        check = _export_folder_budget_check(input_path, export_folder, budget)
+    try:
+        ret = _run_monitored(
+            command,
+            log_file,
+            parser,
+            progress_callback,
+            timeout,
+            stall_timeout,
+            check,
+        )
+        # Extractions finishing between two checks are verified once more.
+        if check and (error := check(force=True)):
+            raise RuntimeError(error)
+    except RuntimeError:
+        shutil.rmtree(export_folder, ignore_errors=True)
+        raise
+    return ret
+
+
+def _fits_in_memory_folder(
+    input_file: dict,
+    members: list[dict] | None,
+    file_filter: list[str],
+    archive_password: str | None,
+    memory_folder: str,
+    memory_budget: int | None,
+) -> bool:
+    """Decides if an archive can be extracted to a memory-backed folder.
+
+    Args:
+      input_file(dict): Input file dict.
+      members(list | None): Archive listing, listed if None.
+      file_filter(list): Normalized list of file patterns.
+      archive_password(str | None): Password of the archive.
+      memory_folder(string): Memory-backed folder.
+      memory_budget(int | None): Maximum number of bytes, defaults to
+          MEMORY_BUDGET_FRACTION of the available memory.
+
+    Returns:
+      bool: True if the files to extract fit in the memory budget and folder.
+    """
+    if not os.path.isdir(memory_folder):
+        logger.warning(f"Memory folder {memory_folder} does not exist")
+        return False
+    if members is None:
+        try:
+            members = list_archive(input_file, archive_password)
+        except RuntimeError as e:
+            logger.warning(f"Not extracting to memory, listing failed: {e}")
+            return False
+
+    needed = sum(
+        m["size"]
+        for m in members
+        if not m["is_dir"]
+        and (not file_filter or _matches_file_filter(m["path"], file_filter))
+    )
+    if memory_budget is None:
+        memory_budget = int(_available_memory() * MEMORY_BUDGET_FRACTION)
+    stat = os.statvfs(memory_folder)
+    available = min(memory_budget, stat.f_bavail * stat.f_frsize)
+    if needed > available:
+        logger.info(
+            f"Not extracting to memory, {needed} bytes exceed {available} bytes"
+        )
+        return False
+    return True
+
+
+def _available_memory() -> int:
+    """Returns the available memory in bytes."""
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def _run_monitored(
+    command: list[str],
+    log_file: str,
+    parser: _ExtractionOutputParser,
+    progress_callback: Callable[[ExtractionProgress], None] | None = None,
+    timeout: float | None = None,
+    stall_timeout: float | None = None,
+    check: Callable[[], str | None] | None = None,
+) -> int:
+    """Runs an extractor, streaming its output to log_file and the output parser.
+
+    Args:
+      command(list): The extractor command.
+      log_file(string): Log file path.
+      parser(_ExtractionOutputParser): Parser for the extractor output.
+      progress_callback(callable): Called with an ExtractionProgress (optional).
+      timeout(float | None): Maximum number of seconds the extractor may run (optional).
+      stall_timeout(float | None): Maximum number of seconds without output (optional).
+      check(callable): Called periodically, returns an error message to abort the
+          extractor (optional).
+
+    Returns:
+      int: The extractor return code.
+
+    Raises:
+      RuntimeError: If the extractor was killed because of a timeout or failed check.
+    """
+    lock = threading.Lock()
+    start = time.monotonic()
+    last_activity = start
+    output_size = 0
+
+    def reader(stream, out):
+        nonlocal last_activity, output_size
+        while data := os.read(stream.fileno(), 65536):
+            out.write(data)
+            with lock:
+                parser.feed(data)
+                last_activity = time.monotonic()
+                output_size += len(data)
 
-    command_string = " ".join(command)
     with open(log_file, "wb") as out:
-        ret = subprocess.call(command, stdout=out, stderr=out)
-    if ret != 0:
-        raise RuntimeError("7zip or tar execution error.")
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        reader_thread = threading.Thread(
+            target=reader, args=(process.stdout, out), daemon=True
+        )
+        reader_thread.start()
+
+        error = None
+        last_report = 0.0
+        while True:
+            try:
+                process.wait(timeout=min(PROGRESS_INTERVAL_SECONDS, 0.5))
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            now = time.monotonic()
+            with lock:
+                idle = now - last_activity
+            if timeout and now - start > timeout:
+                error = f"7zip or tar execution timed out after {timeout} seconds."
+            elif stall_timeout and idle > stall_timeout:
+                error = f"7zip or tar execution stalled for {stall_timeout} seconds."
+            elif check:
+                error = check()
+            if error:
+                logger.error(f"{error} Killing {command[0]}.")
+                # Kill the whole process group, tar runs gzip as a child process.
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                break
+            if progress_callback and now - last_report >= PROGRESS_INTERVAL_SECONDS:
+                last_report = now
+                progress_callback(_snapshot_progress(parser, lock, now - start))
+
+        reader_thread.join()
+        process.stdout.close()
+
+    record_command(command, time.monotonic() - start, process.returncode, output_size)
+    if error:
+        raise RuntimeError(error)
 
-    return (command_string, export_folder)
+    parser.close()
+    if progress_callback:
+        progress_callback(_snapshot_progress(parser, lock, time.monotonic() - start))
+    return process.returncode
+
+
+def _snapshot_progress(
+    parser: _ExtractionOutputParser, lock: threading.Lock, elapsed: float
+) -> ExtractionProgress:
+    """Returns a copy of the parser progress with elapsed time and rate set."""
+    progress = ExtractionProgress()
+    with lock:
+        progress.percent = parser.progress.percent
+        progress.bytes = parser.progress.bytes
+        progress.files = parser.progress.files
+    progress.elapsed = elapsed
+    progress.rate = progress.bytes / elapsed if elapsed > 0 else 0.0
+    return progress
+
+
+def _check_listing_budget(
+    input_file: dict,
+    members: list[dict],
+    file_filter: list[str],
+    budget: ExtractionBudget,
+) -> None:
+    """Checks the archive listing against an extraction budget.
+
+    The size and file count limits only count members matched by the file filter, the
+    compression ratio is checked for the archive as a whole.
+
+    Raises:
+      RuntimeError: If the archive exceeds the budget.
+    """
+    members = [m for m in members if not m["is_dir"]]
+    matched = [
+        m
+        for m in members
+        if not file_filter or _matches_file_filter(m["path"], file_filter)
+    ]
+    archive_size = os.path.getsize(input_file.get("path"))
+
+    ratio_budget = ExtractionBudget(max_ratio=budget.max_ratio)
+    error = ratio_budget.check(sum(m["size"] for m in members), 0, archive_size)
+    if not error:
+        size_budget = ExtractionBudget(budget.max_bytes, budget.max_files)
+        error = size_budget.check(
+            sum(m["size"] for m in matched), len(matched), archive_size
+        )
+    if error:
+        logger.error(f"Archive {input_file.get('path')} exceeds budget: {error}")
+        raise RuntimeError(f"Archive exceeds extraction budget: {error}")
+
+
+def _export_folder_budget_check(
+    input_path: str, export_folder: str, budget: ExtractionBudget
+) -> Callable[[], str | None]:
+    """Returns a check for _run_monitored that enforces the budget on export_folder."""
+    archive_size = os.path.getsize(input_path)
+    next_check = 0.0
+
+    def check(force: bool = False) -> str | None:
+        nonlocal next_check
+        now = time.monotonic()
+        if now < next_check and not force:
+            return None
+        next_check = now + budget.check_interval
+        total_bytes, files = _folder_usage(export_folder)
+        error = budget.check(total_bytes, files, archive_size)
+        if error:
+            return f"Archive exceeds extraction budget: {error}"
+        return None
+
+    return check
+
+
+def _folder_usage(root: str) -> tuple[int, int]:
+    """Returns the total size and number of non-directory entries below root."""
+    total_bytes = 0
+    files = 0
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    else:
+                        files += 1
+                        total_bytes += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            # Entries can disappear while the extractor is still running.
+            continue
+    return (total_bytes, files)
+
+
+def _matches_file_filter(path: str, file_filter: list[str]) -> bool:
+    """Approximates 7z -r and tar --no-anchored matching of an archive member path."""
+    if path.startswith("./"):
+        path = path[2:]
+    return any(
+        fnmatch.fnmatch(path, pattern)
+        or fnmatch.fnmatch(path, f"*/{pattern}")
+        or fnmatch.fnmatch(os.path.basename(path), pattern)
+        for pattern in file_filter
+    )
+
+
+def _parse_7z_listing(output: str) -> list[dict]:
+    """Parses the technical listing (7z l -slt) of an archive.
+
+    Args:
+      output(string): 7z l -slt output.
+
+    Returns:
+      list: A dict per member with path, size, is_dir and encrypted keys.
+    """
+    members = []
+    parts = re.split(r"^-{10}$", output, maxsplit=1, flags=re.MULTILINE)
+    if len(parts) < 2:
+        return members
+    listing = parts[1]
+    for block in listing.split("\n\n"):
+        properties = {}
+        for line in block.splitlines():
+            key, separator, value = line.partition(" = ")
+            if separator:
+                properties[key.strip()] = value.strip()
+        if "Path" not in properties:
+            continue
+        members.append(
+            {
+                "path": properties["Path"],
+                "size": int(properties.get("Size") or 0),
+                "is_dir": properties.get("Folder") == "+"
+                or properties.get("Attributes", "").startswith("D"),
+                "encrypted": properties.get("Encrypted") == "+",
+            }
+        )
+    return members
+
+
+def _parse_tar_listing(output: str) -> list[dict]:
+    """Parses the verbose listing (tar -tv) of an archive.
+
+    Args:
+      output(string): tar -tv --numeric-owner output.
+
+    Returns:
+      list: A dict per member with path, size, is_dir and encrypted keys.
+    """
+    members = []
+    for line in output.splitlines():
+        fields = line.split(None, 5)
+        if len(fields) < 6:
+            continue
+        mode, _, size, _, _, path = fields
+        if mode.startswith("l"):
+            path = path.split(" -> ", 1)[0]
+        members.append(
+            {
+                "path": path,
+                "size": int(size) if size.isdigit() else 0,
+                "is_dir": mode.startswith("d"),
+                "encrypted": False,
+            }
+        )
+    return members
+
+
+def _zip_password_candidates(
+    input_path: str, member: str, candidates: list[str]
+) -> list[str]:
+    """Drops candidates that fail the ZipCrypto password check of a zip member.
+
+    zipfile verifies the password against the check byte in the encryption header
+    without decompressing any data. Archives or members zipfile can't check, such as
+    AES encrypted zips or non-zip archives, keep all candidates.
+
+    Args:
+      input_path(string): Path to the archive.
+      member(string): Name of an encrypted member.
+      candidates(list): Candidate passwords.
+
+    Returns:
+      list: Candidates that passed the check byte test.
+    """
+    if not zipfile.is_zipfile(input_path):
+        return candidates
+    remaining = []
+    try:
+        with zipfile.ZipFile(input_path) as archive:
+            for candidate in candidates:
+                try:
+                    with archive.open(member, pwd=candidate.encode("utf-8")):
+                        remaining.append(candidate)
+                except RuntimeError:
+                    # Bad password for file
+                    continue
+    except (KeyError, NotImplementedError, zipfile.BadZipFile):
+        return candidates
+    return remaining
+
+
+def _normalize_file_filter(file_filter: list) -> list[str]:
+    """Normalizes and dedupes file filter patterns.
+
+    Surrounding whitespace is stripped, Windows path separators are converted and empty
+    or duplicate patterns are dropped. The original pattern order is kept.
+
+    Args:
+      file_filter(list): List of file patterns.
+
+    Returns:
+      list: Normalized, unique file patterns.
+    """
+    patterns = []
+    for pattern in file_filter or []:
+        pattern = pattern.strip().replace("\\", "/")
+        if pattern:
+            patterns.append(pattern)
+    return list(dict.fromkeys(patterns))
+
+
+def _write_filter_list_file(file_filter: list[str], folder: str) -> str:
+    """Writes file filter patterns to a list file, one pattern per line.
+
+    Args:
+      file_filter(list): Normalized list of file patterns.
+      folder(string): Folder to create the list file in.
+
+    Returns:
+      str: Path to the list file.
+    """
+    fd, list_file = tempfile.mkstemp(suffix=".lst", dir=folder)
+    with os.fdopen(fd, "w", encoding="utf-8") as fh:
+        fh.write("\n".join(file_filter))
+        fh.write("\n")
+    return list_file
+
+
+def _link_tree(source: str, destination: str) -> None:
+    """Recreates a folder tree with hardlinks, copying files across filesystems.
+
+    Args:
+      source(string): Folder to link from.
+      destination(string): Folder to create, must not exist.
+    """
+    os.makedirs(destination)
+    folders = [""]
+    while folders:
+        relative_folder = folders.pop()
+        with os.scandir(os.path.join(source, relative_folder)) as it:
+            entries = list(it)
+        for entry in entries:
+            relative_path = os.path.join(relative_folder, entry.name)
+            target = os.path.join(destination, relative_path)
+            if entry.is_dir(follow_symlinks=False):
+                os.mkdir(target)
+                folders.append(relative_path)
+            elif entry.is_file(follow_symlinks=False):
+                try:
+                    os.link(entry.path, target)
+                except OSError:
+                    shutil.copy2(entry.path, target)
+
+
+def _scan_files(root: str) -> Iterator[tuple[os.DirEntry, str]]:
+    """Yields all regular files below root using os.scandir.
+
+    Symlinks are skipped so extracted archives can't point outside of the export folder.
+
+    Args:
+      root(string): Folder to scan.
+
+    Yields:
+      tuple: os.DirEntry of the file and its path relative to root.
+    """
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        with os.scandir(folder) as it:
+            entries = list(it)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                folders.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield (entry, os.path.relpath(entry.path, root))
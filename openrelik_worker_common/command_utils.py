@@ -0,0 +1,467 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runners for external commands.
+
+mount_utils runs every external command through a CommandRunner, so the device
+orchestration can be tested and benchmarked without root or real block devices:
+
+    ```
+    # Record the commands of a real run ...
+    recorder = RecordingRunner()
+    bd = BlockDevice("/folder/image.dd", runner=recorder)
+    ...
+    recorder.save("image.json")
+
+    # ... and replay them anywhere, at half the recorded latency.
+    bd = BlockDevice("/folder/image.dd", runner=FakeRunner.from_recording("image.json", 0.5))
+    ```
+
+The wall time, exit code and output size of every external command run by
+mount_utils, archive_utils and password_utils are collected by the active
+CommandTimer, so workers can report where a task spent its time:
+
+    ```
+    with CommandTimer() as timer:
+        bd.setup()
+        bd.mount()
+        ...
+    return create_task_result(..., meta={"command_timings": timer.summary()})
+    ```
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FAKE_NOT_FOUND_RETURNCODE = 127
+
+_active_timer = contextvars.ContextVar("command_timer", default=None)
+
+
+class CommandTiming:
+    """Timing of a single external command.
+
+    Only the program name is kept, command arguments can contain passwords.
+
+    Attributes:
+        program (str): name of the program, without a leading sudo.
+        wall_seconds (float): wall time of the command.
+        returncode (int): exit code of the command.
+        output_size (int): size of stdout and stderr.
+    """
+
+    def __init__(
+        self, program: str, wall_seconds: float, returncode: int, output_size: int
+    ):
+        self.program = program
+        self.wall_seconds = wall_seconds
+        self.returncode = returncode
+        self.output_size = output_size
+
+    def to_dict(self) -> dict:
+        return {
+            "program": self.program,
+            "wall_seconds": self.wall_seconds,
+            "returncode": self.returncode,
+            "output_size": self.output_size,
+        }
+
+
+class CommandTimer:
+    """Collects the timings of the external commands run while it is active.
+
+    A timer is active inside its with block, including in asyncio tasks and in
+    threads started with a copy of the context (see submit_with_context). Commands
+    are also recorded by the enclosing timers, if any.
+
+    Attributes:
+        timings (list[CommandTiming]): timings in the order the commands finished.
+    """
+
+    def __init__(self):
+        self.timings = []
+        self._parent = None
+        self._token = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._parent = _active_timer.get()
+        self._token = _active_timer.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active_timer.reset(self._token)
+        self._token = None
+
+    def record(self, timing: CommandTiming):
+        """Adds a command timing to this timer and the enclosing timers."""
+        timer = self
+        while timer:
+            with timer._lock:
+                timer.timings.append(timing)
+            timer = timer._parent
+
+    def summary(self) -> dict:
+        """Returns the timings aggregated per program, e.g. for create_task_result meta.
+
+        Returns:
+            dict: number of commands, total wall time and per program the count,
+                wall time, slowest run, number of failures and output size.
+        """
+        with self._lock:
+            timings = list(self.timings)
+        programs = {}
+        for timing in timings:
+            program = programs.setdefault(
+                timing.program,
+                {
+                    "count": 0,
+                    "wall_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "failures": 0,
+                    "output_size": 0,
+                },
+            )
+            program["count"] += 1
+            program["wall_seconds"] += timing.wall_seconds
+            program["max_seconds"] = max(program["max_seconds"], timing.wall_seconds)
+            program["failures"] += timing.returncode != 0
+            program["output_size"] += timing.output_size
+        for program in programs.values():
+            program["wall_seconds"] = round(program["wall_seconds"], 6)
+            program["max_seconds"] = round(program["max_seconds"], 6)
+        return {
+            "commands": len(timings),
+            "wall_seconds": round(sum(t.wall_seconds for t in timings), 6),
+            "programs": programs,
+        }
+
+
+def record_command(
+    command: list, wall_seconds: float, returncode: int, output_size: int = 0
+):
+    """Records the timing of an external command with the active CommandTimer.
+
+    Args:
+        command (list): command and arguments.
+        wall_seconds (float): wall time of the command.
+        returncode (int): exit code of the command.
+        output_size (int): size of stdout and stderr.
+    """
+    program = command[1] if command[0] == "sudo" and len(command) > 1 else command[0]
+    program = os.path.basename(program)
+    logger.debug(
+        f"{program} exited with {returncode} after {wall_seconds:.3f}s, "
+        f"{output_size} bytes of output"
+    )
+    timer = _active_timer.get()
+    if timer:
+        timer.record(CommandTiming(program, wall_seconds, returncode, output_size))
+
+
+def submit_with_context(executor, fn, *args):
+    """Submits fn to an executor, running it in a copy of the current context.
+
+    Worker threads don't inherit context variables, without the copy the commands
+    they run are missing from the active CommandTimer.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+class CommandRunner(ABC):
+    """Interface for running external commands.
+
+    Runners return a subprocess.CompletedProcess with text stdout and stderr and never
+    raise on a non-zero exit code, callers check returncode.
+    """
+
+    @abstractmethod
+    def run(self, command: list) -> subprocess.CompletedProcess:
+        """Runs a command and waits for it to finish.
+
+        Args:
+            command (list): command and arguments.
+
+        Returns:
+            subprocess.CompletedProcess: return code and output of the command.
+        """
+
+    async def run_async(self, command: list) -> subprocess.CompletedProcess:
+        """Runs a command without blocking the event loop.
+
+        The default implementation runs self.run in a worker thread.
+
+        Args:
+            command (list): command and arguments.
+
+        Returns:
+            subprocess.CompletedProcess: return code and output of the command.
+        """
+        return await asyncio.to_thread(self.run, command)
+
+
+class SubprocessRunner(CommandRunner):
+    """Runs commands on the host with subprocess and asyncio subprocesses.
+
+    Every command is recorded with record_command.
+    """
+
+    def run(self, command: list) -> subprocess.CompletedProcess:
+        start = time.perf_counter()
+        process = subprocess.run(command, capture_output=True, check=False, text=True)
+        record_command(
+            command,
+            time.perf_counter() - start,
+            process.returncode,
+            len(process.stdout or "") + len(process.stderr or ""),
+        )
+        return process
+
+    async def run_async(self, command: list) -> subprocess.CompletedProcess:
+        start = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        record_command(
+            command,
+            time.perf_counter() - start,
+            process.returncode,
+            len(stdout) + len(stderr),
+        )
+        return subprocess.CompletedProcess(
+            command,
+            process.returncode,
+            stdout.decode(errors="replace"),
+            stderr.decode(errors="replace"),
+        )
+
+
+class RecordingRunner(CommandRunner):
+    """Records the commands, results and latencies of another runner.
+
+    Attributes:
+        runner (CommandRunner): runner executing the commands.
+        recording (list[dict]): command, returncode, stdout, stderr and latency of
+            every command in the order they finished.
+    """
+
+    def __init__(self, runner: CommandRunner | None = None):
+        """Initialize RecordingRunner class instance.
+
+        Args:
+            runner (CommandRunner): runner to record, default SubprocessRunner.
+        """
+        self.runner = runner or SubprocessRunner()
+        self.recording = []
+        self._lock = threading.Lock()
+
+    def run(self, command: list) -> subprocess.CompletedProcess:
+        start = time.perf_counter()
+        process = self.runner.run(command)
+        self._record(command, process, time.perf_counter() - start)
+        return process
+
+    async def run_async(self, command: list) -> subprocess.CompletedProcess:
+        start = time.perf_counter()
+        process = await self.runner.run_async(command)
+        self._record(command, process, time.perf_counter() - start)
+        return process
+
+    def _record(self, command: list, process: subprocess.CompletedProcess, latency):
+        with self._lock:
+            self.recording.append(
+                {
+                    "command": list(command),
+                    "returncode": process.returncode,
+                    "stdout": process.stdout,
+                    "stderr": process.stderr,
+                    "latency": latency,
+                }
+            )
+
+    def save(self, path: str):
+        """Writes the recording to a JSON file readable by FakeRunner.from_recording.
+
+        Args:
+            path (str): path of the JSON file.
+        """
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump({"commands": self.recording}, fh, indent=2)
+
+
+class FakeRunner(CommandRunner):
+    """Answers commands with canned responses and simulated latencies.
+
+    Commands are answered by, in order:
+    * recorded responses of the exact same command, replayed in recorded order. The
+      last recorded response is repeated once the others are used up.
+    * the response added for the longest matching command prefix.
+    Commands without a response fail with return code 127.
+
+    Attributes:
+        commands (list[list]): every command run, in call order.
+        simulated_seconds (float): total latency simulated so far.
+    """
+
+    def __init__(self, latency_scale: float = 1.0):
+        """Initialize FakeRunner class instance.
+
+        Args:
+            latency_scale (float): factor applied to every latency, 0 disables sleeping.
+        """
+        self.latency_scale = latency_scale
+        self.commands = []
+        self.simulated_seconds = 0.0
+        self._recorded = {}
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_recording(cls, path: str, latency_scale: float = 1.0):
+        """Creates a FakeRunner replaying a recording written by RecordingRunner.save.
+
+        Commands that differ from the recording only in their arguments, e.g. mount
+        with a new random mount folder, get the last recorded response of the same
+        program.
+
+        Args:
+            path (str): path of the JSON recording.
+            latency_scale (float): factor applied to the recorded latencies.
+
+        Returns:
+            FakeRunner: runner replaying the recording.
+        """
+        with open(path, encoding="utf-8") as fh:
+            recording = json.load(fh)
+        runner = cls(latency_scale)
+        for entry in recording["commands"]:
+            runner.record(**entry)
+            runner.add(
+                entry["command"][:2],
+                returncode=entry["returncode"],
+                stdout=entry["stdout"],
+                stderr=entry["stderr"],
+                latency=entry["latency"],
+            )
+        return runner
+
+    def record(
+        self,
+        command: list,
+        returncode: int = 0,
+        stdout: str = "",
+        stderr: str = "",
+        latency: float = 0.0,
+    ):
+        """Queues a response for one exact command.
+
+        Args:
+            command (list): command and arguments.
+            returncode (int): exit code to return.
+            stdout (str): standard output to return.
+            stderr (str): standard error to return.
+            latency (float): seconds the command takes.
+        """
+        responses = self._recorded.setdefault(tuple(command), deque())
+        responses.append((returncode, stdout, stderr, latency))
+
+    def add(
+        self,
+        prefix: list,
+        returncode: int = 0,
+        stdout: str = "",
+        stderr: str = "",
+        latency: float = 0.0,
+        handler=None,
+    ):
+        """Sets the response for all commands starting with prefix.
+
+        Args:
+            prefix (list): leading command arguments to match, e.g. ["sudo", "mount"].
+            returncode (int): exit code to return.
+            stdout (str): standard output to return.
+            stderr (str): standard error to return.
+            latency (float): seconds the command takes.
+            handler (callable): optional, called with the command and returning a
+                (returncode, stdout, stderr) tuple instead of the fixed values.
+        """
+        self._responses[tuple(prefix)] = (returncode, stdout, stderr, latency, handler)
+
+    def run(self, command: list) -> subprocess.CompletedProcess:
+        start = time.perf_counter()
+        process, latency = self._respond(command)
+        if latency:
+            time.sleep(latency)
+        self._record(process, time.perf_counter() - start)
+        return process
+
+    async def run_async(self, command: list) -> subprocess.CompletedProcess:
+        start = time.perf_counter()
+        process, latency = self._respond(command)
+        if latency:
+            await asyncio.sleep(latency)
+        self._record(process, time.perf_counter() - start)
+        return process
+
+    @staticmethod
+    def _record(process: subprocess.CompletedProcess, wall_seconds: float):
+        """Records a fake command like SubprocessRunner does."""
+        record_command(
+            process.args,
+            wall_seconds,
+            process.returncode,
+            len(process.stdout) + len(process.stderr),
+        )
+
+    def _respond(self, command: list) -> tuple:
+        """Looks up the response of a command.
+
+        Returns:
+            tuple: the subprocess.CompletedProcess and the scaled latency.
+        """
+        with self._lock:
+            self.commands.append(list(command))
+            recorded = self._recorded.get(tuple(command))
+            if recorded:
+                returncode, stdout, stderr, latency = (
+                    recorded.popleft() if len(recorded) > 1 else recorded[0]
+                )
+            else:
+                returncode, stdout, stderr, latency = self._prefix_response(command)
+            latency *= self.latency_scale
+            self.simulated_seconds += latency
+        return subprocess.CompletedProcess(command, returncode, stdout, stderr), latency
+
+    def _prefix_response(self, command: list) -> tuple:
+        """Returns the response added for the longest prefix of command."""
+        for length in range(len(command), -1, -1):
+            response = self._responses.get(tuple(command[:length]))
+            if response:
+                returncode, stdout, stderr, latency, handler = response
+                if handler:
+                    returncode, stdout, stderr = handler(command)
+                return returncode, stdout, stderr, latency
+        logger.warning(f"No fake response for command: {command}")
+        return FAKE_NOT_FOUND_RETURNCODE, "", f"{command[0]}: command not found", 0.0
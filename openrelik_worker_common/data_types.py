@@ -27,3 +27,4 @@ class DataType(StrEnum):
     DISKIMAGE_QCOW = "diskimage:qcow"
     DISKIMAGE_RAW = "diskimage:raw"
     BINARY = "binary"
+    MANIFEST_SQLITE = "manifest:sqlite"
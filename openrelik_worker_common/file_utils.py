@@ -12,13 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import errno
+import fnmatch
+import logging
 import os
+import shutil
 import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PurePath
-from typing import Optional
+from typing import Iterator, Optional
 from uuid import uuid4
 
+logger = logging.getLogger(__name__)
+
+EXPORT_WORKERS = 8
+# copy_file_range errors meaning "not supported here", e.g. across file systems.
+COPY_FILE_RANGE_FALLBACK_ERRORS = (
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.EINVAL,
+    errno.EBADF,
+)
+
 
 class OutputFile:
     """Represents an output file.
@@ -31,6 +48,8 @@ class OutputFile:
         path: The full path to the file.
         original_path: The full original path to the file.
         source_file_id: The OutputFile this file belongs to.
+        size: Size of the file in bytes, if known (not serialized).
+        digest: Hex digest of the file content, if computed (not serialized).
     """
 
     def __init__(
@@ -61,6 +80,8 @@ class OutputFile:
         self.path = output_path
         self.original_path = original_path
         self.source_file_id = source_file_id
+        self.size = None
+        self.digest = None
 
     def to_dict(self) -> dict:
         """
@@ -226,7 +247,18 @@ def is_disk_image(inputfile: dict) -> bool:
     Returns: bool
     Raises: RuntimeError
     """
-    disk_image_extensions = [".img", ".raw", ".dd", ".qcow3", ".qcow2", ".qcow"]
+    disk_image_extensions = [
+        ".img",
+        ".raw",
+        ".dd",
+        ".qcow3",
+        ".qcow2",
+        ".qcow",
+        ".vmdk",
+        ".vhd",
+        ".vhdx",
+        ".vdi",
+    ]
 
     if "display_name" not in inputfile:
         raise RuntimeError("inputfile parameter malformed, no display_name found")
@@ -239,3 +271,175 @@ def is_disk_image(inputfile: dict) -> bool:
         return True
 
     return False
+
+
+def export_files(
+    mountpoint: str,
+    patterns: list[str],
+    output_path: str,
+    max_workers: int = EXPORT_WORKERS,
+    data_type: Optional[str] = None,
+    source_file_id: Optional[OutputFile] = None,
+) -> list[OutputFile]:
+    """Copies files matching paths or glob patterns from a mountpoint into outputs.
+
+    Files are copied concurrently in kernel space with os.copy_file_range, falling
+    back to shutil.copyfile (sendfile or a buffered copy) where that is not
+    supported. Only regular files are exported, symlinks are never followed so a
+    mounted image can not point the export outside of the mountpoint.
+
+    Args:
+        mountpoint: Root of the mounted partition, e.g. from BlockDevice.mount().
+        patterns: Paths or glob patterns relative to the mountpoint, "**" matches
+            any number of folders, e.g. ["/etc/passwd", "/var/log/**/*.log"].
+        output_path: The path to the output directory.
+        max_workers: Number of concurrent copies.
+        data_type: The data type of the output files (optional).
+        source_file_id: The OutputFile these files belong to (optional).
+
+    Returns:
+        OutputFiles ordered by original_path, with original_path relative to the
+        mountpoint and size set. Files that could not be copied are logged and skipped.
+    """
+    mountpoint = os.path.realpath(mountpoint)
+    sources = set()
+    for pattern in patterns:
+        for path in _match_files(mountpoint, pattern):
+            if Path(path).is_symlink() or not Path(path).is_file():
+                continue
+            if os.path.realpath(path).startswith(f"{mountpoint}{os.sep}"):
+                sources.add(path)
+
+    output_files = []
+    for source in sorted(sources):
+        relative_path = os.path.relpath(source, mountpoint)
+        output_files.append(
+            create_output_file(
+                output_path,
+                display_name=os.path.basename(source),
+                data_type=data_type,
+                original_path=f"/{relative_path}",
+                source_file_id=source_file_id,
+            )
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            _copy_file,
+            [os.path.join(mountpoint, file.original_path[1:]) for file in output_files],
+            [file.path for file in output_files],
+        )
+        exported = []
+        for output_file, size in zip(output_files, results):
+            if size is not None:
+                output_file.size = size
+                exported.append(output_file)
+
+    logger.info(f"Exported {len(exported)} files from {mountpoint}")
+    return exported
+
+
+def _match_files(mountpoint: str, pattern: str) -> Iterator[str]:
+    """Yields the paths below mountpoint matching a glob pattern.
+
+    The tree is walked with os.walk without following symlinks, so symlink loops or
+    absolute symlinks in a mounted image never make the walk leave the image. Like
+    glob, wildcards don't match names starting with a dot.
+
+    Args:
+        mountpoint: Real path of the mountpoint.
+        pattern: Path or glob pattern relative to the mountpoint.
+
+    Yields:
+        Paths of the matching files, including symlinks to files.
+    """
+    parts = [part for part in pattern.split("/") if part not in ("", ".")]
+    if not parts or ".." in parts:
+        return
+    # Walk from the longest folder prefix without wildcards.
+    static = []
+    for part in parts[:-1]:
+        if _has_wildcard(part):
+            break
+        static.append(part)
+    root = os.path.join(mountpoint, *static)
+    if os.path.realpath(root) != root:
+        # A folder of the prefix is a symlink.
+        return
+    parts = parts[len(static) :]
+    if not any(_has_wildcard(part) for part in parts):
+        path = os.path.join(root, *parts)
+        if os.path.lexists(path):
+            yield path
+        return
+
+    max_depth = None if "**" in parts else len(parts)
+    for folder, folders, files in os.walk(root):
+        relative = os.path.relpath(folder, root)
+        names = [] if relative == "." else relative.split(os.sep)
+        if max_depth is not None and len(names) + 1 >= max_depth:
+            folders.clear()
+        for name in files:
+            if _match_parts(names + [name], parts):
+                yield os.path.join(folder, name)
+
+
+def _has_wildcard(part: str) -> bool:
+    """Returns whether a pattern component contains glob wildcards."""
+    return any(char in part for char in "*?[")
+
+
+def _match_parts(names: list[str], parts: list[str]) -> bool:
+    """Matches path components against pattern components, "**" matches any number."""
+    if not parts:
+        return not names
+    if parts[0] == "**":
+        for index in range(len(names) + 1):
+            if _match_parts(names[index:], parts[1:]):
+                return True
+            if index < len(names) and names[index].startswith("."):
+                return False
+        return False
+    if not names:
+        return False
+    if names[0].startswith(".") and not parts[0].startswith("."):
+        if _has_wildcard(parts[0]):
+            return False
+    return fnmatch.fnmatchcase(names[0], parts[0]) and _match_parts(
+        names[1:], parts[1:]
+    )
+
+
+def _copy_file(source: str, destination: str) -> int | None:
+    """Copies a file with copy_file_range, falling back to shutil.copyfile.
+
+    Args:
+        source: Path of the file to copy.
+        destination: Path to copy the file to.
+
+    Returns:
+        The number of bytes copied, None if the copy failed.
+    """
+    try:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            size = os.fstat(src.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    written = os.copy_file_range(
+                        src.fileno(), dst.fileno(), size - copied
+                    )
+                    if not written:
+                        break
+                    copied += written
+                return copied
+            except OSError as e:
+                if e.errno not in COPY_FILE_RANGE_FALLBACK_ERRORS:
+                    raise
+        shutil.copyfile(source, destination)
+        return os.path.getsize(destination)
+    except OSError as e:
+        logger.warning(f"Error exporting {source}: {e}")
+        if os.path.exists(destination):
+            os.remove(destination)
+        return None
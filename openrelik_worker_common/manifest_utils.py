@@ -0,0 +1,195 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""File manifests of mounted file systems.
+
+A manifest is a SQLite database listing every file and folder below one or more
+mountpoints, so workers can find files without walking the mountpoints again:
+
+    ```
+    manifest, entries = manifest_utils.build_manifest(bd.mountpoints, output_path)
+    for row in manifest_utils.glob_manifest(manifest.path, "/Windows/System32/config/*"):
+        print(row["mountpoint"], row["path"], row["size"])
+    ```
+
+Schema:
+    mountpoints(id INTEGER PRIMARY KEY, path TEXT)
+    files(mountpoint_id INTEGER, path TEXT, size INTEGER, mtime_ns INTEGER,
+          inode INTEGER, mode INTEGER)
+
+files.path is relative to the mountpoint and starts with "/".
+"""
+
+import logging
+import os
+import sqlite3
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .data_types import DataType
+from .file_utils import OutputFile, create_output_file
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_WORKERS = 8
+MANIFEST_SCHEMA = """
+CREATE TABLE mountpoints (id INTEGER PRIMARY KEY, path TEXT NOT NULL);
+CREATE TABLE files (
+    mountpoint_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    mode INTEGER NOT NULL
+);
+"""
+MANIFEST_INDEXES = "CREATE INDEX files_path ON files (path);"
+
+
+def build_manifest(
+    mountpoints: list[str],
+    output_path: str,
+    display_name: str = "manifest",
+    max_workers: int = MANIFEST_WORKERS,
+    source_file_id: OutputFile | None = None,
+) -> tuple[OutputFile, int]:
+    """Walks mountpoints once with parallel os.scandir workers and writes a manifest.
+
+    Folders are scanned concurrently, the rows are written to SQLite by the calling
+    thread. Symlinks are recorded but not followed. Folders that can not be read are
+    logged and skipped.
+
+    Args:
+        mountpoints (list): paths to index, e.g. BlockDevice.mountpoints.
+        output_path (str): OpenRelik output_path.
+        display_name (str): display name of the manifest, default "manifest".
+        max_workers (int): number of concurrent scandir workers.
+        source_file_id (OutputFile): The OutputFile this manifest belongs to (optional).
+
+    Returns:
+        output_file(OutputFile): the manifest with data_type
+            DataType.MANIFEST_SQLITE and size set to its size in bytes.
+        entries(int): number of indexed files and folders.
+    """
+    output_file = create_output_file(
+        output_path,
+        display_name=display_name,
+        extension="sqlite",
+        data_type=DataType.MANIFEST_SQLITE,
+        source_file_id=source_file_id,
+    )
+    connection = sqlite3.connect(output_file.path)
+    try:
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.executescript(MANIFEST_SCHEMA)
+        connection.executemany(
+            "INSERT INTO mountpoints (id, path) VALUES (?, ?)",
+            enumerate(mountpoints),
+        )
+
+        entries = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {
+                executor.submit(_scan_folder, mountpoint_id, mountpoint, "")
+                for mountpoint_id, mountpoint in enumerate(mountpoints)
+            }
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    mountpoint_id, rows, folders = future.result()
+                    connection.executemany(
+                        "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", rows
+                    )
+                    entries += len(rows)
+                    mountpoint = mountpoints[mountpoint_id]
+                    pending.update(
+                        executor.submit(_scan_folder, mountpoint_id, mountpoint, folder)
+                        for folder in folders
+                    )
+
+        connection.execute(MANIFEST_INDEXES)
+        connection.commit()
+    finally:
+        connection.close()
+
+    logger.info(f"Indexed {entries} entries of {mountpoints} in {output_file.path}")
+    output_file.size = os.path.getsize(output_file.path)
+    return (output_file, entries)
+
+
+def _scan_folder(mountpoint_id: int, mountpoint: str, folder: str) -> tuple:
+    """Scans a single folder of a mountpoint.
+
+    Args:
+        mountpoint_id (int): id of the mountpoint in the manifest.
+        mountpoint (str): path of the mountpoint.
+        folder (str): folder relative to the mountpoint, "" for the mountpoint itself.
+
+    Returns:
+        tuple: mountpoint_id, manifest rows and the relative paths of sub folders.
+    """
+    rows = []
+    folders = []
+    try:
+        with os.scandir(os.path.join(mountpoint, folder.lstrip("/"))) as entries:
+            for entry in entries:
+                path = f"{folder}/{entry.name}"
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(path)
+                except OSError as e:
+                    logger.warning(f"Error reading {entry.path}: {e}")
+                    continue
+                rows.append(
+                    (
+                        mountpoint_id,
+                        path,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        stat.st_ino,
+                        stat.st_mode,
+                    )
+                )
+    except OSError as e:
+        logger.warning(f"Error scanning {mountpoint}{folder}: {e}")
+    return mountpoint_id, rows, folders
+
+
+def glob_manifest(manifest_path: str, pattern: str) -> list[dict]:
+    """Returns the manifest entries with a path matching a glob pattern.
+
+    Patterns use SQLite GLOB syntax and are case sensitive. Unlike shell globs, "*"
+    also matches "/". For other queries open the manifest with sqlite3.
+
+    Args:
+        manifest_path (str): path to a manifest written by build_manifest.
+        pattern (str): glob pattern matched against the path relative to the mountpoint.
+
+    Returns:
+        list[dict]: entries with mountpoint, path, size, mtime_ns, inode and mode.
+    """
+    connection = sqlite3.connect(f"file:{manifest_path}?mode=ro", uri=True)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            "SELECT mountpoints.path AS mountpoint, files.path, size, mtime_ns, "
+            "inode, mode FROM files JOIN mountpoints "
+            "ON files.mountpoint_id = mountpoints.id "
+            "WHERE files.path GLOB ? ORDER BY files.mountpoint_id, files.path",
+            (pattern,),
+        )
+        return [dict(row) for row in rows]
+    finally:
+        connection.close()
@@ -12,21 +12,167 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import fcntl
+import glob
+import hashlib
 import json
 import logging
 import os
 import pathlib
 import redis
+import redis.asyncio
 import shutil
 import socket
 import subprocess
+import tempfile
+import threading
 import time
+import weakref
 
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
 
+from .command_utils import CommandRunner, SubprocessRunner, submit_with_context
+from .redis_utils import get_async_redis_client, get_redis_client
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Allocates the first free NBD slot in a single round trip.
+# KEYS: one lock key per NBD device, followed by the waiter queue key.
+# ARGV: lock token, lock TTL in ms, waiter id ("" if not queued), waiter key prefix,
+# comma separated indexes of slots still attached to a qemu-nbd process, e.g. ",0,3,".
+# Returns the slot index, -1 if all slots are locked or -2 if another waiter is
+# ahead in the queue.
+NBD_ALLOCATE_SCRIPT = """
+local queue = KEYS[#KEYS]
+while true do
+    local head = redis.call('lindex', queue, 0)
+    if not head or redis.call('exists', ARGV[4] .. head) == 1 then
+        break
+    end
+    redis.call('lpop', queue)
+end
+local head = redis.call('lindex', queue, 0)
+if head and head ~= ARGV[3] then
+    return -2
+end
+for i = 1, #KEYS - 1 do
+    if not string.find(ARGV[5], ',' .. (i - 1) .. ',', 1, true)
+            and redis.call('set', KEYS[i], ARGV[1], 'NX', 'PX', ARGV[2]) then
+        if head then
+            redis.call('lpop', queue)
+        end
+        return i - 1
+    end
+end
+return -1
+"""
+
+
+# Node-local registry of devices and mounts, used to reap them after a crash. In a
+# container, point OPENRELIK_DEVICE_REGISTRY_DIR to a host path shared by the
+# containers of a node.
+DEVICE_REGISTRY_DIR = os.path.join(tempfile.gettempdir(), "openrelik-block-devices")
+
+
+# Mount drivers per file system type in order of preference, with their options.
+# ntfs3 is the in-kernel NTFS driver, several times faster than the ntfs-3g FUSE
+# driver. All options keep the mount read-only and skip journal replay and atime
+# updates. File system types not listed are mounted with MOUNT_DRIVERS_DEFAULT.
+MOUNT_DRIVERS = {
+    "ntfs": [("ntfs3", "ro,noatime"), ("ntfs-3g", "ro,noatime")],
+    "xfs": [("xfs", "ro,noatime,norecovery")],
+    "ext4": [("ext4", "ro,noatime,noload")],
+    "ext3": [("ext4", "ro,noatime,noload"), ("ext3", "ro,noatime,noload")],
+    "ext2": [("ext4", "ro,noatime"), ("ext2", "ro,noatime")],
+    "vfat": [("vfat", "ro,noatime")],
+    "exfat": [("exfat", "ro,noatime")],
+}
+MOUNT_DRIVERS_DEFAULT = [(None, "ro")]
+KERNEL_MOUNT_DRIVERS = {"ntfs3", "xfs", "ext4", "ext3", "ext2", "vfat", "exfat"}
+FUSE_MOUNT_HELPERS = {"ntfs-3g": "mount.ntfs-3g"}
+PROC_FILESYSTEMS_PATH = "/proc/filesystems"
+MODULES_PATH = "/lib/modules"
+
+
+# Image formats attached with qemu-nbd, by file extension.
+NBD_IMAGE_FORMATS = {
+    "qcow3": "qcow2",
+    "qcow2": "qcow2",
+    "qcow": "qcow",
+    "vmdk": "vmdk",
+    "vhd": "vpc",
+    "vhdx": "vhdx",
+    "vdi": "vdi",
+}
+# qemu-nbd image formats by header magic, as (offset, magic, format). A VHD starts
+# with a copy of its footer, except fixed size VHDs which only have the footer.
+IMAGE_FORMAT_MAGICS = [
+    (0, b"QFI\xfb\x00\x00\x00\x01", "qcow"),
+    (0, b"QFI\xfb", "qcow2"),
+    (0, b"KDMV", "vmdk"),
+    (0, b"COWD", "vmdk"),
+    (0, b"# Disk DescriptorFile", "vmdk"),
+    (0, b"vhdxfile", "vhdx"),
+    (0, b"conectix", "vpc"),
+    (64, b"\x7f\x10\xda\xbe", "vdi"),
+]
+VHD_FOOTER_SIZE = 512
+
+
+def detect_image_format(
+    image_path: str, extensions: dict = NBD_IMAGE_FORMATS
+) -> str | None:
+    """Detects the qemu-nbd format of a disk image by header magic, then by extension.
+
+    Args:
+        image_path (str): path to the disk image.
+        extensions (dict): qemu-nbd format by file extension.
+
+    Returns:
+        str: qemu-nbd format, e.g. "vmdk", or None for raw images.
+    """
+    try:
+        with open(image_path, "rb") as fh:
+            header = fh.read(128)
+            fh.seek(0, os.SEEK_END)
+            if fh.tell() >= VHD_FOOTER_SIZE:
+                fh.seek(-VHD_FOOTER_SIZE, os.SEEK_END)
+                footer = fh.read(8)
+            else:
+                footer = b""
+    except OSError:
+        header = footer = b""
+
+    for offset, magic, image_format in IMAGE_FORMAT_MAGICS:
+        if header[offset : offset + len(magic)] == magic:
+            return image_format
+    if footer == b"conectix":
+        return "vpc"
+    return extensions.get(pathlib.Path(image_path).suffix.strip(".").lower())
+
+
+def select_mount_drivers(fstype: str, available: set) -> list:
+    """Selects the mount drivers and options to try for a file system type.
+
+    Args:
+        fstype (str): file system type reported by blkid.
+        available (set): mount drivers available on the host.
+
+    Returns:
+        list: (driver, options) tuples in order of preference. The driver is None to
+            let mount detect it. If none of the drivers of a type is available they
+            are all returned, so mount reports the error.
+    """
+    candidates = MOUNT_DRIVERS.get(fstype)
+    if not candidates:
+        return list(MOUNT_DRIVERS_DEFAULT)
+    return [candidate for candidate in candidates if candidate[0] in available] or list(
+        candidates
+    )
+
 
 class BlockDevice:
     """BlockDevice provides functionality to map a disk image file to block devices
@@ -51,14 +197,25 @@ class BlockDevice:
 
     MIN_PARTITION_SIZE_BYTES = 100 * 1024 * 1024  #: Default 100 MB
     MAX_NBD_DEVICES = 10  #: Default 10
-    LOCK_TIMEOUT_SECONDS = 6 * 60 * 60  #: Default 6 hours
+    LOCK_TIMEOUT_SECONDS = 6 * 60 * 60  #: Default 6 hours, max NBD lease lifetime
+    LEASE_TTL_SECONDS = 30  #: Default 30 seconds
+    LEASE_RENEW_INTERVAL_SECONDS = 10  #: Default 10 seconds
     MAX_MOUNTPATH_SIZE = 500  #: Default 500
+    MAX_MOUNT_WORKERS = 4  #: Default 4
+    DEVICE_READY_TIMEOUT_SECONDS = 10  #: Default 10 seconds
+    SYSFS_BLOCK_PATH = "/sys/block"
+    NBD_WAITER_TTL_MS = 5000  #: Default 5 seconds
+    NBD_WAIT_MIN_DELAY_SECONDS = 0.05
+    NBD_WAIT_MAX_DELAY_SECONDS = 1.0
+    REQUIRED_MODULES = ["nbd"]
 
     def __init__(
         self,
         image_path: str,
         min_partition_size: int = MIN_PARTITION_SIZE_BYTES,
         max_mountpath_size: int = MAX_MOUNTPATH_SIZE,
+        nbd_wait_timeout: float | None = None,
+        runner: CommandRunner | None = None,
     ):
         """Initialize BlockDevice class instance.
 
@@ -66,21 +223,40 @@ class BlockDevice:
             image_path (str): path to the image file to map and mount.
             min_partition_size (int): minimum partition size, default MIN_PARTITION_SIZE_BYTES
             max_mountpath_size (int): maximum root mount path length, default MAX_MOUNTPATH_SIZE
+            nbd_wait_timeout (float): seconds to queue for a free NBD device when all are
+                locked, default None (fail immediately)
+            runner (CommandRunner): runs the external commands, default SubprocessRunner
         """
         self.image_path = image_path
+        self.runner = runner or SubprocessRunner()
         self.min_partition_size = min_partition_size
         self.blkdevice = None
         self.blkdeviceinfo = None
         self.partitions = []
+        self.fstypes = {}
         self.mountpoints = []
+        self.partition_mountpoints = {}
+        self.mount_failures = {}
+        self.mount_drivers = {}
+        self._mount_drivers_available = None
         self.mountroot = "/mnt"
         self.max_mountpath_size = max_mountpath_size
+        self.nbd_wait_timeout = nbd_wait_timeout
         self.supported_fstypes = ["dos", "xfs", "ext2", "ext3", "ext4", "ntfs", "vfat"]
-        self.supported_qcowtypes = ["qcow3", "qcow2", "qcow"]
+        # qemu-nbd format by file extension, used when no header magic matches.
+        self.supported_nbdtypes = dict(NBD_IMAGE_FORMATS)
+        self.image_format = None
 
         self.REDIS_URL = os.getenv("REDIS_URL") or "redis://localhost:6379/0"
         self.redis_client = None
         self.redis_lock = None
+        self.lease_lost = False
+        self._lease_stop = None
+        self._lease_thread = None
+        self.device_wait_seconds = 0.0
+        self.registry_dir = os.getenv(
+            "OPENRELIK_DEVICE_REGISTRY_DIR", DEVICE_REGISTRY_DIR
+        )
 
     def setup(self):
         """Setup BlockDevice instance
@@ -89,36 +265,50 @@ class BlockDevice:
         block device (loop or nbd) depending on image format and scan the paritions available.
         """
 
-        # Log minimum partitions size
-        logger.info(
-            f"Minimum partition size {self.min_partition_size} Bytes, partitions smaller will be ignored!"
-        )
-
-        # Check if image_path exists
-        image_path = pathlib.Path(self.image_path)
-        if not pathlib.Path.exists(image_path):
-            raise RuntimeError(f"image_path does not exist: {self.image_path}")
-
-        # Check if required tools are available
-        self._required_tools_available()
+        # Check the image and the required tools
+        self._check_setup()
 
         # Check the required kernel modules are available
         self._required_modules_loaded()
 
         # Setup the block device
-        ext = image_path.suffix.strip(".")
-        if ext.lower() in self.supported_qcowtypes:
-            self.redis_client = redis.Redis.from_url(self.REDIS_URL)
+        self.image_format = detect_image_format(
+            self.image_path, self.supported_nbdtypes
+        )
+        if self.image_format:
+            self.redis_client = get_redis_client(self.REDIS_URL)
             self.blkdevice = self._nbdsetup()
         else:
             self.blkdevice = self._losetup()
 
+        # Record the device so it can be reaped if this process dies
+        self._write_registry_record()
+
         # Parse block device info
         self.blkdeviceinfo = self._blkinfo()
 
         # Parse partition information
         self.partitions = self._parse_partitions()
 
+    def _check_setup(self):
+        """Logs the minimum partition size and checks the image and required tools.
+
+        Raises:
+            RuntimeError: if the image or a required tool is missing.
+        """
+        # Log minimum partitions size
+        logger.info(
+            f"Minimum partition size {self.min_partition_size} Bytes, partitions smaller will be ignored!"
+        )
+
+        # Check if image_path exists
+        image_path = pathlib.Path(self.image_path)
+        if not pathlib.Path.exists(image_path):
+            raise RuntimeError(f"image_path does not exist: {self.image_path}")
+
+        # Check if required tools are available
+        self._required_tools_available()
+
     def _losetup(self) -> str:
         """Map image file to loopback device using losetup.
 
@@ -128,7 +318,19 @@ class BlockDevice:
         Raises:
             RuntimeError: if there was an error running losetup.
         """
-        losetup_command = [
+        process = self.runner.run(self._losetup_command())
+        blkdevice = self._losetup_result(process)
+
+        # Wait for the partition device nodes created by --partscan
+        self._wait_for_device(
+            lambda: self._partitions_ready(blkdevice), f"{blkdevice} partitions"
+        )
+
+        return blkdevice
+
+    def _losetup_command(self) -> list:
+        """Returns the losetup command mapping the image to a loop device."""
+        return [
             "sudo",
             "losetup",
             "--find",
@@ -138,18 +340,19 @@ class BlockDevice:
             self.image_path,
         ]
 
-        process = subprocess.run(
-            losetup_command, capture_output=True, check=False, text=True
-        )
-        if process.returncode == 0:
-            blkdevice = process.stdout.strip()
-            logger.info(f"losetup: success creating {blkdevice} for {self.image_path}")
-        else:
+    def _losetup_result(self, process: subprocess.CompletedProcess) -> str:
+        """Returns the loop device created by losetup.
+
+        Raises:
+            RuntimeError: if losetup failed.
+        """
+        if process.returncode != 0:
             logger.error(
                 f"losetup: failed creating blockdevice for {self.image_path}: {process.stderr} {process.stdout}"
             )
             raise RuntimeError(f"Error: {process.stderr} {process.stdout}")
-
+        blkdevice = process.stdout.strip()
+        logger.info(f"losetup: success creating {blkdevice} for {self.image_path}")
         return blkdevice
 
     def _get_hostname(self):
@@ -173,31 +376,289 @@ class BlockDevice:
         NODENAME on container startup to the name of the host the container runtime engine is running on.
         For k8s that is the Node and for Docker that is the actual host the docker engine runs on.
 
+        The free slot is found and locked server side by NBD_ALLOCATE_SCRIPT in a single round
+        trip. If nbd_wait_timeout is set, the worker queues for a slot instead of failing.
+
         Returns:
             str: NBD device name
 
         Raises:
             RuntimeError: if no free nbd device was found.
         """
+        devnames, keys, waiter_prefix = self._nbd_slots()
+        token = uuid4().hex.encode()
+        allocate = self.redis_client.register_script(NBD_ALLOCATE_SCRIPT)
+        args = [token, int(self.LEASE_TTL_SECONDS * 1000)]
+
+        if self.nbd_wait_timeout is None:
+            attached = self._attached_nbd_slots(devnames)
+            index = allocate(keys=keys, args=args + ["", waiter_prefix, attached])
+        else:
+            index = self._wait_for_nbd_slot(
+                allocate, keys, args, waiter_prefix, devnames
+            )
+
+        devname = self._take_nbd_slot(index, devnames, keys, token)
+        self._start_lease_heartbeat()
+        return devname
+
+    def _nbd_slots(self) -> tuple:
+        """Returns the NBD device names, their lock keys and the waiter key prefix.
+
+        Returns:
+            tuple: device names, lock keys followed by the waiter queue key, and the
+                key prefix for the waiter alive keys.
+        """
         hostname = self._get_hostname()
-        for device_number in range(self.MAX_NBD_DEVICES + 1):
-            devname = f"/dev/nbd{device_number}"
-            lock = self.redis_client.lock(
-                name=f"{hostname}-{devname}",
-                timeout=self.LOCK_TIMEOUT_SECONDS,
-                blocking=False,
-            )
-            if lock.acquire():
-                self.redis_lock = lock
-                logger.info(
-                    f"Redis lock succesfully set: {lock.name} for {hostname}-{devname}"
+        devnames = [f"/dev/nbd{n}" for n in range(self.MAX_NBD_DEVICES + 1)]
+        keys = [f"{hostname}-{devname}" for devname in devnames]
+        keys.append(f"{hostname}-nbd-queue")
+        return devnames, keys, f"{hostname}-nbd-waiter-"
+
+    def _take_nbd_slot(self, index: int, devnames: list, keys: list, token: bytes):
+        """Takes over the slot locked by NBD_ALLOCATE_SCRIPT as self.redis_lock.
+
+        Args:
+            index (int): slot index returned by the allocation script.
+            devnames (list): NBD device names in slot order.
+            keys (list): NBD lock keys in slot order.
+            token (bytes): lock token the slot was locked with.
+
+        Returns:
+            str: NBD device name
+
+        Raises:
+            RuntimeError: if no slot was allocated.
+        """
+        if index < 0:
+            raise RuntimeError("Error getting free NBD device: All NBD devices locked!")
+        # Hand the slot to a regular redis-py lock so renew/release keep their
+        # token checks. The token is shared with the lease heartbeat.
+        lock = self.redis_client.lock(
+            name=keys[index], timeout=self.LEASE_TTL_SECONDS, thread_local=False
+        )
+        lock.local.token = token
+        self.redis_lock = lock
+        logger.info(f"Redis lock succesfully set: {lock.name}")
+        return devnames[index]
+
+    def _start_lease_heartbeat(self):
+        """Starts a daemon thread renewing the NBD lease every LEASE_RENEW_INTERVAL_SECONDS.
+
+        The lease only has a LEASE_TTL_SECONDS TTL, so the device of a crashed worker
+        becomes available again within seconds while live workers keep their device.
+        """
+        name = self.redis_lock.name if self.redis_lock else self.image_path
+        self._lease_stop = threading.Event()
+        self._lease_thread = threading.Thread(
+            target=self._renew_lease,
+            args=(weakref.ref(self), self.redis_lock, self._lease_stop, name),
+            name=f"lease-{name}",
+            daemon=True,
+        )
+        self._lease_thread.start()
+
+    def _stop_lease_heartbeat(self):
+        """Stops the lease heartbeat thread if it is running."""
+        if self._lease_thread:
+            self._lease_stop.set()
+            self._lease_thread.join()
+            self._lease_thread = None
+
+    @classmethod
+    def _renew_lease(cls, device_ref, lock, stop, name):
+        """Renews the lease until stopped, the lease is lost or the BlockDevice is gone.
+
+        Args:
+            device_ref (weakref.ref): reference to the BlockDevice owning the lease.
+            lock (redis.lock.Lock): lock holding the NBD lease.
+            stop (threading.Event): set to stop renewing.
+            name (str): lease name used in log messages.
+        """
+        deadline = time.monotonic() + cls.LOCK_TIMEOUT_SECONDS
+        while not stop.wait(cls.LEASE_RENEW_INTERVAL_SECONDS):
+            device = device_ref()
+            if not cls._lease_renewable(device, deadline, name):
+                return
+            try:
+                device._renew_lease_once(lock)
+            except redis.exceptions.RedisError as e:
+                if device._lease_renewal_failed(e, name):
+                    return
+            del device
+
+    @classmethod
+    def _lease_renewable(cls, device, deadline: float, name: str) -> bool:
+        """Checks if a lease heartbeat should renew the lease once more.
+
+        Args:
+            device (BlockDevice): device owning the lease, None if it was deleted.
+            deadline (float): time.monotonic() after which the lease isn't renewed.
+            name (str): lease name used in log messages.
+
+        Returns:
+            bool: False if the heartbeat should stop.
+        """
+        if device is None:
+            logger.warning(f"BlockDevice deleted, stop renewing lease {name}")
+            return False
+        if time.monotonic() > deadline:
+            logger.warning(
+                f"Lease {name} held longer than {cls.LOCK_TIMEOUT_SECONDS}s, "
+                "stop renewing"
+            )
+            return False
+        return True
+
+    def _lease_renewal_failed(self, error: Exception, name: str) -> bool:
+        """Handles a failed lease renewal.
+
+        Args:
+            error (redis.exceptions.RedisError): error raised by the renewal.
+            name (str): lease name used in log messages.
+
+        Returns:
+            bool: True if the lease is lost and the heartbeat should stop.
+        """
+        if isinstance(error, redis.exceptions.LockNotOwnedError):
+            self.lease_lost = True
+            logger.error(f"Lease lost: {name}")
+            return True
+        # Retry on the next interval, the TTL covers a few missed renewals.
+        logger.warning(f"Failed renewing lease {name}: {error}")
+        return False
+
+    def _renew_lease_once(self, lock):
+        """Renews the lease once, called by the heartbeat thread.
+
+        Args:
+            lock (redis.lock.Lock): lock holding the NBD lease.
+
+        Raises:
+            redis.exceptions.LockNotOwnedError: if the lease expired.
+        """
+        lock.reacquire()
+
+    def _release_lease(self):
+        """Stops the heartbeat and releases the NBD lease.
+
+        An expired lease means the device could have been handed to another worker
+        while still in use. That is logged and recorded in lease_lost.
+        """
+        self._stop_lease_heartbeat()
+        try:
+            self.redis_lock.release()
+        except redis.exceptions.LockNotOwnedError:
+            self._lease_expired_before_release()
+        else:
+            logger.info(f"Redis lock released: {self.redis_lock.name}")
+
+    def _lease_expired_before_release(self):
+        """Records that the lease expired while the device was still in use."""
+        self.lease_lost = True
+        logger.error(
+            f"Lease expired before release: {self.redis_lock.name}, the device "
+            "may have been reassigned while in use"
+        )
+
+    def _attached_nbd_slots(self, devnames: list) -> str:
+        """Returns the slots whose device is still attached to a qemu-nbd process.
+
+        A worker that crashed loses its lease after LEASE_TTL_SECONDS, but its qemu-nbd
+        keeps the device until the reaper detaches it. Such slots are skipped, so
+        setups don't fail on qemu-nbd --connect in the meantime.
+
+        Args:
+            devnames (list): NBD device names in slot order.
+
+        Returns:
+            str: comma separated slot indexes for NBD_ALLOCATE_SCRIPT, e.g. ",0,3,".
+        """
+        attached = [
+            str(index)
+            for index, devname in enumerate(devnames)
+            if os.path.exists(
+                os.path.join(self.SYSFS_BLOCK_PATH, os.path.basename(devname), "pid")
+            )
+        ]
+        return f",{','.join(attached)},"
+
+    def _wait_for_nbd_slot(self, allocate, keys, args, waiter_prefix, devnames):
+        """Queue for a free NBD slot until one is allocated or the wait times out.
+
+        Waiters are served in FIFO order. Each waiter refreshes a short lived
+        alive key while polling, so waiters that crashed are dropped from the
+        head of the queue by the allocation script.
+
+        Args:
+            allocate (redis.commands.core.Script): registered NBD_ALLOCATE_SCRIPT.
+            keys (list): NBD lock keys followed by the queue key.
+            args (list): lock token and lock TTL in milliseconds.
+            waiter_prefix (str): key prefix for the waiter alive keys.
+            devnames (list): NBD device names in slot order.
+
+        Returns:
+            int: index of the allocated slot, -1 or -2 if the wait timed out.
+        """
+        waiter = uuid4().hex
+        deadline = time.monotonic() + self.nbd_wait_timeout
+        delay = self.NBD_WAIT_MIN_DELAY_SECONDS
+
+        pipe = self.redis_client.pipeline()
+        self._queue_nbd_waiter(pipe, keys, waiter, waiter_prefix)
+        pipe.execute()
+        try:
+            while True:
+                # Refresh the alive key and poll for a slot in one round trip.
+                pipe = self.redis_client.pipeline()
+                self._queue_nbd_poll(
+                    pipe, allocate, keys, args, waiter, waiter_prefix, devnames
                 )
-                return devname
+                index = pipe.execute()[-1]
+                remaining = deadline - time.monotonic()
+                if index >= 0 or remaining <= 0:
+                    return index
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, self.NBD_WAIT_MAX_DELAY_SECONDS)
+        finally:
+            pipe = self.redis_client.pipeline()
+            self._dequeue_nbd_waiter(pipe, keys, waiter, waiter_prefix)
+            pipe.execute()
+
+    def _queue_nbd_waiter(self, pipe, keys: list, waiter: str, waiter_prefix: str):
+        """Queues adding a waiter to the NBD wait queue on a pipeline."""
+        pipe.set(f"{waiter_prefix}{waiter}", 1, px=self.NBD_WAITER_TTL_MS)
+        pipe.rpush(keys[-1], waiter)
+
+    def _queue_nbd_poll(
+        self, pipe, allocate, keys, args, waiter, waiter_prefix, devnames
+    ):
+        """Queues the alive key refresh and an allocation attempt on a pipeline.
 
-        raise RuntimeError("Error getting free NBD device: All NBD devices locked!")
+        The allocation result is the last result of the pipeline.
+        """
+        pipe.set(f"{waiter_prefix}{waiter}", 1, px=self.NBD_WAITER_TTL_MS)
+        # asyncio scripts can't be called on a pipeline, queue EVALSHA and let the
+        # pipeline load the script.
+        pipe.scripts.add(allocate)
+        pipe.evalsha(
+            allocate.sha,
+            len(keys),
+            *keys,
+            *args,
+            waiter,
+            waiter_prefix,
+            self._attached_nbd_slots(devnames),
+        )
+
+    def _dequeue_nbd_waiter(self, pipe, keys: list, waiter: str, waiter_prefix: str):
+        """Queues removing a waiter from the NBD wait queue on a pipeline."""
+        pipe.lrem(keys[-1], 0, waiter)
+        pipe.delete(f"{waiter_prefix}{waiter}")
 
     def _nbdsetup(self):
-        """Map QCOW image file to NBD device using qemu-nbd and probe partitions.
+        """Map QCOW, VMDK, VHD(X) or VDI image file to NBD device using qemu-nbd and probe
+        partitions. The image format is passed to qemu-nbd, so it is not probed again.
 
         Returns:
             str: block device created by qemu-nbd
@@ -207,57 +668,152 @@ class BlockDevice:
         """
         # Get and lock a free nbd device
         self.blkdevice = self._get_free_nbd_device()
-        nbdsetup_command = [
+
+        process = self.runner.run(self._nbdsetup_command())
+        self._nbdsetup_result(process)
+
+        # Wait for qemu-nbd to activate the nbd device
+        self._wait_for_device(self._nbd_ready, self.blkdevice)
+
+        # Probe partitions with fdisk
+        process = self.runner.run(self._fdisk_command())
+        self._fdisk_result(process)
+
+        # Wait for the partition device nodes of the nbd device
+        self._wait_for_device(
+            lambda: self._partitions_ready(self.blkdevice),
+            f"{self.blkdevice} partitions",
+        )
+
+        return self.blkdevice
+
+    def _nbdsetup_command(self) -> list:
+        """Returns the qemu-nbd command connecting the image to self.blkdevice."""
+        return [
             "sudo",
             "qemu-nbd",
             "--read-only",
+            f"--format={self.image_format or 'qcow2'}",
             "--connect",
             self.blkdevice,
             self.image_path,
         ]
 
-        process = subprocess.run(
-            nbdsetup_command, capture_output=True, check=False, text=True
-        )
-        if process.returncode == 0:
-            logger.info(
-                f"qemu-nbd: success creating {self.blkdevice} for {self.image_path}"
-            )
-        else:
+    def _nbdsetup_result(self, process: subprocess.CompletedProcess):
+        """Checks the result of qemu-nbd.
+
+        Raises:
+            RuntimeError: if qemu-nbd failed.
+        """
+        if process.returncode != 0:
             logger.error(
                 f"qemu-nbd: failed creating {self.blkdevice} for {self.image_path}: {process.stderr} {process.stdout}"
             )
             raise RuntimeError(
                 f"Error running qemu-nbd: {process.stderr} {process.stdout}"
             )
+        logger.info(
+            f"qemu-nbd: success creating {self.blkdevice} for {self.image_path}"
+        )
 
-        # This sleep is needed for qemu-nbd to activate the nbd device
-        time.sleep(0.2)
+    def _fdisk_command(self) -> list:
+        """Returns the fdisk command probing the partitions of self.blkdevice."""
+        return ["sudo", "fdisk", "-l", self.blkdevice.strip()]
 
-        # Probe partitions with fdisk
-        fdisk_command = [
-            "sudo",
-            "fdisk",
-            "-l",
-            self.blkdevice.strip(),
-        ]
+    def _fdisk_result(self, process: subprocess.CompletedProcess):
+        """Checks the result of fdisk.
 
-        process = subprocess.run(
-            fdisk_command, capture_output=True, check=False, text=True
-        )
-        if process.returncode == 0:
-            logger.info(
-                f"fdisk: success probing {self.blkdevice} for {self.image_path}"
-            )
-        else:
+        Raises:
+            RuntimeError: if fdisk failed.
+        """
+        if process.returncode != 0:
             logger.error(
                 f"fdisk: failed probing {self.blkdevice} for {self.image_path}: {process.stderr} {process.stdout}"
             )
             raise RuntimeError(
                 f"Error fdisk: failed probing: {process.stderr} {process.stdout}"
             )
+        logger.info(f"fdisk: success probing {self.blkdevice} for {self.image_path}")
 
-        return self.blkdevice
+    def _wait_for_device(self, ready, description: str) -> float:
+        """Polls until a device is ready, backing off exponentially.
+
+        The measured wait time is logged and added to self.device_wait_seconds.
+
+        Args:
+            ready (callable): returns True once the device is ready.
+            description (str): device description used in log and error messages.
+
+        Returns:
+            float: seconds waited for the device.
+
+        Raises:
+            RuntimeError: if the device wasn't ready within DEVICE_READY_TIMEOUT_SECONDS.
+        """
+        start = time.monotonic()
+        delay = 0.005
+        while not ready():
+            self._check_device_wait(start, description)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        return self._record_device_wait(start, description)
+
+    def _check_device_wait(self, start: float, description: str):
+        """Raises once a device wait started at start timed out.
+
+        Raises:
+            RuntimeError: if the device wasn't ready within DEVICE_READY_TIMEOUT_SECONDS.
+        """
+        waited = time.monotonic() - start
+        if waited > self.DEVICE_READY_TIMEOUT_SECONDS:
+            logger.error(f"{description} not ready after {waited:.3f}s")
+            raise RuntimeError(
+                f"Error waiting for {description}: not ready after {self.DEVICE_READY_TIMEOUT_SECONDS}s"
+            )
+
+    def _record_device_wait(self, start: float, description: str) -> float:
+        """Logs a finished device wait and adds it to self.device_wait_seconds."""
+        waited = time.monotonic() - start
+        self.device_wait_seconds += waited
+        logger.info(f"{description} ready after {waited:.3f}s")
+        return waited
+
+    def _nbd_ready(self) -> bool:
+        """Checks if qemu-nbd has connected the nbd device.
+
+        Returns:
+            bool: True if the nbd device has a pid and a non-zero size.
+        """
+        sysfs_path = pathlib.Path(self.SYSFS_BLOCK_PATH) / os.path.basename(
+            self.blkdevice
+        )
+        try:
+            size = int((sysfs_path / "size").read_text().strip())
+        except (OSError, ValueError):
+            return False
+        return size > 0 and (sysfs_path / "pid").exists()
+
+    def _partitions_ready(self, blkdevice: str) -> bool:
+        """Checks if the device nodes of all kernel detected partitions exist.
+
+        Args:
+            blkdevice (str): block device name.
+
+        Returns:
+            bool: True if every partition in sysfs has a device node in /dev.
+        """
+        name = os.path.basename(blkdevice)
+        sysfs_path = pathlib.Path(self.SYSFS_BLOCK_PATH) / name
+        try:
+            partitions = [
+                entry.name
+                for entry in sysfs_path.iterdir()
+                if entry.name.startswith(name) and (entry / "partition").exists()
+            ]
+        except OSError:
+            # No sysfs entry to check against.
+            return True
+        return all(os.path.exists(f"/dev/{partition}") for partition in partitions)
 
     def _required_modules_loaded(self) -> None:
         """Checks if a required kernel module is loaded.
@@ -269,16 +825,27 @@ class BlockDevice:
             RuntimeError: as soon as we find a module that isn't loaded.
         """
 
-        for module in ["nbd"]:
-            try:
-                subprocess.check_call(
-                        ["/usr/bin/grep", "-E", f"^{module}\\s", "/proc/modules"],
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL)
-            except subprocess.CalledProcessError:
-                  raise RuntimeError(
-                          f"Required kernel module {module} is not loaded. "
-                          f"Load it with '/sbin/modprobe {module}' on the Host.")
+        for module in self.REQUIRED_MODULES:
+            process = self.runner.run(self._module_check_command(module))
+            self._module_check_result(module, process)
+
+    @staticmethod
+    def _module_check_command(module: str) -> list:
+        """Returns the command checking that a kernel module is loaded."""
+        return ["/usr/bin/grep", "-E", f"^{module}\\s", "/proc/modules"]
+
+    @staticmethod
+    def _module_check_result(module: str, process: subprocess.CompletedProcess):
+        """Checks the result of a kernel module check.
+
+        Raises:
+            RuntimeError: if the module isn't loaded.
+        """
+        if process.returncode != 0:
+            raise RuntimeError(
+                f"Required kernel module {module} is not loaded. "
+                f"Load it with '/sbin/modprobe {module}' on the Host."
+            )
 
     def _required_tools_available(self) -> bool:
         """Check if required cli tools are available.
@@ -312,25 +879,32 @@ class BlockDevice:
         Raises:
             RuntimeError: if there was an error running lsblk or parsing the json output.
         """
-        lsblk_command = ["sudo", "lsblk", "-ba", "-J", self.blkdevice]
+        process = self.runner.run(self._blkinfo_command())
+        return self._blkinfo_result(process)
 
-        process = subprocess.run(
-            lsblk_command, capture_output=True, check=False, text=True
-        )
-        if process.returncode == 0:
-            try:
-                lsblk_json_output = process.stdout.strip()
-                blkdeviceinfo = json.loads(lsblk_json_output)
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing lsblk json output: {lsblk_json_output}")
-                raise RuntimeError(
-                    f"Error parsing lsblk json output: {lsblk_json_output}: {e}"
-                )
-        else:
+    def _blkinfo_command(self) -> list:
+        """Returns the lsblk command describing self.blkdevice."""
+        return ["sudo", "lsblk", "-ba", "-J", self.blkdevice]
+
+    def _blkinfo_result(self, process: subprocess.CompletedProcess) -> dict:
+        """Parses the lsblk json output.
+
+        Raises:
+            RuntimeError: if lsblk failed or its output is not valid json.
+        """
+        if process.returncode != 0:
             logger.error(
                 f"Error running lsblk on {self.blkdevice}: {process.stderr} {process.stdout}"
             )
             raise RuntimeError(f"Error lsblk: {process.stderr} {process.stdout}")
+        lsblk_json_output = process.stdout.strip()
+        try:
+            blkdeviceinfo = json.loads(lsblk_json_output)
+        except json.JSONDecodeError as e:
+            logger.error(f"Error parsing lsblk json output: {lsblk_json_output}")
+            raise RuntimeError(
+                f"Error parsing lsblk json output: {lsblk_json_output}: {e}"
+            )
 
         logger.info(f"Success parsing lsblk info: {blkdeviceinfo}")
         return blkdeviceinfo
@@ -341,11 +915,40 @@ class BlockDevice:
         Returns:
             list[str]: a list of partitions
         """
-        partitions = []
+        devnames = self._probe_devnames()
+        if devnames:
+            # Probe the filesystem types of the disk and all partitions at once.
+            self._probe_fstypes(devnames)
+        return self._important_partitions()
+
+    def _probe_devnames(self) -> list:
+        """Returns the disk and partition device names found by lsblk.
+
+        Returns:
+            list[str]: the block device followed by its partitions, empty if lsblk
+                found no block device.
+
+        Raises:
+            RuntimeError: if self.blkdeviceinfo is malformed.
+        """
         if "blockdevices" not in self.blkdeviceinfo:
             raise RuntimeError("_parse_partitions: self.blkdeviceinfo malformed")
         if len(self.blkdeviceinfo.get("blockdevices")) == 0:
             logger.warning("_parse_partitions: blkdeviceinfo.blockdevices had 0 length")
+            return []
+        bd = self.blkdeviceinfo.get("blockdevices")[0]
+        return [self.blkdevice] + [
+            f"/dev/{children['name']}" for children in bd.get("children", [])
+        ]
+
+    def _important_partitions(self) -> list:
+        """Returns the partitions selected by _is_important_partition.
+
+        Returns:
+            list[str]: a list of partitions
+        """
+        partitions = []
+        if not self.blkdeviceinfo.get("blockdevices"):
             return partitions
         bd = self.blkdeviceinfo.get("blockdevices")[0]
         if "children" not in bd:
@@ -389,9 +992,53 @@ class BlockDevice:
 
         return True
 
+    def _probe_fstypes(self, devnames: list):
+        """Probes the file system types of several block devices with a single blkid call.
+
+        The results are cached in self.fstypes and used by _get_fstype. Devices without a
+        detectable file system are cached with an empty type. If blkid fails nothing is
+        cached and _get_fstype probes the devices one by one.
+
+        Args:
+            devnames (list): block device or partition device names.
+        """
+        process = self.runner.run(self._fstype_probe_command(devnames))
+        self._parse_fstype_probe(devnames, process)
+
+    @staticmethod
+    def _fstype_probe_command(devnames: list) -> list:
+        """Returns the blkid command probing the file system types of devnames."""
+        return ["sudo", "blkid", "-s", "TYPE", "-o", "export", *devnames]
+
+    def _parse_fstype_probe(self, devnames: list, process: subprocess.CompletedProcess):
+        """Caches the file system types reported by a blkid export probe.
+
+        Args:
+            devnames (list): block device or partition device names probed.
+            process (subprocess.CompletedProcess): the finished blkid process.
+        """
+        # blkid exits with 2 if none of the devices has a detectable file system.
+        if process.returncode not in (0, 2):
+            logger.warning(
+                f"Error probing file system types: {process.stderr} {process.stdout}"
+            )
+            return
+
+        fstypes = {}
+        for block in process.stdout.strip().split("\n\n"):
+            tags = dict(
+                line.split("=", 1) for line in block.splitlines() if "=" in line
+            )
+            if "DEVNAME" in tags:
+                fstypes[tags["DEVNAME"]] = tags.get("TYPE", "")
+        for devname in devnames:
+            self.fstypes[devname] = fstypes.get(devname, "")
+
     def _get_fstype(self, devname: str):
         """Analyses the file system type of a block device or partition.
 
+        Types probed by _probe_fstypes are returned from cache.
+
         Args:
             devname (str): block device or partitions device name.
 
@@ -401,20 +1048,32 @@ class BlockDevice:
         Raises:
           RuntimeError: If there was an error running blkid.
         """
-        blkid_command = ["sudo", "blkid", "-s", "TYPE", "-o", "value", f"{devname}"]
+        if devname in self.fstypes:
+            return self.fstypes[devname]
 
-        process = subprocess.run(
-            blkid_command, capture_output=True, check=False, text=True
-        )
-        if process.returncode == 0:
-            return process.stdout.strip()
-        else:
+        process = self.runner.run(self._fstype_command(devname))
+        return self._fstype_result(devname, process)
+
+    @staticmethod
+    def _fstype_command(devname: str) -> list:
+        """Returns the blkid command probing the file system type of devname."""
+        return ["sudo", "blkid", "-s", "TYPE", "-o", "value", f"{devname}"]
+
+    @staticmethod
+    def _fstype_result(devname: str, process: subprocess.CompletedProcess) -> str:
+        """Returns the file system type reported by blkid.
+
+        Raises:
+            RuntimeError: if blkid failed.
+        """
+        if process.returncode != 0:
             logger.error(
                 f"Error running blkid on {devname}: {process.stderr} {process.stdout}"
             )
             raise RuntimeError(
                 f"Error running blkid on {devname}: {process.stderr} {process.stdout}"
             )
+        return process.stdout.strip()
 
     def _select_partitions_to_mount(self, partition_name: str = "") -> list:
         """Select partitions to mount.
@@ -470,11 +1129,22 @@ class BlockDevice:
 
         return f"{self.mountroot}/{uuid_path_part}"
 
-    def mount(self, partition_name: str = ""):
+    def mount(
+        self,
+        partition_name: str = "",
+        max_workers: int = MAX_MOUNT_WORKERS,
+        rollback: bool = False,
+    ):
         """Mounts a disk or one or more partititions on a mountpoint.
 
+        Partitions are mounted concurrently. A failing partition does not stop the
+        others from being mounted, all failures are collected in mount_failures and
+        reported together once every partition has been tried.
+
         Args:
             partitions_name (str): Name of specific partition to mount.
+            max_workers (int): maximum number of concurrent mounts, default MAX_MOUNT_WORKERS
+            rollback (bool): unmount the partitions mounted by this call if any mount fails.
 
         Returns:
             list: A list of paths the disk/partitions have been mounted on.
@@ -483,39 +1153,200 @@ class BlockDevice:
           RuntimeError: If there was an error running mount.
         """
         to_mount = self._select_partitions_to_mount(partition_name)
+        self.mount_failures = {}
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(to_mount)))
+        ) as executor:
+            futures = {
+                mounttarget: submit_with_context(
+                    executor, self._mount_partition, mounttarget
+                )
+                for mounttarget in to_mount
+            }
 
-        for mounttarget in to_mount:
-            logger.info(f"Trying to mount {mounttarget}")
-            mount_command = ["sudo", "mount"]
-            fstype = self._get_fstype(mounttarget)
-            if fstype == "xfs":
-                mount_command.extend(["-o", "ro,norecovery"])
-            elif fstype in ["ext2", "ext3", "ext4"]:
-                mount_command.extend(["-o", "ro,noload"])
-            else:
-                mount_command.extend(["-o", "ro"])
+        results = {}
+        for mounttarget, future in futures.items():
+            try:
+                results[mounttarget] = future.result()
+            except (RuntimeError, OSError) as e:
+                results[mounttarget] = e
+        mounted = self._record_mounts(results)
+
+        if self.mount_failures:
+            if rollback:
+                logger.info(f"Rolling back mounts: {mounted}")
+                for mountpoint in mounted:
+                    self._umount(mountpoint)
+                    self._forget_mountpoint(mountpoint)
+            raise self._mount_error()
+        return self.mountpoints
+
+    def _mount_error(self) -> RuntimeError:
+        """Returns the error reporting all failures of the last mount call."""
+        return RuntimeError("; ".join(self.mount_failures.values()))
+
+    def _record_mounts(self, results: dict) -> list:
+        """Records the outcome of mounting several partitions.
+
+        Args:
+            results (dict): mount folder or exception per mount target.
 
-            mount_command.append(mounttarget)
+        Returns:
+            list: the folders mounted successfully.
+        """
+        mounted = []
+        for mounttarget, result in results.items():
+            if isinstance(result, Exception):
+                self.mount_failures[mounttarget] = str(result)
+                continue
+            mounted.append(result)
+            self.partition_mountpoints[mounttarget] = result
+        self.mountpoints.extend(mounted)
+        if mounted:
+            self._write_registry_record()
+        return mounted
+
+    def _mount_partition(self, mounttarget: str) -> str:
+        """Mounts a single disk or partition on a new mountpoint.
+
+        The drivers selected by select_mount_drivers are tried in order, the driver
+        that mounted the partition is recorded in mount_drivers.
 
-            mount_folder = self._get_mount_path()
-            os.makedirs(mount_folder)
+        Args:
+            mounttarget (str): disk or partition device to mount.
 
-            mount_command.append(mount_folder)
+        Returns:
+            str: The path the disk/partition has been mounted on.
 
-            process = subprocess.run(
-                mount_command, capture_output=True, check=False, text=True
+        Raises:
+          RuntimeError: If there was an error running mount.
+        """
+        logger.info(f"Trying to mount {mounttarget}")
+        fstype = self._get_fstype(mounttarget)
+        mount_folder, candidates = self._prepare_mount(fstype)
+
+        for driver, options in candidates:
+            mount_command = self._mount_command(
+                driver, options, mounttarget, mount_folder
             )
-            if process.returncode == 0:
-                logger.info(f"Mounted {mounttarget} to {mount_folder}")
-                self.mountpoints.append(mount_folder)
-            else:
-                logger.error(
-                    f"Error running mount on {mounttarget}: {process.stderr} {process.stdout}"
-                )
-                raise RuntimeError(
-                    f"Error running mount on {mounttarget}: {process.stderr} {process.stdout}"
-                )
-        return self.mountpoints
+
+            process = self.runner.run(mount_command)
+            if self._mount_result(mounttarget, mount_folder, driver, process):
+                return mount_folder
+
+        self._mount_failed(mounttarget, mount_folder, process)
+
+    def _prepare_mount(self, fstype: str) -> tuple:
+        """Creates a new mount folder and selects the mount drivers to try.
+
+        Args:
+            fstype (str): file system type reported by blkid.
+
+        Returns:
+            tuple: the mount folder and the (driver, options) candidates.
+        """
+        candidates = select_mount_drivers(fstype, self._available_mount_drivers())
+        mount_folder = self._get_mount_path()
+        os.makedirs(mount_folder)
+        return mount_folder, candidates
+
+    def _mount_result(
+        self,
+        mounttarget: str,
+        mount_folder: str,
+        driver: str | None,
+        process: subprocess.CompletedProcess,
+    ) -> bool:
+        """Records a mount attempt with a single driver.
+
+        Returns:
+            bool: True if the partition was mounted.
+        """
+        if process.returncode == 0:
+            self.mount_drivers[mounttarget] = driver or "auto"
+            logger.info(
+                f"Mounted {mounttarget} to {mount_folder} with {driver or 'auto'}"
+            )
+            return True
+        logger.warning(
+            f"Error mounting {mounttarget} with {driver or 'auto'}: "
+            f"{process.stderr} {process.stdout}"
+        )
+        return False
+
+    def _mount_failed(
+        self, mounttarget: str, mount_folder: str, process: subprocess.CompletedProcess
+    ):
+        """Removes the mount folder after every mount driver failed.
+
+        Raises:
+            RuntimeError: always, with the output of the last mount attempt.
+        """
+        os.rmdir(mount_folder)
+        logger.error(
+            f"Error running mount on {mounttarget}: {process.stderr} {process.stdout}"
+        )
+        raise RuntimeError(
+            f"Error running mount on {mounttarget}: {process.stderr} {process.stdout}"
+        )
+
+    @staticmethod
+    def _mount_command(
+        driver: str | None, options: str, mounttarget: str, mount_folder: str
+    ) -> list:
+        """Returns the mount command for a single mount driver candidate.
+
+        Args:
+            driver (str): mount -t driver, None lets mount detect the file system.
+            options (str): mount options.
+            mounttarget (str): disk or partition device to mount.
+            mount_folder (str): folder to mount on.
+
+        Returns:
+            list: the mount command.
+        """
+        mount_command = ["sudo", "mount"]
+        if driver:
+            mount_command.extend(["-t", driver])
+        mount_command.extend(["-o", options, mounttarget, mount_folder])
+        return mount_command
+
+    def _available_mount_drivers(self) -> set:
+        """Returns the mount drivers available on this host.
+
+        Kernel file systems are available if they are registered in /proc/filesystems
+        or can be loaded as a module. FUSE drivers need their mount helper.
+
+        Returns:
+            set: names usable with mount -t.
+        """
+        if self._mount_drivers_available is not None:
+            return self._mount_drivers_available
+
+        drivers = set()
+        try:
+            with open(PROC_FILESYSTEMS_PATH, encoding="utf-8") as fh:
+                drivers.update(line.split()[-1] for line in fh if line.strip())
+        except OSError as e:
+            logger.warning(f"Error reading {PROC_FILESYSTEMS_PATH}: {e}")
+        modules_dep = os.path.join(MODULES_PATH, os.uname().release, "modules.dep")
+        try:
+            with open(modules_dep, encoding="utf-8") as fh:
+                modules = fh.read()
+            drivers.update(
+                driver for driver in KERNEL_MOUNT_DRIVERS if f"/{driver}.ko" in modules
+            )
+        except OSError:
+            pass
+        drivers.update(
+            driver
+            for driver, helper in FUSE_MOUNT_HELPERS.items()
+            if shutil.which(helper)
+        )
+        self._mount_drivers_available = drivers
+        logger.info(f"Available mount drivers: {sorted(drivers)}")
+        return drivers
 
     def _umount_all(self):
         """Umounts all registered mount_points.
@@ -526,26 +1357,60 @@ class BlockDevice:
             RuntimeError: If there was an error running umount.
         """
         removed = []
-        for mountpoint in self.mountpoints:
-            umount_command = ["sudo", "umount", f"{mountpoint}"]
-
-            process = subprocess.run(
-                umount_command, capture_output=True, check=False, text=True
-            )
-            if process.returncode == 0:
-                logger.info(f"umount {mountpoint} success")
-                os.rmdir(mountpoint)
+        try:
+            for mountpoint in self.mountpoints:
+                self._umount(mountpoint)
                 removed.append(mountpoint)
-            else:
-                logger.error(
-                    f"Error running umount on {mountpoint}: {process.stderr} {process.stdout}"
-                )
-                raise RuntimeError(
-                    f"Error running umount on {mountpoint}: {process.stderr} {process.stdout}"
-                )
+        finally:
+            for mountpoint in removed:
+                self._forget_mountpoint(mountpoint)
+
+    def _forget_mountpoint(self, mountpoint: str):
+        """Removes an unmounted mount_point from the registered mount_points.
 
-        for mountpoint in removed:
-            self.mountpoints.remove(mountpoint)
+        Args:
+            mountpoint (str): path that has been unmounted.
+        """
+        self.mountpoints.remove(mountpoint)
+        self.partition_mountpoints = {
+            partition: path
+            for partition, path in self.partition_mountpoints.items()
+            if path != mountpoint
+        }
+
+    def _umount(self, mountpoint: str):
+        """Umounts a single mount_point and removes its folder.
+
+        Args:
+            mountpoint (str): path to unmount.
+
+        Raises:
+            RuntimeError: If there was an error running umount.
+        """
+        process = self.runner.run(self._umount_command(mountpoint))
+        self._umount_result(mountpoint, process)
+
+    @staticmethod
+    def _umount_command(mountpoint: str) -> list:
+        """Returns the umount command for a single mount_point."""
+        return ["sudo", "umount", f"{mountpoint}"]
+
+    @staticmethod
+    def _umount_result(mountpoint: str, process: subprocess.CompletedProcess):
+        """Removes the folder of an unmounted mount_point.
+
+        Raises:
+            RuntimeError: If umount failed.
+        """
+        if process.returncode != 0:
+            logger.error(
+                f"Error running umount on {mountpoint}: {process.stderr} {process.stdout}"
+            )
+            raise RuntimeError(
+                f"Error running umount on {mountpoint}: {process.stderr} {process.stdout}"
+            )
+        logger.info(f"umount {mountpoint} success")
+        os.rmdir(mountpoint)
 
     def _detach_device(self):
         """Cleanup block devices for BlockDevice instance.
@@ -555,20 +1420,28 @@ class BlockDevice:
         Raises:
             RuntimeError: If there was an error running losetup or qemu-nbd.
         """
-        if "nbd" in self.blkdevice:
-            command = ["sudo", "qemu-nbd", "--disconnect", self.blkdevice]
-        else:
-            command = ["sudo", "losetup", "--detach", self.blkdevice]
+        process = self.runner.run(self._detach_command())
+        self._detach_result(process)
 
-        process = subprocess.run(command, capture_output=True, check=False, text=True)
-        if process.returncode == 0:
-            logger.info(f"Detached {self.blkdevice} succes!")
-            self.blkdevice = None
-        else:
+    def _detach_result(self, process: subprocess.CompletedProcess):
+        """Forgets the detached block device.
+
+        Raises:
+            RuntimeError: If losetup or qemu-nbd failed to detach the device.
+        """
+        if process.returncode != 0:
             logger.error(f"Detached {self.blkdevice} failed!")
             raise RuntimeError(
                 f"Error detaching block device: {process.stderr} {process.stdout}"
             )
+        logger.info(f"Detached {self.blkdevice} succes!")
+        self.blkdevice = None
+
+    def _detach_command(self) -> list:
+        """Returns the command detaching the loop or NBD device."""
+        if "nbd" in self.blkdevice:
+            return ["sudo", "qemu-nbd", "--disconnect", self.blkdevice]
+        return ["sudo", "losetup", "--detach", self.blkdevice]
 
     def umount(self):
         """Unmounts all mounted file systems and detaches the block device.
@@ -576,14 +1449,874 @@ class BlockDevice:
         This method first attempts to unmount all file systems that were previously
         mounted by the `mount()` method. After successfully unmounting, it detaches
         the underlying block device (loop or NBD). If a Redis lock was acquired
-        for an NBD device, this lock is also released.
+        for an NBD device, its lease heartbeat is stopped and the lock is released.
 
         Raises:
             RuntimeError: If unmounting any of the mount points fails, or if
                           detaching the block device fails.
         """
+        record_path = self._registry_record_path()
         self._umount_all()
         self._detach_device()
         if self.redis_lock:
-            self.redis_lock.release()
+            self._release_lease()
+        self._remove_registry_record(record_path)
+
+    def _registry_record_path(self) -> str | None:
+        """Returns the path of the device registry record of the block device."""
+        if not self.blkdevice:
+            return None
+        return os.path.join(
+            self.registry_dir, f"{os.path.basename(self.blkdevice)}.json"
+        )
+
+    def _registry_record(self) -> dict:
+        """Returns the device registry record used by reap_stale_devices."""
+        return {
+            "image_path": self.image_path,
+            "blkdevice": self.blkdevice,
+            "mountpoints": self.mountpoints,
+            "pid": os.getpid(),
+            "starttime": _process_starttime(os.getpid()),
+            "pid_namespace": _pid_namespace(),
+            "lock_name": self.redis_lock.name if self.redis_lock else None,
+            "lock_token": (
+                self.redis_lock.local.token.decode() if self.redis_lock else None
+            ),
+        }
+
+    def _write_registry_record(self):
+        """Writes or updates the device registry record of the block device.
+
+        Records are named after the device, so a device reused after a crash
+        replaces the stale record. Errors are logged, the registry is best effort.
+        """
+        record_path = self._registry_record_path()
+        if not record_path:
+            return
+        try:
+            os.makedirs(self.registry_dir, exist_ok=True)
+            tmp_path = f"{record_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(self._registry_record(), fh)
+            os.replace(tmp_path, record_path)
+        except OSError as e:
+            logger.warning(f"Error writing device registry record {record_path}: {e}")
+
+    def _remove_registry_record(self, record_path: str | None):
+        """Removes the device registry record after a successful teardown."""
+        if record_path:
+            try:
+                os.remove(record_path)
+            except FileNotFoundError:
+                pass
+
+
+class SharedBlockDevice(BlockDevice):
+    """SharedBlockDevice shares the read-only mounts of an image between tasks on a node.
+
+    The first task sets up the block device, mounts all partitions and records them in
+    a Redis registry keyed by node, mount namespace and image identity (path, inode,
+    size and mtime). Workers in separate containers on a node have their own mount
+    namespace and don't see each other's mounts, so they never share them.
+    Later tasks reuse the existing mountpoints and the last umount() tears them down.
+    Every holder heartbeats its registry entry, holders that crashed are dropped after
+    LEASE_TTL_SECONDS.
+
+    Usage:
+        ```
+        try:
+            bd = SharedBlockDevice('/folder/path_to_disk_image.dd', min_partition_size=1)
+            bd.setup()
+            mountpoints = bd.mount()
+            # Do the things you need to do :)
+        except:
+            # Handle your errors here.
+        finally:
+            bd.umount()
+    """
+
+    REGISTRY_LOCK_TIMEOUT_SECONDS = 10 * 60  #: Default 10 minutes
+
+    def __init__(self, image_path: str, **kwargs):
+        """Initialize SharedBlockDevice class instance.
+
+        Args:
+            image_path (str): path to the image file to map and mount.
+            **kwargs: passed on to BlockDevice.
+        """
+        super().__init__(image_path, **kwargs)
+        self.holder_id = uuid4().hex
+        self.registry_key = None
+        self.reused = False
+
+    @property
+    def _holders_key(self) -> str:
+        return f"{self.registry_key}-holders"
+
+    def _image_identity(self) -> str:
+        """Identifies the image by path, inode, size and modification time.
+
+        Returns:
+            str: hex digest identifying the image.
+        """
+        stat = os.stat(self.image_path)
+        identity = (
+            f"{os.path.realpath(self.image_path)}:{stat.st_dev}:{stat.st_ino}:"
+            f"{stat.st_size}:{stat.st_mtime_ns}"
+        )
+        return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+    @staticmethod
+    def _mount_namespace() -> str:
+        """Identifies the mount namespace of this process.
+
+        Returns:
+            str: inode number of the mount namespace, e.g. "4026531841", or "host" if
+                /proc/self/ns/mnt can not be read.
+        """
+        try:
+            namespace = os.readlink("/proc/self/ns/mnt")
+        except OSError:
+            return "host"
+        return namespace.removeprefix("mnt:[").removesuffix("]")
+
+    def _registry_lock(self):
+        """Returns the lock serializing setup and teardown of the shared mounts."""
+        return self.redis_client.lock(
+            name=f"{self.registry_key}-lock",
+            timeout=self.REGISTRY_LOCK_TIMEOUT_SECONDS,
+            blocking_timeout=self.REGISTRY_LOCK_TIMEOUT_SECONDS,
+        )
+
+    def _drop_stale_holders(self, pipe):
+        """Queues the removal of holders that stopped heartbeating.
+
+        Args:
+            pipe (redis.client.Pipeline): pipeline to queue the command on.
+        """
+        pipe.zremrangebyscore(
+            self._holders_key, "-inf", time.time() - self.LEASE_TTL_SECONDS
+        )
+
+    def setup(self):
+        """Attaches to the shared mounts of the image, or sets them up if there are none.
+
+        Unlike BlockDevice.setup() this also mounts all partitions, the mounts are
+        shared so every holder sees the same set.
+
+        Raises:
+            RuntimeError: if the image does not exist or setting up the mounts failed.
+        """
+        if not pathlib.Path(self.image_path).exists():
+            raise RuntimeError(f"image_path does not exist: {self.image_path}")
+
+        if self.redis_client is None:
+            self.redis_client = get_redis_client(self.REDIS_URL)
+        self.registry_key = (
+            f"{self._get_hostname()}-shared-mount-{self._mount_namespace()}-"
+            f"{self._image_identity()}"
+        )
+
+        with self._registry_lock():
+            pipe = self.redis_client.pipeline()
+            self._drop_stale_holders(pipe)
+            pipe.get(self.registry_key)
+            pipe.zcard(self._holders_key)
+            _, entry, holders = pipe.execute()
+            if entry and holders:
+                self._attach(json.loads(entry))
+            else:
+                if entry:
+                    self._teardown_stale(json.loads(entry))
+                self._setup_and_mount()
+            self._touch_registry()
+
+        if not self._lease_thread:
+            self._start_lease_heartbeat()
+
+    def _setup_and_mount(self):
+        """Sets up the block device, mounts all partitions and registers the mounts.
+
+        Raises:
+            RuntimeError: if setup or mount failed, everything set up is cleaned up.
+        """
+        try:
+            super().setup()
+            super().mount(rollback=True)
+        except RuntimeError:
+            self._stop_lease_heartbeat()
+            if self.blkdevice:
+                try:
+                    super().umount()
+                except RuntimeError as e:
+                    logger.error(f"Error cleaning up {self.image_path}: {e}")
+            raise
+
+        entry = {
+            "blkdevice": self.blkdevice,
+            "partitions": self.partitions,
+            "mountpoints": self.mountpoints,
+            "partition_mountpoints": self.partition_mountpoints,
+            "mount_drivers": self.mount_drivers,
+            "lock_name": self.redis_lock.name if self.redis_lock else None,
+            "lock_token": (
+                self.redis_lock.local.token.decode() if self.redis_lock else None
+            ),
+        }
+        self.redis_client.set(
+            self.registry_key, json.dumps(entry), px=self.LEASE_TTL_SECONDS * 1000
+        )
+        logger.info(
+            f"Registered shared mounts of {self.image_path}: {self.mountpoints}"
+        )
+
+    def _attach(self, entry: dict):
+        """Reuses the registered mounts of another holder.
+
+        Args:
+            entry (dict): registry entry of the shared mounts.
+        """
+        self.blkdevice = entry["blkdevice"]
+        self.partitions = entry["partitions"]
+        self.mountpoints = list(entry["mountpoints"])
+        self.partition_mountpoints = dict(entry["partition_mountpoints"])
+        self.mount_drivers = dict(entry.get("mount_drivers", {}))
+        if entry["lock_name"]:
+            self.redis_lock = self.redis_client.lock(
+                name=entry["lock_name"],
+                timeout=self.LEASE_TTL_SECONDS,
+                thread_local=False,
+            )
+            self.redis_lock.local.token = entry["lock_token"].encode()
+        self.reused = True
+        logger.info(f"Reusing shared mounts of {self.image_path}: {self.mountpoints}")
+
+    def _teardown_stale(self, entry: dict):
+        """Tears down mounts left behind by holders that crashed.
+
+        Args:
+            entry (dict): registry entry of the shared mounts.
+        """
+        logger.warning(f"Tearing down stale shared mounts of {self.image_path}")
+        stale = SharedBlockDevice(self.image_path)
+        stale.redis_client = self.redis_client
+        stale._attach(entry)
+        try:
+            BlockDevice.umount(stale)
+        except RuntimeError as e:
+            logger.error(f"Error tearing down stale mounts of {self.image_path}: {e}")
+        self.redis_client.delete(self.registry_key)
+
+    def _touch_registry(self, pipe=None):
+        """Records a heartbeat of this holder and extends the registry TTL.
+
+        Args:
+            pipe (redis.client.Pipeline): pipeline to queue the commands on, the
+                commands are executed right away if None.
+        """
+        ttl_ms = self.LEASE_TTL_SECONDS * 1000
+        execute = pipe is None
+        if execute:
+            pipe = self.redis_client.pipeline()
+        pipe.zadd(self._holders_key, {self.holder_id: time.time()})
+        pipe.pexpire(self.registry_key, ttl_ms)
+        pipe.pexpire(self._holders_key, ttl_ms)
+        if execute:
+            pipe.execute()
+
+    def _registry_record(self) -> dict:
+        """Adds the shared mount registry key, holders keep the devices alive."""
+        record = super()._registry_record()
+        record["registry_key"] = self.registry_key
+        return record
+
+    def _renew_lease_once(self, lock):
+        """Renews the NBD lease, if any, and the registry entry of this holder in one
+        round trip.
+
+        Args:
+            lock (redis.lock.Lock): lock holding the NBD lease or None.
+
+        Raises:
+            redis.exceptions.LockNotOwnedError: if the lease expired.
+        """
+        pipe = self.redis_client.pipeline()
+        if lock:
+            # Same script as lock.reacquire(), sent with the registry heartbeat.
+            lock.lua_reacquire(
+                keys=[lock.name],
+                args=[lock.local.token, int(lock.timeout * 1000)],
+                client=pipe,
+            )
+        self._touch_registry(pipe)
+        results = pipe.execute()
+        if lock and not results[0]:
+            raise redis.exceptions.LockNotOwnedError(
+                "Cannot reacquire a lock that's no longer owned", lock_name=lock.name
+            )
+
+    def mount(self, partition_name: str = "", **kwargs):
+        """Returns the shared mountpoints, all partitions are mounted by setup().
+
+        Args:
+            partitions_name (str): Name of specific partition to return the mountpoint for.
+            **kwargs: ignored, accepted for compatibility with BlockDevice.mount().
+
+        Returns:
+            list: A list of paths the disk/partitions have been mounted on.
+
+        Raises:
+          RuntimeError: If the partition is not mounted.
+        """
+        if not partition_name:
+            return self.mountpoints
+        if partition_name not in self.partition_mountpoints:
+            raise RuntimeError(
+                f"Error running mount: partition name {partition_name} not found"
+            )
+        return [self.partition_mountpoints[partition_name]]
+
+    def umount(self):
+        """Releases the shared mounts, the last holder unmounts and detaches them.
+
+        Raises:
+            RuntimeError: If unmounting any of the mount points fails, or if
+                          detaching the block device fails.
+        """
+        with self._registry_lock():
+            self._stop_lease_heartbeat()
+            pipe = self.redis_client.pipeline()
+            pipe.zrem(self._holders_key, self.holder_id)
+            self._drop_stale_holders(pipe)
+            pipe.zcard(self._holders_key)
+            holders = pipe.execute()[-1]
+            if holders:
+                logger.info(
+                    f"Leaving shared mounts of {self.image_path} to {holders} holders"
+                )
+                self.mountpoints = []
+                self.partition_mountpoints = {}
+                return
+
+            super().umount()
+            self.redis_client.delete(self.registry_key, self._holders_key)
+
+
+class AsyncBlockDevice(BlockDevice):
+    """AsyncBlockDevice is the asyncio variant of BlockDevice.
+
+    setup_async, mount_async and umount_async run external commands with
+    CommandRunner.run_async, by default on asyncio.create_subprocess_exec, and NBD
+    leases use a redis.asyncio client, so several images can be set up and mounted
+    concurrently on one event loop. Commands and their results are handled by the
+    BlockDevice helpers, the inherited setup, mount and umount stay synchronous.
+
+    Usage:
+        ```
+        async def process(image_path):
+            async with AsyncBlockDevice(image_path) as bd:
+                # setup_async() and mount_async() have run, umount_async() runs on exit.
+                return walk(bd.mountpoints)
+
+        results = await asyncio.gather(*(process(path) for path in image_paths))
+        ```
+    """
+
+    def __init__(self, image_path: str, **kwargs):
+        """Initialize AsyncBlockDevice class instance.
+
+        Args:
+            image_path (str): path to the image file to map and mount.
+            **kwargs: passed to BlockDevice.
+        """
+        super().__init__(image_path, **kwargs)
+        self._lease_task = None
+
+    async def __aenter__(self):
+        """Sets up the block device and mounts all partitions.
+
+        The device is cleaned up again if setup or mount fails.
+        """
+        try:
+            await self.setup_async()
+            await self.mount_async()
+        except BaseException:
+            if self.blkdevice:
+                try:
+                    await self.umount_async()
+                except RuntimeError as e:
+                    logger.error(f"Error cleaning up {self.blkdevice}: {e}")
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        """Unmounts all file systems and detaches the block device."""
+        await self.umount_async()
+
+    async def setup_async(self):
+        """Setup AsyncBlockDevice instance, see BlockDevice.setup."""
+        self._check_setup()
+        await self._required_modules_loaded_async()
+
+        self.image_format = detect_image_format(
+            self.image_path, self.supported_nbdtypes
+        )
+        if self.image_format:
+            self.redis_client = get_async_redis_client(self.REDIS_URL)
+            self.blkdevice = await self._nbdsetup_async()
+        else:
+            self.blkdevice = await self._losetup_async()
+
+        self._write_registry_record()
+        self.blkdeviceinfo = await self._blkinfo_async()
+        self.partitions = await self._parse_partitions_async()
+
+    async def _required_modules_loaded_async(self) -> None:
+        """Checks if a required kernel module is loaded, see _required_modules_loaded.
+
+        Raises:
+            RuntimeError: as soon as we find a module that isn't loaded.
+        """
+        for module in self.REQUIRED_MODULES:
+            process = await self.runner.run_async(self._module_check_command(module))
+            self._module_check_result(module, process)
+
+    async def _losetup_async(self) -> str:
+        """Map image file to loopback device using losetup, see BlockDevice._losetup."""
+        process = await self.runner.run_async(self._losetup_command())
+        blkdevice = self._losetup_result(process)
+
+        await self._wait_for_device_async(
+            lambda: self._partitions_ready(blkdevice), f"{blkdevice} partitions"
+        )
+        return blkdevice
+
+    async def _nbdsetup_async(self) -> str:
+        """Map image file to NBD device using qemu-nbd, see BlockDevice._nbdsetup."""
+        self.blkdevice = await self._get_free_nbd_device_async()
+
+        process = await self.runner.run_async(self._nbdsetup_command())
+        self._nbdsetup_result(process)
+        await self._wait_for_device_async(self._nbd_ready, self.blkdevice)
+
+        process = await self.runner.run_async(self._fdisk_command())
+        self._fdisk_result(process)
+        await self._wait_for_device_async(
+            lambda: self._partitions_ready(self.blkdevice),
+            f"{self.blkdevice} partitions",
+        )
+        return self.blkdevice
+
+    async def _get_free_nbd_device_async(self) -> str:
+        """Find and lock a free NBD device, see BlockDevice._get_free_nbd_device.
+
+        Returns:
+            str: NBD device name
+
+        Raises:
+            RuntimeError: if no free nbd device was found.
+        """
+        devnames, keys, waiter_prefix = self._nbd_slots()
+        token = uuid4().hex.encode()
+        allocate = self.redis_client.register_script(NBD_ALLOCATE_SCRIPT)
+        args = [token, int(self.LEASE_TTL_SECONDS * 1000)]
+
+        if self.nbd_wait_timeout is None:
+            attached = self._attached_nbd_slots(devnames)
+            index = await allocate(keys=keys, args=args + ["", waiter_prefix, attached])
+        else:
+            index = await self._wait_for_nbd_slot_async(
+                allocate, keys, args, waiter_prefix, devnames
+            )
+
+        devname = self._take_nbd_slot(index, devnames, keys, token)
+        self._lease_task = asyncio.create_task(
+            self._renew_lease_async(
+                weakref.ref(self), self.redis_lock, self.redis_lock.name
+            )
+        )
+        return devname
+
+    async def _wait_for_nbd_slot_async(
+        self, allocate, keys, args, waiter_prefix, devnames
+    ):
+        """Queue for a free NBD slot, see BlockDevice._wait_for_nbd_slot."""
+        waiter = uuid4().hex
+        deadline = time.monotonic() + self.nbd_wait_timeout
+        delay = self.NBD_WAIT_MIN_DELAY_SECONDS
+
+        pipe = self.redis_client.pipeline()
+        self._queue_nbd_waiter(pipe, keys, waiter, waiter_prefix)
+        await pipe.execute()
+        try:
+            while True:
+                pipe = self.redis_client.pipeline()
+                self._queue_nbd_poll(
+                    pipe, allocate, keys, args, waiter, waiter_prefix, devnames
+                )
+                index = (await pipe.execute())[-1]
+                remaining = deadline - time.monotonic()
+                if index >= 0 or remaining <= 0:
+                    return index
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, self.NBD_WAIT_MAX_DELAY_SECONDS)
+        finally:
+            pipe = self.redis_client.pipeline()
+            self._dequeue_nbd_waiter(pipe, keys, waiter, waiter_prefix)
+            await pipe.execute()
+
+    @classmethod
+    async def _renew_lease_async(cls, device_ref, lock, name):
+        """Renews the lease until cancelled, the lease is lost or the device is gone.
+
+        Args:
+            device_ref (weakref.ref): reference to the AsyncBlockDevice owning the lease.
+            lock (redis.asyncio.lock.Lock): lock holding the NBD lease.
+            name (str): lease name used in log messages.
+        """
+        deadline = time.monotonic() + cls.LOCK_TIMEOUT_SECONDS
+        while True:
+            await asyncio.sleep(cls.LEASE_RENEW_INTERVAL_SECONDS)
+            device = device_ref()
+            if not cls._lease_renewable(device, deadline, name):
+                return
+            try:
+                await lock.reacquire()
+            except redis.exceptions.RedisError as e:
+                if device._lease_renewal_failed(e, name):
+                    return
+            del device
+
+    async def _release_lease_async(self):
+        """Cancels the heartbeat task and releases the NBD lease."""
+        if self._lease_task:
+            self._lease_task.cancel()
+            try:
+                await self._lease_task
+            except asyncio.CancelledError:
+                pass
+            self._lease_task = None
+        try:
+            await self.redis_lock.release()
+        except redis.exceptions.LockNotOwnedError:
+            self._lease_expired_before_release()
+        else:
             logger.info(f"Redis lock released: {self.redis_lock.name}")
+
+    async def _wait_for_device_async(self, ready, description: str) -> float:
+        """Polls until a device is ready, see BlockDevice._wait_for_device."""
+        start = time.monotonic()
+        delay = 0.005
+        while not ready():
+            self._check_device_wait(start, description)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        return self._record_device_wait(start, description)
+
+    async def _blkinfo_async(self) -> dict:
+        """Extract device and partition information, see BlockDevice._blkinfo."""
+        process = await self.runner.run_async(self._blkinfo_command())
+        return self._blkinfo_result(process)
+
+    async def _parse_partitions_async(self) -> list:
+        """Parse partition information, see BlockDevice._parse_partitions.
+
+        File system types are probed before the partitions are selected, so
+        _is_important_partition only reads cached types.
+        """
+        devnames = self._probe_devnames()
+        if devnames:
+            process = await self.runner.run_async(self._fstype_probe_command(devnames))
+            self._parse_fstype_probe(devnames, process)
+            for devname in devnames:
+                await self._get_fstype_async(devname)
+        return self._important_partitions()
+
+    async def _get_fstype_async(self, devname: str) -> str:
+        """Analyses the file system type of a device, see BlockDevice._get_fstype.
+
+        Unlike BlockDevice._get_fstype the probed type is cached.
+        """
+        if devname in self.fstypes:
+            return self.fstypes[devname]
+
+        process = await self.runner.run_async(self._fstype_command(devname))
+        self.fstypes[devname] = self._fstype_result(devname, process)
+        return self.fstypes[devname]
+
+    async def mount_async(
+        self,
+        partition_name: str = "",
+        max_workers: int = BlockDevice.MAX_MOUNT_WORKERS,
+        rollback: bool = False,
+    ):
+        """Mounts a disk or one or more partititions, see BlockDevice.mount.
+
+        Args:
+            partitions_name (str): Name of specific partition to mount.
+            max_workers (int): maximum number of concurrent mounts, default MAX_MOUNT_WORKERS
+            rollback (bool): unmount the partitions mounted by this call if any mount fails.
+
+        Returns:
+            list: A list of paths the disk/partitions have been mounted on.
+
+        Raises:
+          RuntimeError: If there was an error running mount.
+        """
+        to_mount = self._select_partitions_to_mount(partition_name)
+        self.mount_failures = {}
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def mount_one(mounttarget):
+            async with semaphore:
+                return await self._mount_partition_async(mounttarget)
+
+        outcomes = await asyncio.gather(
+            *(mount_one(mounttarget) for mounttarget in to_mount),
+            return_exceptions=True,
+        )
+        results = {}
+        for mounttarget, outcome in zip(to_mount, outcomes):
+            if isinstance(outcome, BaseException) and not isinstance(
+                outcome, (RuntimeError, OSError)
+            ):
+                raise outcome
+            results[mounttarget] = outcome
+        mounted = self._record_mounts(results)
+
+        if self.mount_failures:
+            if rollback:
+                logger.info(f"Rolling back mounts: {mounted}")
+                for mountpoint in mounted:
+                    await self._umount_async(mountpoint)
+                    self._forget_mountpoint(mountpoint)
+            raise self._mount_error()
+        return self.mountpoints
+
+    async def _mount_partition_async(self, mounttarget: str) -> str:
+        """Mounts a single disk or partition, see BlockDevice._mount_partition."""
+        logger.info(f"Trying to mount {mounttarget}")
+        fstype = await self._get_fstype_async(mounttarget)
+        mount_folder, candidates = self._prepare_mount(fstype)
+
+        for driver, options in candidates:
+            process = await self.runner.run_async(
+                self._mount_command(driver, options, mounttarget, mount_folder)
+            )
+            if self._mount_result(mounttarget, mount_folder, driver, process):
+                return mount_folder
+
+        self._mount_failed(mounttarget, mount_folder, process)
+
+    async def _umount_async(self, mountpoint: str):
+        """Umounts a single mount_point and removes its folder, see BlockDevice._umount."""
+        process = await self.runner.run_async(self._umount_command(mountpoint))
+        self._umount_result(mountpoint, process)
+
+    async def umount_async(self):
+        """Unmounts all file systems and detaches the block device, see BlockDevice.umount.
+
+        Raises:
+            RuntimeError: If unmounting any of the mount points fails, or if
+                          detaching the block device fails.
+        """
+        record_path = self._registry_record_path()
+        removed = []
+        try:
+            for mountpoint in self.mountpoints:
+                await self._umount_async(mountpoint)
+                removed.append(mountpoint)
+        finally:
+            for mountpoint in removed:
+                self._forget_mountpoint(mountpoint)
+
+        if self.blkdevice:
+            process = await self.runner.run_async(self._detach_command())
+            self._detach_result(process)
+        if self.redis_lock:
+            await self._release_lease_async()
+            self.redis_lock = None
+        self._remove_registry_record(record_path)
+
+
+def _process_starttime(pid: int) -> int | None:
+    """Returns the start time of a process in clock ticks since boot.
+
+    Together with the pid it identifies a process, pids are reused.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf-8") as fh:
+            stat = fh.read()
+    except OSError:
+        return None
+    # The command name can contain spaces, the fields after it can not.
+    return int(stat.rsplit(")", 1)[1].split()[19])
+
+
+def _pid_namespace() -> str | None:
+    """Returns the pid namespace of this process, pids are only comparable within it."""
+    try:
+        return os.readlink("/proc/self/ns/pid")
+    except OSError:
+        return None
+
+
+def _record_owner_alive(record: dict, redis_client) -> bool:
+    """Checks if the process or lease owning a device registry record is alive.
+
+    Args:
+        record (dict): device registry record.
+        redis_client (redis.Redis): client to check leases and shared holders, or None.
+
+    Returns:
+        bool: False only if the owner is known to be gone.
+    """
+    checked = False
+    if record.get("pid_namespace") and record["pid_namespace"] == _pid_namespace():
+        if _process_starttime(record["pid"]) == record.get("starttime"):
+            return True
+        checked = True
+    if redis_client is not None and record.get("registry_key"):
+        holders_key = f"{record['registry_key']}-holders"
+        redis_client.zremrangebyscore(
+            holders_key, "-inf", time.time() - BlockDevice.LEASE_TTL_SECONDS
+        )
+        if redis_client.zcard(holders_key):
+            return True
+    if redis_client is not None and record.get("lock_name"):
+        if redis_client.get(record["lock_name"]) == record["lock_token"].encode():
+            return True
+        checked = True
+    return not checked
+
+
+def _device_matches_record(record: dict) -> bool:
+    """Checks that the device is still attached to the image of the record."""
+    devname = os.path.basename(record["blkdevice"])
+    sysfs_path = os.path.join(BlockDevice.SYSFS_BLOCK_PATH, devname)
+    if devname.startswith("nbd"):
+        return os.path.exists(os.path.join(sysfs_path, "pid"))
+    try:
+        with open(
+            os.path.join(sysfs_path, "loop", "backing_file"), encoding="utf-8"
+        ) as fh:
+            backing_file = fh.read().strip()
+    except OSError:
+        return False
+    return backing_file == os.path.realpath(record["image_path"])
+
+
+def _teardown_record(record: dict, redis_client):
+    """Unmounts, detaches and releases the devices of a stale registry record.
+
+    Raises:
+        RuntimeError: if unmounting or detaching failed.
+    """
+    bd = BlockDevice(record["image_path"])
+    bd.redis_client = redis_client
+    for mountpoint in record["mountpoints"]:
+        if os.path.ismount(mountpoint):
+            bd._umount(mountpoint)
+        elif os.path.isdir(mountpoint):
+            os.rmdir(mountpoint)
+    if _device_matches_record(record):
+        bd.blkdevice = record["blkdevice"]
+        bd._detach_device()
+    if redis_client is not None and record.get("lock_name"):
+        bd.redis_lock = redis_client.lock(
+            name=record["lock_name"], timeout=BlockDevice.LEASE_TTL_SECONDS
+        )
+        bd.redis_lock.local.token = record["lock_token"].encode()
+        bd._release_lease()
+    if redis_client is not None and record.get("registry_key"):
+        redis_client.delete(record["registry_key"], f"{record['registry_key']}-holders")
+
+
+def reap_stale_devices(registry_dir: str | None = None, redis_client=None) -> list:
+    """Unmounts and detaches the devices of BlockDevices whose owner died.
+
+    Every BlockDevice records its device, mountpoints, pid and NBD lease in a node
+    local registry. A record is stale if its process is gone (same pid namespace
+    only) or its lease expired, and for SharedBlockDevices no holder is left.
+    Records whose owner can not be checked are kept.
+
+    Args:
+        registry_dir (str): registry folder, default OPENRELIK_DEVICE_REGISTRY_DIR or
+            DEVICE_REGISTRY_DIR.
+        redis_client (redis.Redis): client to check NBD leases and shared mounts.
+
+    Returns:
+        list: the block devices of the reaped records.
+    """
+    registry_dir = registry_dir or os.getenv(
+        "OPENRELIK_DEVICE_REGISTRY_DIR", DEVICE_REGISTRY_DIR
+    )
+    reaped = []
+    for record_path in sorted(glob.glob(os.path.join(registry_dir, "*.json"))):
+        try:
+            fh = open(record_path, encoding="utf-8")
+        except FileNotFoundError:
+            continue
+        with fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another reaper is handling this record.
+                continue
+            try:
+                record = json.load(fh)
+            except json.JSONDecodeError:
+                logger.warning(f"Removing malformed device record {record_path}")
+                os.remove(record_path)
+                continue
+            if _record_owner_alive(record, redis_client):
+                continue
+
+            logger.warning(
+                f"Reaping {record['blkdevice']} of {record['image_path']}, "
+                f"owner pid {record['pid']} is gone"
+            )
+            try:
+                _teardown_record(record, redis_client)
+            except RuntimeError as e:
+                logger.error(f"Error reaping {record['blkdevice']}: {e}")
+                continue
+            # The record may have been replaced by a new owner of the device.
+            try:
+                if os.path.samestat(os.fstat(fh.fileno()), os.stat(record_path)):
+                    os.remove(record_path)
+            except FileNotFoundError:
+                pass
+            reaped.append(record["blkdevice"])
+    return reaped
+
+
+def start_device_reaper(
+    interval_seconds: float = 60, registry_dir: str | None = None, redis_client=None
+) -> threading.Event:
+    """Reaps stale devices now and then every interval_seconds in a daemon thread.
+
+    Call this once at worker startup.
+
+    Args:
+        interval_seconds (float): seconds between reaper runs.
+        registry_dir (str): registry folder, see reap_stale_devices.
+        redis_client (redis.Redis): client to check NBD leases and shared mounts.
+
+    Returns:
+        threading.Event: set it to stop the reaper.
+    """
+    stop = threading.Event()
+
+    def run():
+        while True:
+            try:
+                reap_stale_devices(registry_dir, redis_client)
+            except (OSError, redis.exceptions.RedisError) as e:
+                logger.error(f"Error reaping stale devices: {e}")
+            if stop.wait(interval_seconds):
+                return
+
+    threading.Thread(target=run, name="device-reaper", daemon=True).start()
+    return stop
@@ -0,0 +1,794 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Pure Python partition table parsing for raw and qcow2 disk images.
+
+The partition layout of an image can be read without sudo, loop or NBD devices:
+
+    ```
+    partitions = partition_utils.read_partitions("/path/to/image.qcow2")
+    for partition in partitions:
+        print(partition.number, partition.offset, partition.size, partition.type_id)
+    ```
+
+PartitionReader gives file-like access to the raw bytes of a single partition.
+"""
+
+import io
+import logging
+import mmap
+import os
+import struct
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+
+from .mount_utils import detect_image_format
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SECTOR_SIZE = 512
+GPT_SECTOR_SIZES = (512, 4096)
+GPT_SIGNATURE = b"EFI PART"
+MBR_SIGNATURE = b"\x55\xaa"
+MBR_PROTECTIVE_TYPE = 0xEE
+MBR_EXTENDED_TYPES = (0x05, 0x0F, 0x85)
+MAX_LOGICAL_PARTITIONS = 128
+QCOW2_MAGIC = b"QFI\xfb"
+# qcow2 incompatible feature bits that still allow reading: dirty and corrupt.
+QCOW2_SUPPORTED_INCOMPATIBLE_FEATURES = 0b11
+QCOW2_OFFSET_MASK = 0x00FFFFFFFFFFFE00
+QCOW2_COMPRESSED_FLAG = 1 << 62
+QCOW2_ZERO_FLAG = 1
+# Limits from the qemu qcow2 driver: 512 byte to 2 MiB clusters, 32 MiB L1 table
+# and 1023 byte backing file names.
+QCOW2_MIN_CLUSTER_BITS = 9
+QCOW2_MAX_CLUSTER_BITS = 21
+QCOW2_MAX_L1_BYTES = 32 * 1024 * 1024
+QCOW2_MAX_BACKING_FILE_SIZE = 1023
+QCOW2_MAX_BACKING_CHAIN = 16
+# Raw L2 tables kept per image, least recently used first evicted. 32 MiB maps 2 TiB
+# of guest data with the default 64 KiB clusters.
+QCOW2_L2_CACHE_BYTES = 32 * 1024 * 1024
+GPT_MIN_ENTRY_SIZE = 128
+GPT_MAX_ENTRIES_BYTES = 1024 * 1024
+# Boot sector OEM names and file system labels of unpartitioned volumes.
+VOLUME_BOOT_SECTOR_MARKERS = ((3, b"NTFS    "), (54, b"FAT"), (82, b"FAT32"))
+
+
+class Partition:
+    """A partition found in a partition table.
+
+    Attributes:
+        number (int): partition number as used by the kernel (loop0p<number>). MBR
+            logical partitions start at 5, 0 is the whole disk if there is no table.
+        offset (int): offset of the partition in the image in bytes.
+        size (int): size of the partition in bytes.
+        scheme (str): "mbr", "gpt" or "none".
+        type_id (str): GPT partition type GUID or MBR partition type, e.g. "0x83".
+        guid (str): GPT unique partition GUID, None for MBR.
+        name (str): GPT partition name, empty for MBR.
+        bootable (bool): MBR active flag.
+    """
+
+    def __init__(
+        self,
+        number: int,
+        offset: int,
+        size: int,
+        scheme: str,
+        type_id: str,
+        guid: str = None,
+        name: str = "",
+        bootable: bool = False,
+    ):
+        self.number = number
+        self.offset = offset
+        self.size = size
+        self.scheme = scheme
+        self.type_id = type_id
+        self.guid = guid
+        self.name = name
+        self.bootable = bootable
+
+    def __repr__(self):
+        return (
+            f"Partition(number={self.number}, offset={self.offset}, size={self.size}, "
+            f"scheme={self.scheme!r}, type_id={self.type_id!r})"
+        )
+
+    def to_dict(self):
+        """Return a dictionary representation of the Partition object."""
+        return {
+            "number": self.number,
+            "offset": self.offset,
+            "size": self.size,
+            "scheme": self.scheme,
+            "type_id": self.type_id,
+            "guid": self.guid,
+            "name": self.name,
+            "bootable": self.bootable,
+        }
+
+
+class RawImage:
+    """Reads a raw disk image with pread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self._fd).st_size
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Reads length bytes at offset, short reads only happen at the end of the image."""
+        return os.pread(self._fd, length, offset)
+
+    def readinto(self, offset: int, buffer) -> int:
+        """Reads into a writable buffer at offset without an intermediate copy.
+
+        Returns:
+            int: number of bytes read.
+        """
+        return os.preadv(self._fd, [buffer], offset)
+
+    def close(self):
+        """Closes the image file."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Qcow2Image(RawImage):
+    """Reads the guest view of a qcow2 image through its L1/L2 cluster map.
+
+    Unallocated clusters are read from the backing file if there is one, otherwise
+    they read as zeros. Backing files must be relative paths inside the folder of
+    the image. Encrypted images, external data files, extended L2 entries and non
+    zlib compression are not supported.
+    """
+
+    def __init__(self, path: str, backing_depth: int = 0):
+        """Initialize Qcow2Image class instance.
+
+        Args:
+            path (str): path to the qcow2 image.
+            backing_depth (int): number of images above this one in the backing chain.
+
+        Raises:
+            RuntimeError: if the image or its backing chain is not supported.
+        """
+        super().__init__(path)
+        self.backing_depth = backing_depth
+        try:
+            self._parse_header()
+        except Exception:
+            self.close()
+            raise
+        self._l2_cache = OrderedDict()
+        self._l2_cache_lock = threading.Lock()
+
+    def _parse_header(self):
+        """Parses the qcow2 header and loads the L1 table.
+
+        Raises:
+            RuntimeError: if the image is not a supported qcow2 image.
+        """
+        header = os.pread(self._fd, 104, 0)
+        if len(header) < 80 or header[:4] != QCOW2_MAGIC:
+            raise RuntimeError(f"Error reading qcow2 image {self.path}: bad magic")
+        (
+            version,
+            backing_file_offset,
+            backing_file_size,
+            self.cluster_bits,
+            self.size,
+            crypt_method,
+            l1_size,
+            l1_table_offset,
+        ) = struct.unpack(">IQIIQIIQ", header[4:48])
+        if version not in (2, 3):
+            raise RuntimeError(
+                f"Error reading qcow2 image {self.path}: unsupported version {version}"
+            )
+        if crypt_method:
+            raise RuntimeError(f"Error reading qcow2 image {self.path}: encrypted")
+        if version == 3:
+            (incompatible_features,) = struct.unpack(">Q", header[72:80])
+            if incompatible_features & ~QCOW2_SUPPORTED_INCOMPATIBLE_FEATURES:
+                raise RuntimeError(
+                    f"Error reading qcow2 image {self.path}: unsupported incompatible "
+                    f"features {incompatible_features:#x}"
+                )
+
+        if not QCOW2_MIN_CLUSTER_BITS <= self.cluster_bits <= QCOW2_MAX_CLUSTER_BITS:
+            raise RuntimeError(
+                f"Error reading qcow2 image {self.path}: unsupported cluster bits "
+                f"{self.cluster_bits}"
+            )
+        if l1_size * 8 > QCOW2_MAX_L1_BYTES:
+            raise RuntimeError(
+                f"Error reading qcow2 image {self.path}: L1 table too large"
+            )
+
+        self.cluster_size = 1 << self.cluster_bits
+        self.l2_entries = self.cluster_size // 8
+        l1_table = os.pread(self._fd, l1_size * 8, l1_table_offset)
+        if len(l1_table) != l1_size * 8:
+            raise RuntimeError(
+                f"Error reading qcow2 image {self.path}: L1 table outside of the image"
+            )
+        self.l1_table = struct.unpack(f">{l1_size}Q", l1_table)
+
+        self.backing = None
+        if backing_file_offset:
+            self.backing = self._open_backing(backing_file_offset, backing_file_size)
+
+    def _open_backing(self, offset: int, size: int) -> RawImage:
+        """Opens the backing file named in the header.
+
+        Only relative names resolving inside the folder of the image are followed, a
+        crafted image must not make the reader open arbitrary files on the host.
+
+        Raises:
+            RuntimeError: if the backing file name or chain is not supported.
+        """
+        if self.backing_depth >= QCOW2_MAX_BACKING_CHAIN:
+            raise RuntimeError(
+                f"Error reading qcow2 image {self.path}: backing chain longer than "
+                f"{QCOW2_MAX_BACKING_CHAIN} images"
+            )
+        if size > QCOW2_MAX_BACKING_FILE_SIZE:
+            raise RuntimeError(
+                f"Error reading qcow2 image {self.path}: backing file name too long"
+            )
+        try:
+            backing_file = os.pread(self._fd, size, offset).decode()
+        except UnicodeDecodeError:
+            raise RuntimeError(
+                f"Error reading qcow2 image {self.path}: invalid backing file name"
+            )
+        folder = os.path.realpath(os.path.dirname(self.path))
+        backing_path = os.path.realpath(os.path.join(folder, backing_file))
+        if (
+            not backing_file
+            or os.path.isabs(backing_file)
+            or os.path.commonpath([folder, backing_path]) != folder
+        ):
+            raise RuntimeError(
+                f"Error reading qcow2 image {self.path}: backing file {backing_file} "
+                "outside of the image folder"
+            )
+        return _open_image(backing_path, self.backing_depth + 1)
+
+    def close(self):
+        """Closes the image and its backing file."""
+        if getattr(self, "backing", None):
+            self.backing.close()
+            self.backing = None
+        super().close()
+
+    def _l2_table(self, l2_offset: int) -> bytes:
+        """Returns the raw L2 table at l2_offset, caching up to QCOW2_L2_CACHE_BYTES.
+
+        Raises:
+            RuntimeError: if the L2 table is outside of the image.
+        """
+        with self._l2_cache_lock:
+            table = self._l2_cache.get(l2_offset)
+            if table is not None:
+                self._l2_cache.move_to_end(l2_offset)
+                return table
+        table = os.pread(self._fd, self.cluster_size, l2_offset)
+        if len(table) != self.cluster_size:
+            raise RuntimeError(
+                f"Error reading qcow2 image {self.path}: L2 table at {l2_offset} "
+                "outside of the image"
+            )
+        with self._l2_cache_lock:
+            self._l2_cache[l2_offset] = table
+            while len(self._l2_cache) * self.cluster_size > QCOW2_L2_CACHE_BYTES:
+                self._l2_cache.popitem(last=False)
+        return table
+
+    def _read_cluster(self, guest_offset: int, skip: int, length: int) -> bytes:
+        """Reads length bytes starting skip bytes into the cluster at guest_offset."""
+        cluster_index = guest_offset >> self.cluster_bits
+        l1_index, l2_index = divmod(cluster_index, self.l2_entries)
+        entry = 0
+        if l1_index < len(self.l1_table):
+            l2_offset = self.l1_table[l1_index] & QCOW2_OFFSET_MASK
+            if l2_offset:
+                (entry,) = struct.unpack_from(
+                    ">Q", self._l2_table(l2_offset), l2_index * 8
+                )
+
+        if entry & QCOW2_COMPRESSED_FLAG:
+            return self._read_compressed(entry)[skip : skip + length]
+        host_offset = entry & QCOW2_OFFSET_MASK
+        if entry & QCOW2_ZERO_FLAG:
+            return bytes(length)
+        if host_offset:
+            return os.pread(self._fd, length, host_offset + skip)
+        if self.backing:
+            return self.backing.read(guest_offset + skip, length).ljust(length, b"\0")
+        return bytes(length)
+
+    def _read_compressed(self, entry: int) -> bytes:
+        """Reads and inflates a compressed cluster."""
+        offset_bits = 62 - (self.cluster_bits - 8)
+        host_offset = entry & ((1 << offset_bits) - 1)
+        sectors = ((entry >> offset_bits) & ((1 << (62 - offset_bits)) - 1)) + 1
+        length = sectors * SECTOR_SIZE - (host_offset & (SECTOR_SIZE - 1))
+        data = os.pread(self._fd, length, host_offset)
+        return zlib.decompressobj(-12).decompress(data, self.cluster_size)
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Reads length bytes at guest offset, short reads only happen at the end."""
+        length = max(0, min(length, self.size - offset))
+        chunks = []
+        while length:
+            skip = offset & (self.cluster_size - 1)
+            chunk = min(length, self.cluster_size - skip)
+            chunks.append(self._read_cluster(offset - skip, skip, chunk))
+            offset += chunk
+            length -= chunk
+        return b"".join(chunks)
+
+    def readinto(self, offset: int, buffer) -> int:
+        """Reads into a writable buffer at guest offset.
+
+        Returns:
+            int: number of bytes read.
+        """
+        data = self.read(offset, len(buffer))
+        memoryview(buffer)[: len(data)] = data
+        return len(data)
+
+
+def open_image(path: str) -> RawImage:
+    """Opens a raw or qcow2 image for reading, detected by header magic.
+
+    Args:
+        path (str): path to the disk image.
+
+    Returns:
+        RawImage: RawImage or Qcow2Image instance, use as context manager or close().
+
+    Raises:
+        RuntimeError: if the image is in another container format, e.g. VMDK, VHD,
+            VHDX or VDI, or is not a supported qcow2 image.
+    """
+    return _open_image(path, 0)
+
+
+def _open_image(path: str, backing_depth: int) -> RawImage:
+    """Opens a raw or qcow2 image at backing_depth in a backing chain."""
+    with open(path, "rb") as fh:
+        magic = fh.read(4)
+    if magic == QCOW2_MAGIC:
+        return Qcow2Image(path, backing_depth)
+    # Other containers would read as raw and return their metadata as disk bytes.
+    image_format = detect_image_format(path)
+    if image_format not in (None, "qcow2"):
+        raise RuntimeError(
+            f"Error reading image {path}: unsupported image format {image_format}, "
+            "only raw and qcow2 images can be read"
+        )
+    return RawImage(path)
+
+
+class PartitionReader(io.RawIOBase):
+    """Read-only, seekable file-like view of one partition of a disk image.
+
+    Reads are positional (pread), so a reader can be shared between threads through
+    pread() and view(). With use_mmap the partition of a raw image is memory mapped
+    and view() returns zero-copy memoryviews. readinto() reads straight into the
+    caller's buffer, so io.BufferedReader and large reads avoid an extra copy.
+
+    Usage:
+        ```
+        partition = partition_utils.read_partitions(image_path)[0]
+        with PartitionReader.from_partition(image_path, partition) as reader:
+            header = reader.read(4096)
+        ```
+    """
+
+    def __init__(
+        self, image_path: str, offset: int, length: int, use_mmap: bool = False
+    ):
+        """Initialize PartitionReader class instance.
+
+        Args:
+            image_path (str): path to a raw or qcow2 disk image.
+            offset (int): offset of the partition in the image in bytes.
+            length (int): size of the partition in bytes.
+            use_mmap (bool): memory map the partition, raw images only.
+
+        Raises:
+            RuntimeError: if the image is not a raw or qcow2 image, or the partition
+                is outside the image or can not be mapped.
+        """
+        super().__init__()
+        self.image = open_image(image_path)
+        self.offset = offset
+        self.length = length
+        self._position = 0
+        self._mmap = None
+        self._view = None
+        if offset < 0 or length < 0 or offset + length > self.image.size:
+            self.image.close()
+            raise RuntimeError(
+                f"Error reading partition: {offset}+{length} outside of {image_path}"
+            )
+        if use_mmap:
+            self._map()
+
+    @classmethod
+    def from_partition(cls, image_path: str, partition: Partition, **kwargs):
+        """Creates a reader for a Partition returned by read_partitions().
+
+        Args:
+            image_path (str): path to the disk image the partition was read from.
+            partition (Partition): partition to read.
+            **kwargs: passed on to PartitionReader.
+        """
+        return cls(image_path, partition.offset, partition.size, **kwargs)
+
+    @classmethod
+    def from_block_device(cls, block_device, partition_name: str, **kwargs):
+        """Creates a reader for a partition found by BlockDevice._parse_partitions().
+
+        The partition offset and size are taken from sysfs, so this works for the
+        loop and NBD devices set up by BlockDevice.setup().
+
+        Args:
+            block_device (BlockDevice): set up BlockDevice instance.
+            partition_name (str): partition device, e.g. /dev/loop0p1.
+            **kwargs: passed on to PartitionReader.
+
+        Raises:
+            RuntimeError: if the partition is not a partition of the block device, or
+                the image is not a raw or qcow2 image.
+        """
+        disk = os.path.basename(block_device.blkdevice)
+        name = os.path.basename(partition_name)
+        sysfs_path = os.path.join(block_device.SYSFS_BLOCK_PATH, disk, name)
+        try:
+            with open(os.path.join(sysfs_path, "start"), encoding="utf-8") as fh:
+                start = int(fh.read())
+            with open(os.path.join(sysfs_path, "size"), encoding="utf-8") as fh:
+                size = int(fh.read())
+        except (OSError, ValueError) as e:
+            raise RuntimeError(
+                f"Error reading partition {partition_name} of {block_device.blkdevice}: {e}"
+            )
+        # sysfs reports 512 byte sectors regardless of the logical sector size.
+        return cls(
+            block_device.image_path, start * SECTOR_SIZE, size * SECTOR_SIZE, **kwargs
+        )
+
+    def _map(self):
+        """Memory maps the partition range of a raw image."""
+        if isinstance(self.image, Qcow2Image):
+            self.image.close()
+            raise RuntimeError("Error reading partition: mmap needs a raw image")
+        if not self.length:
+            return
+        start = self.offset - self.offset % mmap.ALLOCATIONGRANULARITY
+        self._mmap = mmap.mmap(
+            self.image._fd,
+            self.offset + self.length - start,
+            access=mmap.ACCESS_READ,
+            offset=start,
+        )
+        self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        skip = self.offset - start
+        self._view = memoryview(self._mmap)[skip : skip + self.length]
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._position = offset
+        return self._position
+
+    def _clamp(self, offset: int, length: int) -> int:
+        """Returns the number of bytes of a read that lie within the partition."""
+        return max(0, min(length, self.length - offset))
+
+    def view(self, offset: int, length: int) -> memoryview:
+        """Returns a zero-copy view of the partition, needs use_mmap.
+
+        The view is only valid until the reader is closed.
+
+        Args:
+            offset (int): offset in the partition.
+            length (int): number of bytes.
+        """
+        if self._view is None and self.length:
+            raise RuntimeError("Error reading partition: view() needs use_mmap")
+        if self._view is None:
+            return memoryview(b"")
+        return self._view[offset : offset + self._clamp(offset, length)]
+
+    def pread(self, offset: int, length: int) -> bytes:
+        """Reads length bytes at offset in the partition without moving the position.
+
+        Args:
+            offset (int): offset in the partition.
+            length (int): number of bytes, reads are truncated at the partition end.
+        """
+        length = self._clamp(offset, length)
+        if self._view is not None:
+            return self._view[offset : offset + length].tobytes()
+        return self.image.read(self.offset + offset, length)
+
+    def readinto(self, buffer) -> int:
+        length = self._clamp(self._position, len(buffer))
+        if not length:
+            return 0
+        if self._view is not None:
+            memoryview(buffer)[:length] = self._view[
+                self._position : self._position + length
+            ]
+            read = length
+        else:
+            read = self.image.readinto(
+                self.offset + self._position, memoryview(buffer)[:length]
+            )
+        self._position += read
+        return read
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.length - self._position
+        data = self.pread(self._position, size)
+        self._position += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def close(self):
+        """Closes the mapping and the image."""
+        if self.closed:
+            return
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views handed out by view() are still alive, the mapping is
+                # unmapped once they are garbage collected.
+                logger.warning("Partition views still in use, deferring unmap")
+            self._mmap = None
+        self.image.close()
+        super().close()
+
+
+def read_partitions(image_path: str) -> list:
+    """Reads the GPT or MBR partition table, including logical partitions, of an image.
+
+    Args:
+        image_path (str): path to a raw or qcow2 disk image.
+
+    Returns:
+        list: Partition instances ordered by partition number, empty if the image has
+            no partition table.
+
+    Raises:
+        RuntimeError: if the image can not be read.
+    """
+    with open_image(image_path) as image:
+        for sector_size in GPT_SECTOR_SIZES:
+            if image.read(sector_size, 8) == GPT_SIGNATURE:
+                return _parse_gpt(image, sector_size)
+        return _parse_mbr(image)
+
+
+def select_partitions(image_path: str, min_partition_size: int) -> list:
+    """Selects the partitions worth mounting without setting up a block device.
+
+    Mirrors what BlockDevice would mount: partitions of at least min_partition_size,
+    or the whole image if it has no partition table. Extended and protective MBR
+    entries are never returned. An empty result means the image can be skipped.
+
+    Args:
+        image_path (str): path to a raw or qcow2 disk image.
+        min_partition_size (int): minimum partition size in bytes.
+
+    Returns:
+        list: selected Partition instances.
+
+    Raises:
+        RuntimeError: if the image is not a raw or qcow2 image, or can not be read.
+    """
+    partitions = read_partitions(image_path)
+    if not partitions:
+        with open_image(image_path) as image:
+            partitions = [Partition(0, 0, image.size, "none", "")]
+    return [
+        partition for partition in partitions if partition.size >= min_partition_size
+    ]
+
+
+def _parse_gpt(image: RawImage, sector_size: int) -> list:
+    """Parses the GPT partition entries.
+
+    Args:
+        image (RawImage): image to read from.
+        sector_size (int): logical sector size the GPT header was found at.
+
+    Returns:
+        list: Partition instances.
+
+    Raises:
+        RuntimeError: if the GPT header is truncated or its entry array is invalid.
+    """
+    header = image.read(sector_size, 92)
+    if len(header) < 88:
+        raise RuntimeError(f"Error reading GPT of {image.path}: truncated header")
+    entries_lba, entry_count, entry_size = struct.unpack("<QII", header[72:88])
+    entries_offset = entries_lba * sector_size
+    if (
+        entry_size < GPT_MIN_ENTRY_SIZE
+        or entry_count * entry_size > GPT_MAX_ENTRIES_BYTES
+        or entries_offset >= image.size
+    ):
+        raise RuntimeError(
+            f"Error reading GPT of {image.path}: invalid partition entry array "
+            f"({entry_count} entries of {entry_size} bytes at LBA {entries_lba})"
+        )
+    entries = image.read(entries_offset, entry_count * entry_size)
+
+    partitions = []
+    for index in range(entry_count):
+        entry = entries[index * entry_size : (index + 1) * entry_size]
+        if len(entry) < 128:
+            break
+        type_guid = uuid.UUID(bytes_le=entry[0:16])
+        if type_guid.int == 0:
+            continue
+        first_lba, last_lba = struct.unpack("<QQ", entry[32:48])
+        partitions.append(
+            Partition(
+                number=index + 1,
+                offset=first_lba * sector_size,
+                size=(last_lba - first_lba + 1) * sector_size,
+                scheme="gpt",
+                type_id=str(type_guid),
+                guid=str(uuid.UUID(bytes_le=entry[16:32])),
+                name=entry[56:128].decode("utf-16-le", "replace").rstrip("\0"),
+            )
+        )
+    return partitions
+
+
+def _mbr_entries(sector: bytes) -> list:
+    """Returns (bootable, type, start_lba, sectors) for the four MBR entries."""
+    entries = []
+    for index in range(4):
+        entry = sector[446 + index * 16 : 446 + (index + 1) * 16]
+        status, partition_type = entry[0], entry[4]
+        start_lba, sectors = struct.unpack("<II", entry[8:16])
+        entries.append((status, partition_type, start_lba, sectors))
+    return entries
+
+
+def _parse_mbr(image: RawImage) -> list:
+    """Parses the MBR partition entries and the EBR chain of an extended partition.
+
+    Args:
+        image (RawImage): image to read from.
+
+    Returns:
+        list: Partition instances, empty if sector 0 holds no valid MBR.
+    """
+    sector = image.read(0, SECTOR_SIZE)
+    if len(sector) < SECTOR_SIZE or sector[510:512] != MBR_SIGNATURE:
+        return []
+    if any(
+        sector[pos : pos + len(marker)] == marker
+        for pos, marker in VOLUME_BOOT_SECTOR_MARKERS
+    ):
+        # A file system boot sector, not a partition table.
+        return []
+
+    entries = _mbr_entries(sector)
+    image_sectors = image.size // SECTOR_SIZE
+    for status, partition_type, start_lba, sectors in entries:
+        if status not in (0x00, 0x80):
+            return []
+        if partition_type and start_lba + sectors > image_sectors:
+            return []
+
+    partitions = []
+    for index, (status, partition_type, start_lba, sectors) in enumerate(entries):
+        if not partition_type or not sectors:
+            continue
+        if partition_type in MBR_EXTENDED_TYPES:
+            partitions.extend(_parse_ebr_chain(image, start_lba))
+            continue
+        if partition_type == MBR_PROTECTIVE_TYPE:
+            continue
+        partitions.append(
+            Partition(
+                number=index + 1,
+                offset=start_lba * SECTOR_SIZE,
+                size=sectors * SECTOR_SIZE,
+                scheme="mbr",
+                type_id=f"{partition_type:#04x}",
+                bootable=status == 0x80,
+            )
+        )
+    return sorted(partitions, key=lambda partition: partition.number)
+
+
+def _parse_ebr_chain(image: RawImage, extended_lba: int) -> list:
+    """Follows the EBR chain of an extended partition.
+
+    Args:
+        image (RawImage): image to read from.
+        extended_lba (int): first sector of the extended partition.
+
+    Returns:
+        list: logical Partition instances numbered from 5.
+    """
+    partitions = []
+    ebr_lba = extended_lba
+    seen = set()
+    while len(partitions) < MAX_LOGICAL_PARTITIONS and ebr_lba not in seen:
+        seen.add(ebr_lba)
+        sector = image.read(ebr_lba * SECTOR_SIZE, SECTOR_SIZE)
+        if len(sector) < SECTOR_SIZE or sector[510:512] != MBR_SIGNATURE:
+            logger.warning(f"Invalid EBR at sector {ebr_lba} in {image.path}")
+            break
+        logical, chain = _mbr_entries(sector)[:2]
+        status, partition_type, start_lba, sectors = logical
+        if partition_type and sectors:
+            partitions.append(
+                Partition(
+                    number=5 + len(partitions),
+                    offset=(ebr_lba + start_lba) * SECTOR_SIZE,
+                    size=sectors * SECTOR_SIZE,
+                    scheme="mbr",
+                    type_id=f"{partition_type:#04x}",
+                    bootable=status == 0x80,
+                )
+            )
+        if chain[1] not in MBR_EXTENDED_TYPES or not chain[2]:
+            break
+        ebr_lba = extended_lba + chain[2]
+    return partitions
@@ -17,8 +17,11 @@ import shutil
 import subprocess
 import tempfile
 import threading
+import time
 from typing import List
 
+from .command_utils import record_command
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -105,6 +108,7 @@ def bruteforce_password_hashes(
 
   with open(os.devnull, "w", encoding="utf-8") as devnull:
     try:
+      start = time.perf_counter()
       child = subprocess.Popen(cmd, stdout=devnull, stderr=devnull)
       timer = threading.Timer(timeout, child.terminate)
       timer.start()
@@ -112,6 +116,7 @@ def bruteforce_password_hashes(
       # Cancel the timer if the process is done before the timer.
       if timer.is_alive():
         timer.cancel()
+      record_command(cmd, time.perf_counter() - start, child.returncode)
     except OSError as exception:
       raise RuntimeError(f'{" ".join(cmd)} failed: {exception}') from exception
 
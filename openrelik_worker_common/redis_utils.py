@@ -0,0 +1,221 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shared Redis clients.
+
+Clients returned by get_redis_client share one connection pool per Redis URL, so
+tasks reuse TCP connections instead of opening new ones for every image:
+
+    ```
+    redis_client = redis_utils.get_redis_client(os.getenv("REDIS_URL"))
+    ...
+    print(redis_utils.connection_stats())
+    ```
+
+Pools are per process, a forked child starts without pools and never uses the
+connections of its parent. asyncio clients from get_async_redis_client share one
+pool per URL and event loop.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import weakref
+from urllib.parse import urlsplit, urlunsplit
+
+import redis
+import redis.asyncio
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_REDIS_URL = "redis://localhost:6379/0"
+
+
+class _CountingConnectionPool(redis.ConnectionPool):
+    """ConnectionPool counting connection checkouts and new connections."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.connections_created = 0
+
+    def make_connection(self):
+        self.connections_created += 1
+        return super().make_connection()
+
+    def get_connection(self, *args, **kwargs):
+        self.checkouts += 1
+        return super().get_connection(*args, **kwargs)
+
+
+class _CountingAsyncConnectionPool(redis.asyncio.ConnectionPool):
+    """asyncio ConnectionPool counting connection checkouts and new connections."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.connections_created = 0
+
+    def make_connection(self):
+        self.connections_created += 1
+        return super().make_connection()
+
+    async def get_connection(self, *args, **kwargs):
+        self.checkouts += 1
+        return await super().get_connection(*args, **kwargs)
+
+
+_lock = threading.Lock()
+_pid = os.getpid()
+_pools = {}
+_async_pools = weakref.WeakKeyDictionary()
+_clients = {}
+
+
+def _reset_after_fork():
+    """Drops the pools of the parent process in a forked child."""
+    global _lock, _pid, _pools, _async_pools, _clients
+    _lock = threading.Lock()
+    _pid = os.getpid()
+    _pools = {}
+    _async_pools = weakref.WeakKeyDictionary()
+    _clients = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_redis_client(url: str | None = None) -> redis.Redis:
+    """Returns a Redis client on the shared connection pool of url.
+
+    Args:
+        url (str): Redis URL, default REDIS_URL from the environment or
+            DEFAULT_REDIS_URL.
+
+    Returns:
+        redis.Redis: client sharing its connections with the other clients of url.
+    """
+    url = url or os.getenv("REDIS_URL") or DEFAULT_REDIS_URL
+    if os.getpid() != _pid:
+        # The at fork hook did not run, e.g. after a fork outside of os.fork.
+        _reset_after_fork()
+    with _lock:
+        pool = _pools.get(url)
+        if pool is None:
+            pool = _CountingConnectionPool.from_url(url)
+            _pools[url] = pool
+            logger.info(f"Created Redis connection pool for {_redact(url)}")
+        _clients[url] = _clients.get(url, 0) + 1
+    return redis.Redis(connection_pool=pool)
+
+
+def get_async_redis_client(url: str | None = None) -> redis.asyncio.Redis:
+    """Returns an asyncio Redis client on the shared pool of url and the running loop.
+
+    Closing the client leaves the pool open for the other clients.
+
+    Args:
+        url (str): Redis URL, default REDIS_URL from the environment or
+            DEFAULT_REDIS_URL.
+
+    Returns:
+        redis.asyncio.Redis: client sharing its connections with the other clients of
+            url on the running event loop.
+
+    Raises:
+        RuntimeError: if there is no running event loop.
+    """
+    url = url or os.getenv("REDIS_URL") or DEFAULT_REDIS_URL
+    loop = asyncio.get_running_loop()
+    if os.getpid() != _pid:
+        _reset_after_fork()
+    with _lock:
+        pools = _async_pools.setdefault(loop, {})
+        pool = pools.get(url)
+        if pool is None:
+            pool = _CountingAsyncConnectionPool.from_url(url)
+            pools[url] = pool
+            logger.info(f"Created asyncio Redis connection pool for {_redact(url)}")
+        _clients[url] = _clients.get(url, 0) + 1
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+def connection_stats() -> dict:
+    """Returns connection reuse statistics per Redis URL, passwords are redacted.
+
+    The counters are updated without locking and may be slightly off under load.
+
+    Returns:
+        dict: per URL the number of clients handed out, connection checkouts, new
+            connections, reused connections and the connections currently in use
+            and idle.
+    """
+    with _lock:
+        pools = list(_pools.items())
+        pools += [
+            (url, pool)
+            for loop_pools in list(_async_pools.values())
+            for url, pool in loop_pools.items()
+        ]
+        clients = dict(_clients)
+
+    stats = {}
+    for url, pool in pools:
+        url_stats = stats.setdefault(
+            _redact(url),
+            {
+                "clients": clients.get(url, 0),
+                "pools": 0,
+                "checkouts": 0,
+                "connections_created": 0,
+                "connections_reused": 0,
+                "in_use": 0,
+                "idle": 0,
+            },
+        )
+        url_stats["pools"] += 1
+        url_stats["checkouts"] += pool.checkouts
+        url_stats["connections_created"] += pool.connections_created
+        url_stats["connections_reused"] += max(
+            pool.checkouts - pool.connections_created, 0
+        )
+        url_stats["in_use"] += len(pool._in_use_connections)
+        url_stats["idle"] += len(pool._available_connections)
+    return stats
+
+
+def reset_pools():
+    """Disconnects and drops all shared connection pools of this process.
+
+    asyncio pools are dropped without awaiting their disconnect, close them from
+    their event loop first if their connections must be closed cleanly.
+    """
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        _async_pools.clear()
+        _clients.clear()
+    for pool in pools:
+        pool.disconnect()
+
+
+def _redact(url: str) -> str:
+    """Replaces the password of a Redis URL with ***."""
+    parts = urlsplit(url)
+    if not parts.password:
+        return url
+    netloc = parts.netloc.replace(f":{parts.password}@", ":***@", 1)
+    return urlunsplit(parts._replace(netloc=netloc))
@@ -1,9 +1,21 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from openrelik_worker_common.archive_utils import extract_archive
+from openrelik_worker_common import archive_utils
+from openrelik_worker_common.archive_utils import (
+    extract_archive,
+    extract_archive_to_output_files,
+)
+from openrelik_worker_common.command_utils import CommandTimer
+from openrelik_worker_common.file_utils import create_output_file
+import hashlib
+import io
+import json
 import os
 import shutil
 import subprocess
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
 
 
@@ -159,5 +171,772 @@ class TestArchiveUtils(unittest.TestCase):
                 input_file, self.output_folder, self.log_file, self.file_filter
             )
 
+    @patch("subprocess.call")
+    @patch("shutil.which")
+    def test_extract_archive_filter_normalized(self, mock_which, mock_subprocess_call):
+        input_file = {"path": "/path/to/archive.zip", "display_name": "archive.zip"}
+        mock_which.return_value = True
+        mock_subprocess_call.return_value = 0
+
+        file_filter = [" *.txt ", "*.txt", "", "Windows\\System32\\*.evtx"]
+        result = extract_archive(
+            input_file, self.output_folder, self.log_file, file_filter
+        )
+        command = mock_subprocess_call.call_args[0][0]
+        self.assertEqual(command[-2:], ["*.txt", "Windows/System32/*.evtx"])
+        self.assertEqual(result[0].count("*.txt"), 1)
+
+    @patch("subprocess.call")
+    @patch("shutil.which")
+    def test_extract_archive_zip_filter_list_file(
+        self, mock_which, mock_subprocess_call
+    ):
+        input_file = {"path": "/path/to/archive.zip", "display_name": "archive.zip"}
+        mock_which.return_value = True
+        file_filter = [f"*.ext{i}" for i in range(500)]
+        list_file_content = {}
+
+        def call(command, stdout, stderr):
+            list_file = command[-1].lstrip("@")
+            with open(list_file, encoding="utf-8") as fh:
+                list_file_content["patterns"] = fh.read().splitlines()
+            return 0
+
+        mock_subprocess_call.side_effect = call
+
+        result = extract_archive(
+            input_file, self.output_folder, self.log_file, file_filter
+        )
+        command = mock_subprocess_call.call_args[0][0]
+        self.assertIn("-r", command)
+        self.assertTrue(command[-1].startswith("@"))
+        self.assertNotIn("*.ext1", result[0])
+        self.assertEqual(list_file_content["patterns"], file_filter)
+        self.assertFalse(os.path.exists(command[-1].lstrip("@")))
+
+    @patch("shutil.which")
+    def test_extract_archive_tgz_filter_list_file(self, mock_which):
+        mock_which.return_value = True
+        members = {f"dir{i}/file{i}.txt": b"x" for i in range(300)}
+        members["other.bin"] = b"y"
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, members)
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+            file_filter = [f"file{i}.txt" for i in range(300)]
+
+            command, export_folder = extract_archive(
+                input_file, tmp, os.path.join(tmp, "log.txt"), file_filter
+            )
+
+            self.assertIn("-T", command)
+            self.assertNotIn("file1.txt", command)
+            self.assertTrue(
+                os.path.isfile(os.path.join(export_folder, "dir1/file1.txt"))
+            )
+            self.assertFalse(os.path.exists(os.path.join(export_folder, "other.bin")))
+            self.assertEqual(
+                sorted(os.listdir(tmp)),
+                sorted(["archive.tgz", "log.txt", os.path.basename(export_folder)]),
+            )
+
+    @patch("shutil.which")
+    def test_extract_archive_progress(self, mock_which):
+        mock_which.return_value = True
+        members = {f"dir/file{i}.bin": b"x" * 1000 for i in range(20)}
+        progress = []
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, members)
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+            log_file = os.path.join(tmp, "log.txt")
+
+            extract_archive(
+                input_file, tmp, log_file, progress_callback=progress.append
+            )
+
+            self.assertEqual(progress[-1].files, 20)
+            self.assertEqual(progress[-1].bytes, 20000)
+            self.assertIsNone(progress[-1].percent)
+            with open(log_file, encoding="utf-8") as fh:
+                self.assertIn("dir/file0.bin", fh.read())
+
+    @patch("shutil.which")
+    def test_extract_archive_command_timings(self, mock_which):
+        mock_which.return_value = True
+        members = {f"dir/file{i}.bin": b"x" for i in range(5)}
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, members)
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+            log_file = os.path.join(tmp, "log.txt")
+
+            with CommandTimer() as timer:
+                extract_archive(input_file, tmp, log_file)
+                extract_archive(
+                    input_file, tmp, log_file, progress_callback=lambda p: None
+                )
+
+        summary = timer.summary()
+        self.assertEqual(summary["commands"], 2)
+        self.assertEqual(list(summary["programs"]), ["tar"])
+        self.assertEqual(summary["programs"]["tar"]["failures"], 0)
+        # Both extractions log the extracted members.
+        self.assertGreater(timer.timings[0].output_size, 0)
+        self.assertEqual(
+            summary["programs"]["tar"]["output_size"],
+            2 * timer.timings[0].output_size,
+        )
+
+    def test_extraction_output_parser_7z(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = os.path.join(tmp, "archive.zip")
+            with open(archive_path, "wb") as fh:
+                fh.write(b"x" * 1000)
+            parser = archive_utils._ExtractionOutputParser(archive_path, tmp, False)
+
+            parser.feed(b"Extracting archive: archive.zip\n  0%\b\b\b\b    \b\b\b\b 1")
+            parser.feed(b"2% 3 - dir/a.txt\b\b\b\b\b\b\b\b")
+            self.assertEqual(parser.progress.percent, 12)
+            self.assertEqual(parser.progress.files, 3)
+            self.assertEqual(parser.progress.bytes, 120)
+
+            parser.feed(b"- dir/a.txt\n- dir/b.txt\n- dir/c.txt\n- dir/d.txt\n")
+            parser.close()
+            self.assertEqual(parser.progress.files, 4)
+
+    def test_run_monitored_stall_timeout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            parser = archive_utils._ExtractionOutputParser("", tmp, True)
+            with self.assertRaises(RuntimeError) as e:
+                archive_utils._run_monitored(
+                    ["sh", "-c", "echo a; sleep 10"],
+                    os.path.join(tmp, "log.txt"),
+                    parser,
+                    stall_timeout=0.5,
+                )
+            self.assertEqual(
+                str(e.exception), "7zip or tar execution stalled for 0.5 seconds."
+            )
+
+    def test_run_monitored_timeout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            parser = archive_utils._ExtractionOutputParser("", tmp, True)
+            with self.assertRaises(RuntimeError) as e:
+                archive_utils._run_monitored(
+                    ["sh", "-c", "while true; do echo a; sleep 0.1; done"],
+                    os.path.join(tmp, "log.txt"),
+                    parser,
+                    timeout=1,
+                    stall_timeout=5,
+                )
+            self.assertEqual(
+                str(e.exception), "7zip or tar execution timed out after 1 seconds."
+            )
+            self.assertGreater(parser.progress.files, 0)
+
+    @patch("shutil.which")
+    def test_extract_archive_budget_listing(self, mock_which):
+        mock_which.return_value = True
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(
+                tmp, {"a.txt": b"a", "b.txt": b"b", "c.bin": b"\0" * 1000000}
+            )
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+            log_file = os.path.join(tmp, "log.txt")
+
+            with self.assertRaises(RuntimeError) as e:
+                extract_archive(
+                    input_file,
+                    tmp,
+                    log_file,
+                    budget=archive_utils.ExtractionBudget(max_files=2),
+                )
+            self.assertEqual(
+                str(e.exception),
+                "Archive exceeds extraction budget: file count 3 exceeds 2 files",
+            )
+
+            with self.assertRaises(RuntimeError) as e:
+                extract_archive(
+                    input_file,
+                    tmp,
+                    log_file,
+                    budget=archive_utils.ExtractionBudget(max_ratio=10),
+                )
+            self.assertIn("compression ratio", str(e.exception))
+            self.assertEqual(sorted(os.listdir(tmp)), ["archive.tgz"])
+
+            # Filtered members are within budget, the archive ratio is not checked.
+            _, export_folder = extract_archive(
+                input_file,
+                tmp,
+                log_file,
+                ["*.txt"],
+                budget=archive_utils.ExtractionBudget(max_files=2, max_bytes=10),
+            )
+            self.assertEqual(sorted(os.listdir(export_folder)), ["a.txt", "b.txt"])
+
+    @patch("openrelik_worker_common.archive_utils.list_archive")
+    @patch("shutil.which")
+    def test_extract_archive_budget_during_extraction(
+        self, mock_which, mock_list_archive
+    ):
+        mock_which.return_value = True
+        # A listing that lies about the member sizes.
+        mock_list_archive.return_value = [
+            {"path": "a.bin", "size": 1, "is_dir": False, "encrypted": False}
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, {"a.bin": b"\0" * 100000})
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+
+            with self.assertRaises(RuntimeError) as e:
+                extract_archive(
+                    input_file,
+                    tmp,
+                    os.path.join(tmp, "log.txt"),
+                    budget=archive_utils.ExtractionBudget(max_bytes=1000),
+                )
+            self.assertEqual(
+                str(e.exception),
+                "Archive exceeds extraction budget: size 100000 exceeds 1000 bytes",
+            )
+            self.assertEqual(sorted(os.listdir(tmp)), ["archive.tgz", "log.txt"])
+
+    def test_run_monitored_check(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            parser = archive_utils._ExtractionOutputParser("", tmp, True)
+            export_folder = os.path.join(tmp, "export")
+            os.makedirs(export_folder)
+            archive_path = os.path.join(tmp, "archive.tgz")
+            with open(archive_path, "wb") as fh:
+                fh.write(b"x" * 10)
+            check = archive_utils._export_folder_budget_check(
+                archive_path,
+                export_folder,
+                archive_utils.ExtractionBudget(max_files=5, check_interval=0),
+            )
+            with self.assertRaises(RuntimeError) as e:
+                archive_utils._run_monitored(
+                    [
+                        "sh",
+                        "-c",
+                        f"for i in $(seq 100); do touch {export_folder}/$i; sleep 0.1; done",
+                    ],
+                    os.path.join(tmp, "log.txt"),
+                    parser,
+                    check=check,
+                )
+            self.assertIn("file count", str(e.exception))
+
+    def test_parse_7z_listing(self):
+        output = "\n".join(
+            [
+                "Listing archive: archive.zip",
+                "",
+                "--",
+                "Path = archive.zip",
+                "Type = zip",
+                "",
+                "----------",
+                "Path = dir",
+                "Folder = +",
+                "Size = 0",
+                "Encrypted = -",
+                "",
+                "Path = dir/secret.txt",
+                "Folder = -",
+                "Size = 1234",
+                "Packed Size = 100",
+                "Encrypted = +",
+                "",
+                "Path = dir/other",
+                "Size = 5",
+                "Attributes = A",
+                "",
+            ]
+        )
+        self.assertEqual(
+            archive_utils._parse_7z_listing(output),
+            [
+                {"path": "dir", "size": 0, "is_dir": True, "encrypted": False},
+                {
+                    "path": "dir/secret.txt",
+                    "size": 1234,
+                    "is_dir": False,
+                    "encrypted": True,
+                },
+                {"path": "dir/other", "size": 5, "is_dir": False, "encrypted": False},
+            ],
+        )
+
+    def _7z_run(self, listing, passwords):
+        """Helper returning a subprocess.run side effect emulating 7z l and 7z t."""
+
+        def run(command, **kwargs):
+            password = next((c[2:] for c in command if c.startswith("-p")), None)
+            if command[1] == "l" and password is None:
+                if listing is None:
+                    return subprocess.CompletedProcess(command, 2, b"", b"Wrong pass")
+                return subprocess.CompletedProcess(command, 0, listing.encode(), b"")
+            returncode = 0 if password in passwords else 2
+            return subprocess.CompletedProcess(command, returncode, b"", b"")
+
+        return run
+
+    @patch("subprocess.run")
+    def test_find_archive_password(self, mock_run):
+        listing = "\n".join(
+            [
+                "----------",
+                "Path = big.txt",
+                "Size = 1000",
+                "Encrypted = +",
+                "",
+                "Path = small.txt",
+                "Size = 10",
+                "Encrypted = +",
+            ]
+        )
+        mock_run.side_effect = self._7z_run(listing, ["secret"])
+        input_file = {"path": "/path/to/archive.7z", "display_name": "archive.7z"}
+
+        password = archive_utils.find_archive_password(
+            input_file, ["a", "b", "secret", "c"]
+        )
+        self.assertEqual(password, "secret")
+        test_commands = [c.args[0] for c in mock_run.call_args_list[1:]]
+        self.assertIn("-psecret", [c[3] for c in test_commands])
+        for command in test_commands:
+            self.assertEqual(command[:3], ["7z", "t", "/path/to/archive.7z"])
+            self.assertEqual(command[-1], "small.txt")
+
+        with self.assertRaises(RuntimeError) as e:
+            archive_utils.find_archive_password(input_file, ["a", "b"])
+        self.assertEqual(
+            str(e.exception), "None of the archive password candidates worked."
+        )
+
+    @patch("subprocess.run")
+    def test_find_archive_password_not_encrypted(self, mock_run):
+        listing = "----------\nPath = a.txt\nSize = 1000\nEncrypted = -\n"
+        mock_run.side_effect = self._7z_run(listing, [])
+        input_file = {"path": "/path/to/archive.zip", "display_name": "archive.zip"}
+
+        self.assertIsNone(archive_utils.find_archive_password(input_file, ["a"]))
+        self.assertEqual(mock_run.call_count, 1)
+
+    @patch("subprocess.run")
+    def test_find_archive_password_encrypted_headers(self, mock_run):
+        mock_run.side_effect = self._7z_run(None, ["secret"])
+        input_file = {"path": "/path/to/archive.7z", "display_name": "archive.7z"}
+
+        password = archive_utils.find_archive_password(input_file, ["x", "secret"])
+        self.assertEqual(password, "secret")
+        self.assertEqual(mock_run.call_args_list[-1].args[0][1], "l")
+
+    @patch("openrelik_worker_common.archive_utils.zipfile")
+    def test_zip_password_candidates(self, mock_zipfile):
+        mock_zipfile.is_zipfile.return_value = True
+        archive = mock_zipfile.ZipFile.return_value.__enter__.return_value
+
+        def open_member(member, pwd):
+            if pwd != b"secret":
+                raise RuntimeError("Bad password for file")
+            return MagicMock()
+
+        archive.open.side_effect = open_member
+        self.assertEqual(
+            archive_utils._zip_password_candidates(
+                "archive.zip", "a.txt", ["x", "secret", "y"]
+            ),
+            ["secret"],
+        )
+
+    @patch("subprocess.call")
+    @patch("subprocess.run")
+    @patch("shutil.which")
+    def test_extract_archive_password_candidates(
+        self, mock_which, mock_run, mock_subprocess_call
+    ):
+        listing = "----------\nPath = a.txt\nSize = 10\nEncrypted = +\n"
+        mock_which.return_value = True
+        mock_run.side_effect = self._7z_run(listing, ["Openrelik123!"])
+        mock_subprocess_call.return_value = 0
+        input_file = {"path": "/path/to/archive.7z", "display_name": "archive.7z"}
+
+        result = extract_archive(
+            input_file,
+            self.output_folder,
+            self.log_file,
+            archive_password=["wrong", "Openrelik123!"],
+        )
+        self.assertIn("-pOpenrelik123!", result[0])
+        self.assertNotIn("-pwrong", result[0])
+
+    @patch("shutil.which")
+    def test_extraction_cache(self, mock_which):
+        mock_which.return_value = True
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, {"dir/a.txt": b"aaa", "b.txt": b"b"})
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+            cache = archive_utils.ExtractionCache(os.path.join(tmp, "cache"))
+            log_file = os.path.join(tmp, "log.txt")
+
+            with patch(
+                "openrelik_worker_common.archive_utils.extract_archive",
+                wraps=archive_utils.extract_archive,
+            ) as mock_extract:
+                command, first = cache.extract_archive(input_file, tmp, log_file)
+                _, second = cache.extract_archive(input_file, tmp, log_file)
+                # A different filter is a different cache entry.
+                cache.extract_archive(input_file, tmp, log_file, ["*.txt"])
+            self.assertEqual(mock_extract.call_count, 2)
+
+            self.assertIn("tar -vxzf", command)
+            self.assertNotEqual(first, second)
+            for export_folder in (first, second):
+                with open(os.path.join(export_folder, "dir/a.txt"), "rb") as fh:
+                    self.assertEqual(fh.read(), b"aaa")
+            self.assertEqual(
+                os.stat(os.path.join(first, "b.txt")).st_ino,
+                os.stat(os.path.join(second, "b.txt")).st_ino,
+            )
+
+    @patch("shutil.which")
+    def test_extraction_cache_concurrent(self, mock_which):
+        mock_which.return_value = True
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, {"a.txt": b"a"})
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+            cache = archive_utils.ExtractionCache(os.path.join(tmp, "cache"))
+
+            with patch(
+                "openrelik_worker_common.archive_utils.extract_archive",
+                wraps=archive_utils.extract_archive,
+            ) as mock_extract:
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    results = list(
+                        executor.map(
+                            lambda i: cache.extract_archive(
+                                input_file, tmp, os.path.join(tmp, f"log{i}.txt")
+                            ),
+                            range(4),
+                        )
+                    )
+            self.assertEqual(mock_extract.call_count, 1)
+            self.assertEqual(len({folder for _, folder in results}), 4)
+
+    @patch("shutil.which")
+    def test_extraction_cache_eviction(self, mock_which):
+        mock_which.return_value = True
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = archive_utils.ExtractionCache(
+                os.path.join(tmp, "cache"), max_bytes=150
+            )
+            keys = []
+            for i in range(3):
+                folder = os.path.join(tmp, str(i))
+                os.makedirs(folder)
+                archive_path = self._create_tgz(folder, {f"{i}.bin": b"x" * 100})
+                input_file = {"path": archive_path, "display_name": "archive.tgz"}
+                cache.extract_archive(input_file, folder, os.path.join(folder, "log"))
+                with open(archive_path, "rb") as fh:
+                    digest = hashlib.sha256(fh.read()).hexdigest()
+                keys.append(cache._key(digest, [], False))
+
+            self.assertEqual(os.listdir(cache.entries_dir), [keys[2]])
+
+    @patch("shutil.which")
+    def test_extraction_cache_memory_folder(self, mock_which):
+        mock_which.return_value = True
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, {"a.bin": b"x" * 1000})
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+            memory_folder = os.path.join(tmp, "shm")
+            os.makedirs(memory_folder)
+            cache = archive_utils.ExtractionCache(os.path.join(tmp, "cache"))
+            log_file = os.path.join(tmp, "log.txt")
+
+            # Moving out of a tmpfs memory folder crosses file systems.
+            with patch(
+                "openrelik_worker_common.archive_utils.os.rename",
+                side_effect=OSError(18, "Invalid cross-device link"),
+            ):
+                _, export_folder = cache.extract_archive(
+                    input_file,
+                    tmp,
+                    log_file,
+                    memory_folder=memory_folder,
+                    memory_budget=10000,
+                )
+            self.assertTrue(os.path.isfile(os.path.join(export_folder, "a.bin")))
+            self.assertEqual(os.listdir(memory_folder), [])
+
+            with patch(
+                "openrelik_worker_common.archive_utils._folder_usage",
+                side_effect=OSError("failed"),
+            ):
+                with self.assertRaises(OSError):
+                    cache.extract_archive(
+                        input_file,
+                        tmp,
+                        log_file,
+                        ["*.bin"],
+                        memory_folder=memory_folder,
+                        memory_budget=10000,
+                    )
+            self.assertEqual(os.listdir(memory_folder), [])
+            self.assertEqual(len(os.listdir(cache.entries_dir)), 1)
+
+    @patch("shutil.which")
+    def test_extract_archive_memory_folder(self, mock_which):
+        mock_which.return_value = True
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, {"a.bin": b"x" * 1000})
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+            memory_folder = os.path.join(tmp, "shm")
+            os.makedirs(memory_folder)
+            output_folder = os.path.join(tmp, "output")
+            os.makedirs(output_folder)
+            log_file = os.path.join(tmp, "log.txt")
+
+            _, export_folder = extract_archive(
+                input_file,
+                output_folder,
+                log_file,
+                memory_folder=memory_folder,
+                memory_budget=10000,
+            )
+            self.assertEqual(os.path.dirname(export_folder), memory_folder)
+            self.assertTrue(os.path.isfile(os.path.join(export_folder, "a.bin")))
+
+            _, export_folder = extract_archive(
+                input_file,
+                output_folder,
+                log_file,
+                memory_folder=memory_folder,
+                memory_budget=100,
+            )
+            self.assertEqual(os.path.dirname(export_folder), output_folder)
+
+            _, export_folder = extract_archive(
+                input_file,
+                output_folder,
+                log_file,
+                memory_folder=os.path.join(tmp, "doesnotexist"),
+            )
+            self.assertEqual(os.path.dirname(export_folder), output_folder)
+
+    @patch("openrelik_worker_common.archive_utils.list_archive")
+    @patch("subprocess.call")
+    @patch("shutil.which")
+    def test_extract_archive_memory_folder_fallback(
+        self, mock_which, mock_subprocess_call, mock_list_archive
+    ):
+        mock_which.return_value = True
+        mock_subprocess_call.side_effect = [2, 0]
+        mock_list_archive.return_value = [
+            {"path": "a.txt", "size": 10, "is_dir": False, "encrypted": False}
+        ]
+        input_file = {"path": "/path/to/archive.zip", "display_name": "archive.zip"}
+        with tempfile.TemporaryDirectory() as tmp:
+            memory_folder = os.path.join(tmp, "shm")
+            os.makedirs(memory_folder)
+
+            command, export_folder = extract_archive(
+                input_file,
+                tmp,
+                self.log_file,
+                memory_folder=memory_folder,
+                memory_budget=1000,
+            )
+            first_command = mock_subprocess_call.call_args_list[0].args[0]
+            self.assertTrue(first_command[3].startswith(f"-o{memory_folder}"))
+            self.assertEqual(os.path.dirname(export_folder), tmp)
+            self.assertIn(f"-o{export_folder}", command)
+            self.assertEqual(os.listdir(memory_folder), [])
+
+    def test_create_archive_output_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            files = []
+            for original_path, content in [
+                ("/etc/passwd", b"root"),
+                ("/home/user/passwd", b"user"),
+                (None, b"no path"),
+            ]:
+                output_file = create_output_file(
+                    tmp, display_name="passwd", original_path=original_path
+                )
+                with open(output_file.path, "wb") as fh:
+                    fh.write(content)
+                files.append(output_file)
+
+            output_file, manifest = archive_utils.create_archive(
+                tmp, files, display_name="bundle", data_type="bundle:tar"
+            )
+
+            self.assertEqual(output_file.display_name, "bundle.tar.gz")
+            self.assertEqual(output_file.data_type, "bundle:tar")
+            self.assertEqual(output_file.size, os.path.getsize(output_file.path))
+            self.assertEqual(
+                [m["name"] for m in manifest],
+                ["etc/passwd", "home/user/passwd", "passwd"],
+            )
+            with tarfile.open(output_file.path, "r:gz") as tar:
+                self.assertEqual(
+                    tar.getnames(),
+                    [m["name"] for m in manifest] + [archive_utils.MANIFEST_MEMBER_NAME],
+                )
+                self.assertEqual(tar.extractfile("home/user/passwd").read(), b"user")
+                self.assertEqual(
+                    json.load(tar.extractfile(archive_utils.MANIFEST_MEMBER_NAME)),
+                    manifest,
+                )
+
+    def test_create_archive_member_names(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            files = []
+            for display_name, original_path in [
+                ("a", "../../etc/cron.d/a"),
+                ("b", "/var/../../b"),
+                ("c", "logs/./x/../c"),
+                ("../d", None),
+                ("..", ".."),
+            ]:
+                output_file = create_output_file(
+                    tmp, display_name=display_name, original_path=original_path
+                )
+                open(output_file.path, "wb").close()
+                files.append(output_file)
+
+            _, manifest = archive_utils.create_archive(tmp, files)
+            self.assertEqual(
+                [m["name"] for m in manifest],
+                ["etc/cron.d/a", "b", "logs/c", "d", files[-1].uuid],
+            )
+
+    def test_create_archive_removes_partial_archive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = os.path.join(tmp, "folder")
+            os.makedirs(folder)
+            with open(os.path.join(folder, "a.txt"), "w", encoding="utf-8") as fh:
+                fh.write("a")
+            output_folder = os.path.join(tmp, "output")
+            os.makedirs(output_folder)
+
+            with patch.object(
+                tarfile.TarFile, "addfile", side_effect=OSError("disk full")
+            ):
+                with self.assertRaises(OSError):
+                    archive_utils.create_archive(output_folder, folder)
+            self.assertEqual(os.listdir(output_folder), [])
+
+    def test_create_archive_folder(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = os.path.join(tmp, "folder")
+            os.makedirs(os.path.join(folder, "sub"))
+            for name in ["a.txt", "sub/b.txt"]:
+                with open(os.path.join(folder, name), "w", encoding="utf-8") as fh:
+                    fh.write(name)
+
+            output_file, manifest = archive_utils.create_archive(
+                tmp, folder, compress=False
+            )
+
+            self.assertEqual(output_file.display_name, "archive.tar")
+            self.assertEqual(
+                sorted((m["name"], m["original_path"], m["size"]) for m in manifest),
+                [("a.txt", "/a.txt", 5), ("sub/b.txt", "/sub/b.txt", 9)],
+            )
+            with tarfile.open(output_file.path, "r:") as tar:
+                self.assertEqual(tar.extractfile("sub/b.txt").read(), b"sub/b.txt")
+
+    @unittest.skipUnless(shutil.which("pigz"), "pigz not installed")
+    def test_create_archive_pigz(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = os.path.join(tmp, "folder")
+            os.makedirs(folder)
+            with open(os.path.join(folder, "a.txt"), "w", encoding="utf-8") as fh:
+                fh.write("a" * 100000)
+
+            output_file, _ = archive_utils.create_archive(
+                tmp, folder, compress_threads=2
+            )
+            with tarfile.open(output_file.path, "r:gz") as tar:
+                self.assertEqual(len(tar.extractfile("a.txt").read()), 100000)
+
+    def _create_tgz(self, folder, members):
+        """Helper function to create a tgz archive with the given members."""
+        archive_path = os.path.join(folder, "archive.tgz")
+        with tarfile.open(archive_path, "w:gz") as tar:
+            for name, content in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        return archive_path
+
+    @patch("shutil.which")
+    def test_extract_archive_to_output_files(self, mock_which):
+        mock_which.return_value = True
+        members = {"a.txt": b"aaa", "dir/sub/b.evtx": b"bbbb", "dir/c.bin": b"c"}
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, members)
+            output_folder = os.path.join(tmp, "output")
+            os.makedirs(output_folder)
+            input_file = {"id": 1, "path": archive_path, "display_name": "archive.tgz"}
+
+            command, output_files = extract_archive_to_output_files(
+                input_file,
+                output_folder,
+                os.path.join(tmp, "log.txt"),
+                data_type="extraction:file",
+                digest_algorithm="sha256",
+            )
+
+            self.assertIn("tar -vxzf", command)
+            by_path = {f.original_path: f for f in output_files}
+            self.assertEqual(
+                sorted(by_path), ["/a.txt", "/dir/c.bin", "/dir/sub/b.evtx"]
+            )
+            for name, content in members.items():
+                output_file = by_path[f"/{name}"]
+                self.assertEqual(output_file.size, len(content))
+                self.assertEqual(
+                    output_file.digest, hashlib.sha256(content).hexdigest()
+                )
+                self.assertEqual(output_file.data_type, "extraction:file")
+                self.assertEqual(output_file.source_file_id, 1)
+                with open(output_file.path, "rb") as fh:
+                    self.assertEqual(fh.read(), content)
+            # Only the moved output files are left, the export folder is removed.
+            self.assertEqual(len(os.listdir(output_folder)), len(members))
+
+    @patch("shutil.which")
+    def test_extract_archive_to_output_files_options(self, mock_which):
+        mock_which.return_value = True
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = self._create_tgz(tmp, {"a.txt": b"aaa"})
+            memory_folder = os.path.join(tmp, "shm")
+            output_folder = os.path.join(tmp, "output")
+            os.makedirs(memory_folder)
+            os.makedirs(output_folder)
+            input_file = {"path": archive_path, "display_name": "archive.tgz"}
+            progress = []
+
+            command, output_files = extract_archive_to_output_files(
+                input_file,
+                output_folder,
+                os.path.join(tmp, "log.txt"),
+                progress_callback=progress.append,
+                timeout=60,
+                memory_folder=memory_folder,
+                memory_budget=10000,
+            )
+
+            self.assertIn(f"-C {memory_folder}", command)
+            self.assertEqual([f.original_path for f in output_files], ["/a.txt"])
+            self.assertTrue(progress)
+            self.assertEqual(os.listdir(memory_folder), [])
+
+
 if __name__ == "__main__":
     unittest.main()
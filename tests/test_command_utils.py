@@ -0,0 +1,184 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from openrelik_worker_common.command_utils import (
+    CommandRunner,
+    CommandTimer,
+    FakeRunner,
+    RecordingRunner,
+    SubprocessRunner,
+    submit_with_context,
+)
+
+
+class CommandUtils(unittest.TestCase):
+    """Test the command runners."""
+
+    def test_SubprocessRunner(self):
+        runner = SubprocessRunner()
+        command = [sys.executable, "-c", "import sys; print('out'); sys.exit(3)"]
+        process = runner.run(command)
+        self.assertEqual((process.returncode, process.stdout), (3, "out\n"))
+        process = asyncio.run(runner.run_async(command))
+        self.assertEqual((process.returncode, process.stdout), (3, "out\n"))
+        self.assertEqual(process.args, command)
+
+    def test_CommandRunnerInterface(self):
+        with self.assertRaises(TypeError):
+            CommandRunner()
+
+        class EchoRunner(CommandRunner):
+            def run(self, command):
+                return subprocess.CompletedProcess(command, 0, " ".join(command), "")
+
+        process = asyncio.run(EchoRunner().run_async(["echo", "a"]))
+        self.assertEqual(process.stdout, "echo a")
+
+    def test_FakeRunnerPrefix(self):
+        runner = FakeRunner()
+        runner.add(["sudo"], returncode=1, stderr="denied")
+        runner.add(["sudo", "losetup"], stdout="/dev/loop0\n")
+        runner.add(["sudo", "blkid"], handler=lambda command: (0, command[-1], ""))
+
+        self.assertEqual(runner.run(["sudo", "losetup", "-f"]).stdout, "/dev/loop0\n")
+        self.assertEqual(runner.run(["sudo", "blkid", "/dev/sda"]).stdout, "/dev/sda")
+        self.assertEqual(runner.run(["sudo", "mount"]).returncode, 1)
+        process = runner.run(["umount", "/mnt"])
+        self.assertEqual(process.returncode, 127)
+        self.assertEqual(process.stderr, "umount: command not found")
+        self.assertEqual(len(runner.commands), 4)
+
+    def test_FakeRunnerLatency(self):
+        runner = FakeRunner(latency_scale=0.5)
+        runner.add(["sleep"], latency=0.1)
+        start = time.monotonic()
+        runner.run(["sleep"])
+        asyncio.run(runner.run_async(["sleep"]))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertAlmostEqual(runner.simulated_seconds, 0.1)
+
+        runner = FakeRunner(latency_scale=0)
+        runner.add(["sleep"], latency=60)
+        runner.run(["sleep"])
+        self.assertEqual(runner.simulated_seconds, 0)
+
+    def test_RecordAndReplay(self):
+        fake = FakeRunner()
+        fake.record(["sudo", "losetup"], stdout="/dev/loop0\n", latency=0.2)
+        fake.record(["sudo", "losetup"], stdout="/dev/loop1\n", latency=0.2)
+        fake.record(["sudo", "mount", "/dev/loop0", "/mnt/a"], latency=0.1)
+        recorder = RecordingRunner(fake)
+        for _ in range(3):
+            recorder.run(["sudo", "losetup"])
+        asyncio.run(recorder.run_async(["sudo", "mount", "/dev/loop0", "/mnt/a"]))
+        self.assertEqual(
+            [entry["stdout"] for entry in recorder.recording],
+            ["/dev/loop0\n", "/dev/loop1\n", "/dev/loop1\n", ""],
+        )
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "recording.json")
+            recorder.save(path)
+            replay = FakeRunner.from_recording(path, latency_scale=0)
+
+        # Exact commands replay in recorded order, the last response repeats.
+        self.assertEqual(replay.run(["sudo", "losetup"]).stdout, "/dev/loop0\n")
+        self.assertEqual(replay.run(["sudo", "losetup"]).stdout, "/dev/loop1\n")
+        self.assertEqual(replay.run(["sudo", "losetup"]).stdout, "/dev/loop1\n")
+        # Other arguments get the response of the same program.
+        process = replay.run(["sudo", "mount", "/dev/loop0", "/mnt/b"])
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(replay.run(["sudo", "umount"]).returncode, 127)
+
+    @patch("openrelik_worker_common.command_utils.time.sleep")
+    def test_FakeRunnerScalesRecordedLatency(self, mock_sleep):
+        runner = FakeRunner(latency_scale=2)
+        runner.record(["fdisk", "-l"], latency=0.25)
+        runner.run(["fdisk", "-l"])
+        mock_sleep.assert_called_once_with(0.5)
+
+    def test_CommandTimer(self):
+        runner = FakeRunner()
+        runner.add(["sudo", "mount"], latency=0.01)
+        runner.add(["/usr/bin/blkid"], returncode=2, stdout="12345")
+
+        runner.run(["sudo", "mount"])
+        with CommandTimer() as task_timer:
+            runner.run(["sudo", "mount", "/dev/loop0p1"])
+            with CommandTimer() as timer:
+                runner.run(["/usr/bin/blkid", "/dev/loop0"])
+            runner.run(["sudo", "mount", "/dev/loop0p2"])
+        runner.run(["sudo", "mount"])
+
+        self.assertEqual(timer.summary()["commands"], 1)
+        summary = task_timer.summary()
+        self.assertEqual(summary["commands"], 3)
+        self.assertEqual(summary["programs"]["blkid"]["failures"], 1)
+        self.assertEqual(summary["programs"]["blkid"]["output_size"], 5)
+        self.assertEqual(summary["programs"]["mount"]["count"], 2)
+        self.assertGreaterEqual(summary["programs"]["mount"]["max_seconds"], 0.01)
+        self.assertAlmostEqual(
+            summary["wall_seconds"],
+            sum(timing.wall_seconds for timing in task_timer.timings),
+            places=5,
+        )
+        self.assertEqual(
+            task_timer.timings[1].to_dict(),
+            {
+                "program": "blkid",
+                "wall_seconds": task_timer.timings[1].wall_seconds,
+                "returncode": 2,
+                "output_size": 5,
+            },
+        )
+
+    def test_CommandTimerThreadsAndTasks(self):
+        runner = FakeRunner()
+        runner.add(["true"])
+
+        async def run_async():
+            await asyncio.gather(*(runner.run_async(["true"]) for _ in range(3)))
+
+        with CommandTimer() as timer:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                for _ in range(4):
+                    submit_with_context(executor, runner.run, ["true"]).result()
+                # Plain submits run outside of the timer.
+                executor.submit(runner.run, ["true"]).result()
+            asyncio.run(run_async())
+        self.assertEqual(timer.summary()["programs"]["true"]["count"], 7)
+
+    def test_SubprocessRunnerTimings(self):
+        command = [sys.executable, "-c", "print('out')"]
+        with CommandTimer() as timer:
+            SubprocessRunner().run(command)
+            asyncio.run(SubprocessRunner().run_async(command))
+        self.assertEqual(
+            [(t.returncode, t.output_size) for t in timer.timings], [(0, 4), (0, 4)]
+        )
+        self.assertEqual(timer.timings[0].program, os.path.basename(sys.executable))
+
+
+if __name__ == "__main__":
+    unittest.main()
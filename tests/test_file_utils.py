@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import errno
 import unittest
 import unittest.mock
 import os
@@ -166,12 +167,99 @@ class Utils(unittest.TestCase):
         relative_path = file_utils.get_relative_path("/xxx/yyy/test.txt")
         self.assertEqual(relative_path, "xxx/yyy/test.txt")
 
+    def _create_mountpoint(self):
+        """Helper function creating a mountpoint with a few files."""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        mountpoint = os.path.join(tmpdir.name, "mnt")
+        output_path = os.path.join(tmpdir.name, "output")
+        os.mkdir(output_path)
+        for path, content in (
+            ("etc/passwd", b"root:x:0:0"),
+            ("var/log/syslog.log", b"a" * 100),
+            ("var/log/apt/history.log", b"b" * 10),
+            ("var/log/apt/term.txt", b"c"),
+        ):
+            os.makedirs(os.path.join(mountpoint, os.path.dirname(path)), exist_ok=True)
+            with open(os.path.join(mountpoint, path), "wb") as fh:
+                fh.write(content)
+        secret = os.path.join(tmpdir.name, "secret.log")
+        open(secret, "w", encoding="utf-8").close()
+        os.symlink(secret, os.path.join(mountpoint, "var/log/escape.log"))
+        return mountpoint, output_path
+
+    def test_export_files(self):
+        """Test export_files function."""
+        mountpoint, output_path = self._create_mountpoint()
+        files = file_utils.export_files(
+            mountpoint,
+            ["/etc/passwd", "var/log/**/*.log", "/does/not/exist"],
+            output_path,
+            data_type="test:log",
+        )
+        self.assertEqual(
+            [(file.original_path, file.size) for file in files],
+            [
+                ("/etc/passwd", 10),
+                ("/var/log/apt/history.log", 10),
+                ("/var/log/syslog.log", 100),
+            ],
+        )
+        for file in files:
+            self.assertEqual(file.data_type, "test:log")
+            self.assertEqual(file.display_name, os.path.basename(file.original_path))
+            with open(file.path, "rb") as fh:
+                with open(mountpoint + file.original_path, "rb") as original:
+                    self.assertEqual(fh.read(), original.read())
+
+    def test_export_files_symlinks(self):
+        """Test export_files never follows symlinks of the mounted image."""
+        mountpoint, output_path = self._create_mountpoint()
+        os.symlink(".", os.path.join(mountpoint, "a"))
+        os.symlink(".", os.path.join(mountpoint, "b"))
+        os.symlink("/", os.path.join(mountpoint, "root"))
+        os.symlink("/etc", os.path.join(mountpoint, "var/etc"))
+        with open(os.path.join(mountpoint, "f"), "wb") as fh:
+            fh.write(b"f")
+        with open(os.path.join(mountpoint, "var/.hidden.log"), "wb") as fh:
+            fh.write(b"h")
+
+        files = file_utils.export_files(
+            mountpoint,
+            ["/**/f", "/root/etc/passwd", "/var/etc/*", "/**/*.log", "/a/../etc/*"],
+            output_path,
+        )
+        self.assertEqual(
+            [file.original_path for file in files],
+            ["/f", "/var/log/apt/history.log", "/var/log/syslog.log"],
+        )
+
+    @unittest.mock.patch("openrelik_worker_common.file_utils.os.copy_file_range")
+    def test_export_files_fallback(self, mock_copy_file_range):
+        """Test export_files falls back when copy_file_range is not supported."""
+        mock_copy_file_range.side_effect = OSError(errno.EXDEV, "Cross-device link")
+        mountpoint, output_path = self._create_mountpoint()
+        files = file_utils.export_files(mountpoint, ["**/syslog.log"], output_path)
+        self.assertEqual(len(files), 1)
+        self.assertEqual(files[0].size, 100)
+        mock_copy_file_range.assert_called_once()
+
+        # Other errors skip the file.
+        mock_copy_file_range.side_effect = OSError(errno.EIO, "I/O error")
+        files = file_utils.export_files(mountpoint, ["**/syslog.log"], output_path)
+        self.assertEqual(files, [])
+        self.assertEqual(len(os.listdir(output_path)), 1)
+
     def test_valid_disk_image_extensions(self):
         # Test with various valid disk image extensions
         self.assertTrue(file_utils.is_disk_image({"display_name": "myimage.img"}))
         self.assertTrue(file_utils.is_disk_image({"display_name": "vm.qcow3"}))
         self.assertTrue(file_utils.is_disk_image({"display_name": "another.qcow2"}))
         self.assertTrue(file_utils.is_disk_image({"display_name": "test.qcow"}))
+        self.assertTrue(file_utils.is_disk_image({"display_name": "vm.vmdk"}))
+        self.assertTrue(file_utils.is_disk_image({"display_name": "vm.VHD"}))
+        self.assertTrue(file_utils.is_disk_image({"display_name": "vm.vhdx"}))
+        self.assertTrue(file_utils.is_disk_image({"display_name": "vm.vdi"}))
         # Test a file name with multiple dots, where the last part is the extension
         self.assertTrue(file_utils.is_disk_image({"display_name": "backup.disk.qcow2"}))
         # Test that extensions are case-insensitive
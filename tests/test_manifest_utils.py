@@ -0,0 +1,124 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sqlite3
+import stat
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from openrelik_worker_common import manifest_utils
+from openrelik_worker_common.data_types import DataType
+
+
+class ManifestUtils(unittest.TestCase):
+    """Test the manifest indexer."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.output_path = os.path.join(self.folder.name, "output")
+        os.mkdir(self.output_path)
+        self.mountpoints = []
+        for mountpoint, files in (
+            ("mnt1", {"etc/passwd": b"root", "etc/ssh/sshd_config": b"x" * 10}),
+            ("mnt2", {"Windows/System32/config/SAM": b"sam", "empty/.keep": b""}),
+        ):
+            root = os.path.join(self.folder.name, mountpoint)
+            for path, content in files.items():
+                os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+                with open(os.path.join(root, path), "wb") as fh:
+                    fh.write(content)
+            self.mountpoints.append(root)
+        os.symlink("/etc", os.path.join(self.mountpoints[0], "link"))
+
+    def test_BuildManifest(self):
+        manifest, entries = manifest_utils.build_manifest(
+            self.mountpoints, self.output_path, max_workers=4
+        )
+        self.assertEqual(manifest.data_type, DataType.MANIFEST_SQLITE)
+        self.assertEqual(manifest.display_name, "manifest.sqlite")
+        self.assertEqual(entries, 11)
+        self.assertEqual(manifest.size, os.path.getsize(manifest.path))
+
+        connection = sqlite3.connect(manifest.path)
+        rows = connection.execute(
+            "SELECT mountpoint_id, path, size, mode, inode FROM files ORDER BY path"
+        ).fetchall()
+        connection.close()
+        paths = [(row[0], row[1]) for row in rows]
+        self.assertEqual(
+            paths,
+            [
+                (1, "/Windows"),
+                (1, "/Windows/System32"),
+                (1, "/Windows/System32/config"),
+                (1, "/Windows/System32/config/SAM"),
+                (1, "/empty"),
+                (1, "/empty/.keep"),
+                (0, "/etc"),
+                (0, "/etc/passwd"),
+                (0, "/etc/ssh"),
+                (0, "/etc/ssh/sshd_config"),
+                (0, "/link"),
+            ],
+        )
+        by_path = {row[1]: row for row in rows}
+        self.assertEqual(by_path["/etc/ssh/sshd_config"][2], 10)
+        self.assertTrue(stat.S_ISDIR(by_path["/etc"][3]))
+        self.assertTrue(stat.S_ISLNK(by_path["/link"][3]))
+        self.assertEqual(
+            by_path["/etc/passwd"][4],
+            os.stat(os.path.join(self.mountpoints[0], "etc/passwd")).st_ino,
+        )
+
+    def test_GlobManifest(self):
+        manifest, _ = manifest_utils.build_manifest(self.mountpoints, self.output_path)
+        rows = manifest_utils.glob_manifest(manifest.path, "/etc/*")
+        self.assertEqual(
+            [row["path"] for row in rows],
+            ["/etc/passwd", "/etc/ssh", "/etc/ssh/sshd_config"],
+        )
+        self.assertEqual(rows[0]["mountpoint"], self.mountpoints[0])
+        self.assertEqual(rows[0]["size"], 4)
+        self.assertEqual(
+            manifest_utils.glob_manifest(manifest.path, "*/config/SAM")[0][
+                "mountpoint"
+            ],
+            self.mountpoints[1],
+        )
+        self.assertEqual(manifest_utils.glob_manifest(manifest.path, "/ETC/*"), [])
+
+    def test_UnreadableFolder(self):
+        scandir = os.scandir
+        unreadable = os.path.join(self.mountpoints[0], "etc")
+
+        def mock_scandir(path):
+            if path == unreadable:
+                raise PermissionError("Permission denied")
+            return scandir(path)
+
+        with patch("openrelik_worker_common.manifest_utils.os.scandir") as mock:
+            mock.side_effect = mock_scandir
+            manifest, entries = manifest_utils.build_manifest(
+                self.mountpoints[:1], self.output_path
+            )
+        self.assertEqual(entries, 2)
+        rows = manifest_utils.glob_manifest(manifest.path, "*")
+        self.assertEqual([row["path"] for row in rows], ["/etc", "/link"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,13 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import gc
+import json
+import os
+import redis
 import unittest
 import subprocess
-from fakeredis import FakeStrictRedis
+import tempfile
+import threading
+import time
+from fakeredis import FakeAsyncRedis, FakeStrictRedis
 from pathlib import Path
 from unittest.mock import patch
 
 from openrelik_worker_common import mount_utils
+from openrelik_worker_common.command_utils import CommandTimer, FakeRunner
 
 
 class Utils(unittest.TestCase):
@@ -86,7 +95,7 @@ class Utils(unittest.TestCase):
             self.assertEqual(t, "ext4")
 
     @patch("openrelik_worker_common.mount_utils.BlockDevice._get_hostname")
-    @patch("openrelik_worker_common.mount_utils.redis.Redis.from_url")
+    @patch("openrelik_worker_common.mount_utils.get_redis_client")
     @patch.object(mount_utils.BlockDevice, "_is_important_partition")
     def test_GetFreeNbDevice(self, mock_partition, mock_redisclient, mock_get_hostname):
         mock_partition.return_value = True
@@ -118,7 +127,7 @@ class Utils(unittest.TestCase):
         self.assertIsNone(bd2.redis_client.get("random_host_name-/dev/nbd1"))
 
     @patch("openrelik_worker_common.mount_utils.BlockDevice._get_hostname")
-    @patch("openrelik_worker_common.mount_utils.redis.Redis.from_url")
+    @patch("openrelik_worker_common.mount_utils.get_redis_client")
     @patch.object(mount_utils.BlockDevice, "_is_important_partition")
     def test_GetFreeNbDeviceNoDevicesAvailable(
         self, mock_partition, mock_redisclient, mock_get_hostname
@@ -449,5 +458,1123 @@ class Utils(unittest.TestCase):
         pass
 
 
+class FsTypeProbe(unittest.TestCase):
+    """Test the batched file system type probing without block devices."""
+
+    BLKID_EXPORT_OUTPUT = (
+        "DEVNAME=/dev/loop0p1\nTYPE=ext4\n\nDEVNAME=/dev/loop0p3\nTYPE=ntfs\n"
+    )
+
+    @patch("openrelik_worker_common.mount_utils.subprocess.run")
+    def test_ProbeFsTypes(self, mock_subprocess):
+        mock_subprocess.return_value = subprocess.CompletedProcess(
+            args=[], stdout=self.BLKID_EXPORT_OUTPUT, stderr="", returncode=0
+        )
+        bd = mount_utils.BlockDevice("./test_data/image_vfat.img")
+        bd._probe_fstypes(["/dev/loop0p1", "/dev/loop0p2", "/dev/loop0p3"])
+
+        self.assertEqual(
+            bd.fstypes,
+            {"/dev/loop0p1": "ext4", "/dev/loop0p2": "", "/dev/loop0p3": "ntfs"},
+        )
+        self.assertEqual(bd._get_fstype("/dev/loop0p3"), "ntfs")
+        self.assertEqual(bd._get_fstype("/dev/loop0p2"), "")
+        self.assertEqual(mock_subprocess.call_count, 1)
+        self.assertEqual(
+            mock_subprocess.call_args.args[0],
+            ["sudo", "blkid", "-s", "TYPE", "-o", "export"]
+            + ["/dev/loop0p1", "/dev/loop0p2", "/dev/loop0p3"],
+        )
+
+    @patch("openrelik_worker_common.mount_utils.subprocess.run")
+    def test_ProbeFsTypesError(self, mock_subprocess):
+        mock_subprocess.return_value = subprocess.CompletedProcess(
+            args=[], stdout="", stderr="permission denied", returncode=1
+        )
+        bd = mount_utils.BlockDevice("./test_data/image_vfat.img")
+        bd._probe_fstypes(["/dev/loop0p1"])
+        self.assertEqual(bd.fstypes, {})
+
+    @patch("openrelik_worker_common.mount_utils.subprocess.run")
+    def test_ParsePartitionsSingleProbe(self, mock_subprocess):
+        mock_subprocess.return_value = subprocess.CompletedProcess(
+            args=[], stdout=self.BLKID_EXPORT_OUTPUT, stderr="", returncode=0
+        )
+        bd = mount_utils.BlockDevice("./test_data/image_vfat.img", min_partition_size=1)
+        bd.blkdevice = "/dev/loop0"
+        bd.blkdeviceinfo = {
+            "blockdevices": [
+                {
+                    "name": "loop0",
+                    "size": 3000,
+                    "children": [
+                        {"name": "loop0p1", "size": 1000},
+                        {"name": "loop0p2", "size": 1000},
+                        {"name": "loop0p3", "size": 1000},
+                    ],
+                }
+            ]
+        }
+        self.assertEqual(bd._parse_partitions(), ["/dev/loop0p1", "/dev/loop0p3"])
+        self.assertEqual(mock_subprocess.call_count, 1)
+
+
+class DeviceReadiness(unittest.TestCase):
+    """Test the device readiness polling without block devices."""
+
+    def setUp(self):
+        self.sysfs = tempfile.TemporaryDirectory()
+        self.bd = mount_utils.BlockDevice("./test_data/image_vfat.img")
+        self.bd.SYSFS_BLOCK_PATH = self.sysfs.name
+
+    def tearDown(self):
+        self.sysfs.cleanup()
+
+    def test_WaitForDevice(self):
+        results = iter([False, False, True])
+        waited = self.bd._wait_for_device(lambda: next(results), "/dev/nbd0")
+        self.assertGreater(waited, 0)
+        self.assertEqual(self.bd.device_wait_seconds, waited)
+
+    def test_WaitForDeviceTimeout(self):
+        self.bd.DEVICE_READY_TIMEOUT_SECONDS = 0.05
+        with self.assertRaises(RuntimeError) as e:
+            self.bd._wait_for_device(lambda: False, "/dev/nbd0")
+        self.assertEqual(
+            str(e.exception), "Error waiting for /dev/nbd0: not ready after 0.05s"
+        )
+
+    def test_NbdReady(self):
+        self.bd.blkdevice = "/dev/nbd3"
+        nbd = Path(self.sysfs.name) / "nbd3"
+        nbd.mkdir()
+        self.assertFalse(self.bd._nbd_ready())
+        (nbd / "size").write_text("0\n")
+        (nbd / "pid").write_text("1234\n")
+        self.assertFalse(self.bd._nbd_ready())
+        (nbd / "size").write_text("2048\n")
+        self.assertTrue(self.bd._nbd_ready())
+
+    def test_PartitionsReady(self):
+        loop = Path(self.sysfs.name) / "loop7"
+        (loop / "loop7p1").mkdir(parents=True)
+        (loop / "loop7p1" / "partition").write_text("1\n")
+        (loop / "queue").mkdir()
+
+        with patch("openrelik_worker_common.mount_utils.os.path.exists") as exists:
+            exists.return_value = False
+            self.assertFalse(self.bd._partitions_ready("/dev/loop7"))
+            exists.return_value = True
+            self.assertTrue(self.bd._partitions_ready("/dev/loop7"))
+            exists.assert_called_with("/dev/loop7p1")
+
+        # Devices without sysfs entry are not waited for.
+        self.assertTrue(self.bd._partitions_ready("/dev/loop8"))
+
+
+class NbdAllocation(unittest.TestCase):
+    """Test the NBD slot allocation script and wait queue."""
+
+    def setUp(self):
+        self.redis_client = FakeStrictRedis(server_type="redis")
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        for patcher in (
+            patch.object(mount_utils.BlockDevice, "_get_hostname", return_value="host"),
+            patch.object(mount_utils.BlockDevice, "SYSFS_BLOCK_PATH", self.folder.name),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _block_device(self, **kwargs):
+        bd = mount_utils.BlockDevice(
+            "./test_data/image_with_partitions.qcow2", **kwargs
+        )
+        bd.redis_client = self.redis_client
+        return bd
+
+    def _lock_all(self):
+        for device_number in range(mount_utils.BlockDevice.MAX_NBD_DEVICES + 1):
+            self.redis_client.set(f"host-/dev/nbd{device_number}", "other")
+
+    def test_AllocateSingleRoundTrip(self):
+        self.redis_client.set("host-/dev/nbd0", "other")
+        bd = self._block_device()
+        with patch.object(
+            self.redis_client, "lock", wraps=self.redis_client.lock
+        ) as mock_lock:
+            self.assertEqual(bd._get_free_nbd_device(), "/dev/nbd1")
+        mock_lock.assert_called_once()
+        self.assertEqual(
+            self.redis_client.get("host-/dev/nbd1"), bd.redis_lock.local.token
+        )
+        self.assertGreater(self.redis_client.pttl("host-/dev/nbd1"), 0)
+
+        # Release only removes the key while it still holds our token.
+        self.redis_client.set("host-/dev/nbd1", "stolen")
+        with self.assertRaises(redis.exceptions.LockNotOwnedError):
+            bd.redis_lock.release()
+        self.assertEqual(self.redis_client.get("host-/dev/nbd1"), b"stolen")
+
+    def test_SkipAttachedSlots(self):
+        # nbd0 is unlocked but still attached to the qemu-nbd of a crashed worker.
+        for devname in ("nbd0", "nbd2"):
+            os.makedirs(os.path.join(self.folder.name, devname))
+            Path(self.folder.name, devname, "pid").write_text("1234\n")
+        self.redis_client.set("host-/dev/nbd1", "other")
+        self.assertEqual(self._block_device()._get_free_nbd_device(), "/dev/nbd3")
+        self.assertIsNone(self.redis_client.get("host-/dev/nbd0"))
+
+        # Waiters skip them as well.
+        self.redis_client.delete("host-/dev/nbd1")
+        bd = self._block_device(nbd_wait_timeout=1)
+        self.assertEqual(bd._get_free_nbd_device(), "/dev/nbd1")
+
+    def test_WaitForSlot(self):
+        self._lock_all()
+        bd = self._block_device(nbd_wait_timeout=5)
+
+        def free_slot(seconds):
+            self.redis_client.delete("host-/dev/nbd4")
+
+        with patch("openrelik_worker_common.mount_utils.time.sleep") as mock_sleep:
+            mock_sleep.side_effect = free_slot
+            self.assertEqual(bd._get_free_nbd_device(), "/dev/nbd4")
+        self.assertEqual(self.redis_client.llen("host-nbd-queue"), 0)
+        self.assertEqual(self.redis_client.keys("host-nbd-waiter-*"), [])
+
+    def test_WaitForSlotTimeout(self):
+        self._lock_all()
+        bd = self._block_device(nbd_wait_timeout=0.1)
+        with self.assertRaises(RuntimeError) as e:
+            bd._get_free_nbd_device()
+        self.assertEqual(
+            str(e.exception), "Error getting free NBD device: All NBD devices locked!"
+        )
+        self.assertEqual(self.redis_client.llen("host-nbd-queue"), 0)
+
+    def test_QueueIsFair(self):
+        bd = self._block_device()
+        # A live waiter ahead in the queue gets the next free slot first.
+        self.redis_client.rpush("host-nbd-queue", "first")
+        self.redis_client.set("host-nbd-waiter-first", 1)
+        with self.assertRaises(RuntimeError):
+            bd._get_free_nbd_device()
+
+        # Waiters that stopped refreshing their alive key are skipped.
+        self.redis_client.delete("host-nbd-waiter-first")
+        self.assertEqual(bd._get_free_nbd_device(), "/dev/nbd0")
+        self.assertEqual(self.redis_client.llen("host-nbd-queue"), 0)
+
+
+class NbdLease(unittest.TestCase):
+    """Test the NBD lease heartbeat."""
+
+    def setUp(self):
+        self.redis_client = FakeStrictRedis(server_type="redis")
+        for name, value in (
+            ("_get_hostname", "host"),
+            ("LEASE_RENEW_INTERVAL_SECONDS", 0.02),
+        ):
+            if name.startswith("_"):
+                patcher = patch.object(
+                    mount_utils.BlockDevice, name, return_value=value
+                )
+            else:
+                patcher = patch.object(mount_utils.BlockDevice, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _allocate(self):
+        bd = mount_utils.BlockDevice("./test_data/image_with_partitions.qcow2")
+        bd.redis_client = self.redis_client
+        bd._get_free_nbd_device()
+        self.addCleanup(bd._stop_lease_heartbeat)
+        return bd
+
+    def test_LeaseRenewed(self):
+        bd = self._allocate()
+        self.assertLessEqual(
+            self.redis_client.pttl(bd.redis_lock.name),
+            mount_utils.BlockDevice.LEASE_TTL_SECONDS * 1000,
+        )
+        # Shorten the TTL, the heartbeat resets it before it expires.
+        self.redis_client.pexpire(bd.redis_lock.name, 200)
+        time.sleep(0.3)
+        self.assertEqual(
+            self.redis_client.get(bd.redis_lock.name), bd.redis_lock.local.token
+        )
+        self.assertGreater(self.redis_client.pttl(bd.redis_lock.name), 1000)
+
+        bd._release_lease()
+        self.assertIsNone(self.redis_client.get(bd.redis_lock.name))
+        self.assertIsNone(bd._lease_thread)
+        self.assertFalse(bd.lease_lost)
+
+    def test_LeaseLost(self):
+        bd = self._allocate()
+        self.redis_client.set(bd.redis_lock.name, "other")
+        bd._lease_thread.join(timeout=5)
+        self.assertFalse(bd._lease_thread.is_alive())
+        self.assertTrue(bd.lease_lost)
+
+    def test_ReleaseExpiredLease(self):
+        with patch.object(mount_utils.BlockDevice, "LEASE_RENEW_INTERVAL_SECONDS", 60):
+            bd = self._allocate()
+        self.redis_client.delete(bd.redis_lock.name)
+        bd._release_lease()
+        self.assertTrue(bd.lease_lost)
+        self.assertIsNone(bd._lease_thread)
+
+    def test_HeartbeatStopsWithBlockDevice(self):
+        # Load the script up front, the NoScriptError traceback of the first
+        # call would keep the BlockDevice alive.
+        self.redis_client.script_load(mount_utils.NBD_ALLOCATE_SCRIPT)
+        bd = mount_utils.BlockDevice("./test_data/image_with_partitions.qcow2")
+        bd.redis_client = self.redis_client
+        bd._get_free_nbd_device()
+        thread = bd._lease_thread
+        del bd
+        gc.collect()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+
+
+class ParallelMount(unittest.TestCase):
+    """Test concurrent partition mounting without block devices."""
+
+    def setUp(self):
+        self.mountroot = tempfile.TemporaryDirectory()
+        self.addCleanup(self.mountroot.cleanup)
+        self.bd = mount_utils.BlockDevice("./test_data/image_with_partitions.img")
+        self.bd.blkdevice = "/dev/loop0"
+        self.bd.partitions = ["/dev/loop0p1", "/dev/loop0p2", "/dev/loop0p3"]
+        self.bd.fstypes = {partition: "ext4" for partition in self.bd.partitions}
+        self.bd.mountroot = self.mountroot.name
+
+    def _run(self, failing=(), barrier=None):
+        def run(command, **kwargs):
+            if command[1] == "mount" and barrier:
+                barrier.wait()
+            returncode = 1 if command[-2] in failing else 0
+            return subprocess.CompletedProcess(
+                args=command, stdout="", stderr="failed", returncode=returncode
+            )
+
+        return patch(
+            "openrelik_worker_common.mount_utils.subprocess.run", side_effect=run
+        )
+
+    def test_MountConcurrently(self):
+        # All mounts have to be in flight at once to pass the barrier.
+        with self._run(barrier=threading.Barrier(3, timeout=5)):
+            mountpoints = self.bd.mount()
+        self.assertEqual(len(mountpoints), 3)
+        self.assertEqual(self.bd.mount_failures, {})
+        for mountpoint in mountpoints:
+            self.assertTrue(os.path.isdir(mountpoint))
+
+    def test_MountCollectsFailures(self):
+        with self._run(failing=["/dev/loop0p2"]) as mock_run:
+            with self.assertRaises(RuntimeError) as e:
+                self.bd.mount()
+        self.assertEqual(
+            str(e.exception), "Error running mount on /dev/loop0p2: failed "
+        )
+        self.assertEqual(list(self.bd.mount_failures), ["/dev/loop0p2"])
+        # The other partitions were still mounted.
+        self.assertEqual(len(self.bd.mountpoints), 2)
+        self.assertEqual(mock_run.call_count, 3)
+        self.assertEqual(
+            sorted(os.listdir(self.mountroot.name)),
+            sorted(os.path.basename(path) for path in self.bd.mountpoints),
+        )
+
+    def test_MountRollback(self):
+        with self._run(failing=["/dev/loop0p1", "/dev/loop0p3"]) as mock_run:
+            with self.assertRaises(RuntimeError) as e:
+                self.bd.mount(rollback=True)
+        self.assertEqual(
+            str(e.exception),
+            "Error running mount on /dev/loop0p1: failed ; "
+            "Error running mount on /dev/loop0p3: failed ",
+        )
+        self.assertEqual(self.bd.mountpoints, [])
+        self.assertEqual(os.listdir(self.mountroot.name), [])
+        self.assertEqual(mock_run.call_args.args[0][:2], ["sudo", "umount"])
+
+
+class SharedMounts(unittest.TestCase):
+    """Test the shared mount registry without block devices."""
+
+    def setUp(self):
+        self.redis_client = FakeStrictRedis(server_type="redis")
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.image_path = os.path.join(self.folder.name, "image.img")
+        Path(self.image_path).write_bytes(b"\0" * 1024)
+        self.mountroot = os.path.join(self.folder.name, "mnt")
+        os.mkdir(self.mountroot)
+
+        def setup(bd):
+            bd.blkdevice = "/dev/loop0"
+            bd.partitions = ["/dev/loop0p1", "/dev/loop0p2"]
+            bd.fstypes = {partition: "ext4" for partition in bd.partitions}
+
+        for patcher in (
+            patch.object(mount_utils.BlockDevice, "_get_hostname", return_value="host"),
+            patch.object(
+                mount_utils.BlockDevice, "setup", autospec=True, side_effect=setup
+            ),
+            patch(
+                "openrelik_worker_common.mount_utils.subprocess.run",
+                return_value=subprocess.CompletedProcess(
+                    args=[], stdout="", stderr="", returncode=0
+                ),
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.mock_setup = mount_utils.BlockDevice.setup
+        self.mock_run = mount_utils.subprocess.run
+
+    def _shared(self):
+        bd = mount_utils.SharedBlockDevice(self.image_path)
+        bd.redis_client = self.redis_client
+        bd.mountroot = self.mountroot
+        self.addCleanup(bd._stop_lease_heartbeat)
+        return bd
+
+    def _commands(self, command):
+        return [
+            call.args[0]
+            for call in self.mock_run.call_args_list
+            if command in call.args[0]
+        ]
+
+    def test_MountNamespaces(self):
+        first = self._shared()
+        first.setup()
+        self.assertIn(f"-{first._mount_namespace()}-", first.registry_key)
+
+        # A worker in another container on the node can't see the mounts.
+        with patch(
+            "openrelik_worker_common.mount_utils.os.readlink",
+            return_value="mnt:[4026532000]",
+        ):
+            second = self._shared()
+            second.setup()
+        self.assertFalse(second.reused)
+        self.assertNotEqual(second.registry_key, first.registry_key)
+        self.assertEqual(self.mock_setup.call_count, 2)
+        first.umount()
+        second.umount()
+
+    def test_ReuseMounts(self):
+        first = self._shared()
+        first.setup()
+        self.assertFalse(first.reused)
+        self.assertEqual(len(first.mount()), 2)
+        self.assertEqual(
+            first.mount(partition_name="/dev/loop0p2"),
+            [first.partition_mountpoints["/dev/loop0p2"]],
+        )
+
+        second = self._shared()
+        second.setup()
+        self.assertTrue(second.reused)
+        self.assertEqual(second.mount(), first.mountpoints)
+        self.assertEqual(self.mock_setup.call_count, 1)
+        self.assertEqual(len(self._commands("mount")), 2)
+
+        # The first holder leaves the mounts in place for the second one.
+        mountpoints = first.mountpoints
+        first.umount()
+        self.assertEqual(self._commands("umount"), [])
+        self.assertEqual(first.mountpoints, [])
+
+        second.umount()
+        self.assertEqual(len(self._commands("umount")), 2)
+        self.assertEqual(len(self._commands("--detach")), 1)
+        for mountpoint in mountpoints:
+            self.assertFalse(os.path.exists(mountpoint))
+        self.assertEqual(self.redis_client.keys("host-shared-mount-*"), [])
+
+    def _crash(self, bd):
+        bd._stop_lease_heartbeat()
+        self.redis_client.zadd(bd._holders_key, {bd.holder_id: 0})
+
+    def test_CrashedHolderIsDropped(self):
+        crashed = self._shared()
+        crashed.setup()
+        holder = self._shared()
+        holder.setup()
+        self.assertTrue(holder.reused)
+
+        self._crash(crashed)
+        holder.umount()
+        self.assertEqual(len(self._commands("umount")), 2)
+        self.assertEqual(len(self._commands("--detach")), 1)
+
+    def test_StaleMountsTornDown(self):
+        crashed = self._shared()
+        crashed.setup()
+        self._crash(crashed)
+
+        bd = self._shared()
+        bd.setup()
+        self.assertFalse(bd.reused)
+        self.assertEqual(self.mock_setup.call_count, 2)
+        self.assertEqual(len(self._commands("umount")), 2)
+        self.assertEqual(len(self._commands("mount")), 4)
+        bd.umount()
+        self.assertEqual(self.redis_client.keys("host-shared-mount-*"), [])
+
+    def test_RenewLeaseAndRegistry(self):
+        bd = self._shared()
+        bd.setup()
+        lock = self.redis_client.lock(
+            "host-/dev/nbd0", timeout=bd.LEASE_TTL_SECONDS, thread_local=False
+        )
+        self.assertTrue(lock.acquire(token="token"))
+        self.redis_client.pexpire(lock.name, 100)
+        self.redis_client.pexpire(bd.registry_key, 100)
+
+        bd._renew_lease_once(lock)
+        self.assertGreater(self.redis_client.pttl(lock.name), 1000)
+        self.assertGreater(self.redis_client.pttl(bd.registry_key), 1000)
+
+        self.redis_client.set(lock.name, "other")
+        with self.assertRaises(redis.exceptions.LockNotOwnedError):
+            bd._renew_lease_once(lock)
+        # The registry heartbeat is still sent with a lost lease.
+        self.assertIsNotNone(self.redis_client.zscore(bd._holders_key, bd.holder_id))
+        bd.umount()
+
+    def test_ImageIdentity(self):
+        bd = self._shared()
+        identity = bd._image_identity()
+        self.assertEqual(identity, self._shared()._image_identity())
+        Path(self.image_path).write_bytes(b"\0" * 2048)
+        self.assertNotEqual(identity, bd._image_identity())
+
+
+class DeviceReaper(unittest.TestCase):
+    """Test the stale device registry and reaper without block devices."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.registry_dir = os.path.join(self.folder.name, "registry")
+        self.sysfs = os.path.join(self.folder.name, "sys")
+        self.image_path = os.path.join(self.folder.name, "image.img")
+        Path(self.image_path).touch()
+        self.redis_client = FakeStrictRedis(server_type="redis")
+        for patcher in (
+            patch.object(mount_utils.BlockDevice, "SYSFS_BLOCK_PATH", self.sysfs),
+            patch(
+                "openrelik_worker_common.mount_utils.subprocess.run",
+                return_value=subprocess.CompletedProcess(
+                    args=[], stdout="", stderr="", returncode=0
+                ),
+            ),
+        ):
+            self.mock_run = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _record(self, devname="loop0", **kwargs):
+        mountpoint = os.path.join(self.folder.name, f"mnt-{devname}")
+        os.makedirs(mountpoint)
+        record = {
+            "image_path": self.image_path,
+            "blkdevice": f"/dev/{devname}",
+            "mountpoints": [mountpoint],
+            "pid": os.getpid(),
+            "starttime": -1,
+            "pid_namespace": mount_utils._pid_namespace(),
+            "lock_name": None,
+            "lock_token": None,
+        }
+        record.update(kwargs)
+        os.makedirs(self.registry_dir, exist_ok=True)
+        with open(os.path.join(self.registry_dir, f"{devname}.json"), "w") as fh:
+            json.dump(record, fh)
+        return record
+
+    def _attach_loop(self, devname="loop0"):
+        loop = os.path.join(self.sysfs, devname, "loop")
+        os.makedirs(loop)
+        Path(loop, "backing_file").write_text(os.path.realpath(self.image_path) + "\n")
+
+    def _reap(self):
+        return mount_utils.reap_stale_devices(self.registry_dir, self.redis_client)
+
+    def test_RegistryRecord(self):
+        bd = mount_utils.BlockDevice(self.image_path)
+        bd.registry_dir = self.registry_dir
+        bd.blkdevice = "/dev/loop3"
+        bd._write_registry_record()
+        with open(os.path.join(self.registry_dir, "loop3.json")) as fh:
+            record = json.load(fh)
+        self.assertEqual(record["pid"], os.getpid())
+        self.assertEqual(
+            record["starttime"], mount_utils._process_starttime(os.getpid())
+        )
+        self.assertEqual(record["blkdevice"], "/dev/loop3")
+
+        # A live owner is never reaped.
+        self.assertEqual(self._reap(), [])
+        bd.umount()
+        self.assertEqual(os.listdir(self.registry_dir), [])
+
+    def test_ReapDeadProcess(self):
+        # Same pid with another start time: the pid was reused.
+        record = self._record()
+        self._attach_loop()
+        self.assertEqual(self._reap(), ["/dev/loop0"])
+        self.assertFalse(os.path.exists(record["mountpoints"][0]))
+        self.mock_run.assert_called_once_with(
+            ["sudo", "losetup", "--detach", "/dev/loop0"],
+            capture_output=True,
+            check=False,
+            text=True,
+        )
+        self.assertEqual(os.listdir(self.registry_dir), [])
+
+    def test_ReapSkipsReusedDevice(self):
+        self._record()
+        # loop0 is attached to another image now, only the record is removed.
+        self.assertEqual(self._reap(), ["/dev/loop0"])
+        self.mock_run.assert_not_called()
+
+    def test_ReapExpiredLease(self):
+        # Another pid namespace, only the lease tells if the owner is alive.
+        self.redis_client.set("host-/dev/nbd1", b"token")
+        self._record(
+            "nbd1",
+            pid_namespace="pid:[1]",
+            lock_name="host-/dev/nbd1",
+            lock_token="token",
+        )
+        self.assertEqual(self._reap(), [])
+
+        self.redis_client.delete("host-/dev/nbd1")
+        os.makedirs(os.path.join(self.sysfs, "nbd1"))
+        Path(self.sysfs, "nbd1", "pid").write_text("1234\n")
+        self.assertEqual(self._reap(), ["/dev/nbd1"])
+        self.assertEqual(
+            self.mock_run.call_args.args[0],
+            ["sudo", "qemu-nbd", "--disconnect", "/dev/nbd1"],
+        )
+
+    def test_ReapUncheckableOwner(self):
+        self._record(pid_namespace="pid:[1]")
+        self.assertEqual(self._reap(), [])
+
+    def test_ReapSharedMounts(self):
+        self._record(registry_key="host-shared-mount-1")
+        self.redis_client.zadd("host-shared-mount-1-holders", {"holder": time.time()})
+        self.redis_client.set("host-shared-mount-1", "{}")
+        self.assertEqual(self._reap(), [])
+
+        self.redis_client.zadd("host-shared-mount-1-holders", {"holder": 0})
+        self.assertEqual(self._reap(), ["/dev/loop0"])
+        self.assertEqual(self.redis_client.keys("host-shared-mount-*"), [])
+
+    def test_StartDeviceReaper(self):
+        self._record()
+        stop = mount_utils.start_device_reaper(
+            0.01, self.registry_dir, self.redis_client
+        )
+        for _ in range(100):
+            if not os.listdir(self.registry_dir):
+                break
+            time.sleep(0.01)
+        stop.set()
+        self.assertEqual(os.listdir(self.registry_dir), [])
+
+
+class MountDrivers(unittest.TestCase):
+    """Test the mount driver policy with a mocked mount command."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.bd = mount_utils.BlockDevice("./test_data/image_vfat.img")
+        self.bd.mountroot = self.folder.name
+
+    def test_SelectMountDrivers(self):
+        self.assertEqual(
+            mount_utils.select_mount_drivers("ntfs", {"ntfs3", "ntfs-3g"}),
+            [("ntfs3", "ro,noatime"), ("ntfs-3g", "ro,noatime")],
+        )
+        self.assertEqual(
+            mount_utils.select_mount_drivers("ntfs", {"ntfs-3g", "ext4"}),
+            [("ntfs-3g", "ro,noatime")],
+        )
+        self.assertEqual(
+            mount_utils.select_mount_drivers("xfs", set()),
+            [("xfs", "ro,noatime,norecovery")],
+        )
+        self.assertEqual(
+            mount_utils.select_mount_drivers("ext3", {"ext3", "ext4"})[0],
+            ("ext4", "ro,noatime,noload"),
+        )
+        self.assertEqual(
+            mount_utils.select_mount_drivers("dos", {"ext4"}), [(None, "ro")]
+        )
+
+    def test_AvailableMountDrivers(self):
+        filesystems = Path(self.folder.name, "filesystems")
+        filesystems.write_text("nodev\tsysfs\n\text4\n\tvfat\n")
+        modules = Path(self.folder.name, "modules", os.uname().release)
+        modules.mkdir(parents=True)
+        (modules / "modules.dep").write_text("kernel/fs/ntfs3/ntfs3.ko:\n")
+
+        with patch.object(
+            mount_utils, "PROC_FILESYSTEMS_PATH", str(filesystems)
+        ), patch.object(mount_utils, "MODULES_PATH", str(modules.parent)), patch(
+            "openrelik_worker_common.mount_utils.shutil.which", return_value=None
+        ):
+            self.assertEqual(
+                self.bd._available_mount_drivers(), {"sysfs", "ext4", "vfat", "ntfs3"}
+            )
+
+    @patch("openrelik_worker_common.mount_utils.subprocess.run")
+    def test_MountFallsBackToNextDriver(self, mock_run):
+        def run(command, **kwargs):
+            returncode = 32 if command[3] == "ntfs3" else 0
+            return subprocess.CompletedProcess(
+                args=command, stdout="", stderr="error", returncode=returncode
+            )
+
+        mock_run.side_effect = run
+        self.bd.fstypes = {"/dev/loop0p1": "ntfs"}
+        self.bd._mount_drivers_available = {"ntfs3", "ntfs-3g"}
+
+        mount_folder = self.bd._mount_partition("/dev/loop0p1")
+        self.assertEqual(self.bd.mount_drivers, {"/dev/loop0p1": "ntfs-3g"})
+        self.assertEqual(
+            [call.args[0] for call in mock_run.call_args_list],
+            [
+                ["sudo", "mount", "-t", "ntfs3", "-o", "ro,noatime"]
+                + ["/dev/loop0p1", mount_folder],
+                ["sudo", "mount", "-t", "ntfs-3g", "-o", "ro,noatime"]
+                + ["/dev/loop0p1", mount_folder],
+            ],
+        )
+
+    @patch("openrelik_worker_common.mount_utils.subprocess.run")
+    def test_MountAllDriversFail(self, mock_run):
+        mock_run.return_value = subprocess.CompletedProcess(
+            args=[], stdout="", stderr="wrong fs type", returncode=32
+        )
+        self.bd.fstypes = {"/dev/loop0p1": "ntfs"}
+        self.bd._mount_drivers_available = {"ntfs3", "ntfs-3g"}
+
+        with self.assertRaises(RuntimeError) as e:
+            self.bd._mount_partition("/dev/loop0p1")
+        self.assertEqual(
+            str(e.exception), "Error running mount on /dev/loop0p1: wrong fs type "
+        )
+        self.assertEqual(mock_run.call_count, 2)
+        self.assertEqual(os.listdir(self.folder.name), [])
+        self.assertEqual(self.bd.mount_drivers, {})
+
+
+class ImageFormats(unittest.TestCase):
+    """Test the qemu-nbd image format detection."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def _write(self, name, content):
+        path = os.path.join(self.folder.name, name)
+        Path(path).write_bytes(content)
+        return path
+
+    def test_DetectByMagic(self):
+        for name, content, image_format in (
+            ("a.img", b"KDMV" + bytes(1020), "vmdk"),
+            ("b.img", b"# Disk DescriptorFile\n", "vmdk"),
+            ("c.img", b"vhdxfile" + bytes(1016), "vhdx"),
+            ("d.img", b"conectix" + bytes(1016), "vpc"),
+            ("e.img", bytes(1024) + b"conectix" + bytes(504), "vpc"),
+            ("f.img", bytes(64) + b"\x7f\x10\xda\xbe" + bytes(956), "vdi"),
+            ("g.img", b"QFI\xfb\x00\x00\x00\x01" + bytes(1016), "qcow"),
+            # Magic wins over the extension.
+            ("h.vhd", b"QFI\xfb\x00\x00\x00\x03" + bytes(1016), "qcow2"),
+            ("i.img", bytes(1024), None),
+        ):
+            self.assertEqual(
+                mount_utils.detect_image_format(self._write(name, content)),
+                image_format,
+                name,
+            )
+
+    def test_DetectByExtension(self):
+        self.assertEqual(mount_utils.detect_image_format("missing.VHD"), "vpc")
+        self.assertEqual(mount_utils.detect_image_format("missing.qcow3"), "qcow2")
+        self.assertIsNone(mount_utils.detect_image_format("missing.dd"))
+
+        # Extensions are configured per BlockDevice through supported_nbdtypes.
+        bd = mount_utils.BlockDevice("missing.vhd")
+        del bd.supported_nbdtypes["vhd"]
+        self.assertIsNone(
+            mount_utils.detect_image_format(bd.image_path, bd.supported_nbdtypes)
+        )
+        self.assertEqual(mount_utils.NBD_IMAGE_FORMATS["vhd"], "vpc")
+
+    @patch("openrelik_worker_common.mount_utils.get_redis_client")
+    @patch("openrelik_worker_common.mount_utils.subprocess.run")
+    @patch.object(mount_utils.BlockDevice, "_required_modules_loaded")
+    @patch.object(mount_utils.BlockDevice, "_required_tools_available")
+    @patch.object(mount_utils.BlockDevice, "_get_free_nbd_device")
+    def test_SetupUsesNbdFormat(
+        self, mock_nbd, mock_tools, mock_modules, mock_run, mock_redis
+    ):
+        mock_nbd.return_value = "/dev/nbd0"
+        mock_run.return_value = subprocess.CompletedProcess(
+            args=[], stdout="", stderr="error", returncode=1
+        )
+        bd = mount_utils.BlockDevice(self._write("disk.vmdk", b"KDMV" + bytes(1020)))
+        with self.assertRaises(RuntimeError):
+            bd.setup()
+        self.assertEqual(bd.image_format, "vmdk")
+        self.assertEqual(
+            mock_run.call_args.args[0],
+            ["sudo", "qemu-nbd", "--read-only", "--format=vmdk", "--connect"]
+            + ["/dev/nbd0", bd.image_path],
+        )
+
+
+class AsyncBlockDevices(unittest.TestCase):
+    """Test the asyncio BlockDevice without block devices."""
+
+    LSBLK = {
+        "blockdevices": [
+            {
+                "name": "loop0",
+                "size": 4 * 1024 * 1024 * 1024,
+                "children": [
+                    {"name": "loop0p1", "size": 1024 * 1024 * 1024},
+                    {"name": "loop0p2", "size": 1024 * 1024 * 1024},
+                ],
+            }
+        ]
+    }
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.mountroot = os.path.join(self.folder.name, "mnt")
+        os.mkdir(self.mountroot)
+        self.commands = []
+        self.fail_mount = False
+        self.running = 0
+        self.max_running = 0
+        for name in ("_required_tools_available", "_required_modules_loaded_async"):
+            patcher = patch.object(mount_utils.AsyncBlockDevice, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ("_partitions_ready", "_nbd_ready"):
+            patcher = patch.object(mount_utils.BlockDevice, name, return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.dict(
+            os.environ, {"OPENRELIK_DEVICE_REGISTRY_DIR": self.folder.name}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch(
+            "openrelik_worker_common.mount_utils.asyncio.create_subprocess_exec",
+            side_effect=self._exec,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _output(self, command):
+        # Images are named image<n>.*, image n is attached to loop<n>.
+        if command[1] == "losetup" and "--find" in command:
+            return 0, f"/dev/loop{command[-1][-5]}\n"
+        if command[1] == "lsblk":
+            name = os.path.basename(command[-1])
+            lsblk = json.loads(json.dumps(self.LSBLK).replace("loop0", name))
+            return 0, json.dumps(lsblk)
+        if command[1] == "blkid":
+            return 0, "\n\n".join(
+                f"DEVNAME={devname}\nTYPE=ext4"
+                for devname in command[6:]
+                if devname[-2] == "p"
+            )
+        if command[1] == "mount" and command[-2].endswith("p2") and self.fail_mount:
+            return 32, ""
+        return 0, ""
+
+    async def _exec(self, *command, **kwargs):
+        self.commands.append(list(command))
+        returncode, stdout = self._output(command)
+        test = self
+
+        class Process:
+            async def communicate(self):
+                test.running += 1
+                test.max_running = max(test.max_running, test.running)
+                await asyncio.sleep(0.01)
+                test.running -= 1
+                return stdout.encode(), b"failed" if returncode else b""
+
+        Process.returncode = returncode
+        return Process()
+
+    def _device(self, name):
+        image_path = os.path.join(self.folder.name, name)
+        Path(image_path).write_bytes(b"\0" * 1024)
+        bd = mount_utils.AsyncBlockDevice(image_path)
+        bd.mountroot = self.mountroot
+        return bd
+
+    def test_ContextManager(self):
+        bd = self._device("image1.img")
+
+        async def run():
+            async with bd:
+                self.assertEqual(bd.blkdevice, "/dev/loop1")
+                self.assertEqual(bd.partitions, ["/dev/loop1p1", "/dev/loop1p2"])
+                self.assertEqual(len(bd.mountpoints), 2)
+                for mountpoint in bd.mountpoints:
+                    self.assertTrue(os.path.isdir(mountpoint))
+                self.assertTrue(
+                    os.path.exists(os.path.join(self.folder.name, "loop1.json"))
+                )
+
+        asyncio.run(run())
+        self.assertIsNone(bd.blkdevice)
+        self.assertEqual(bd.mountpoints, [])
+        self.assertEqual(os.listdir(self.mountroot), [])
+        self.assertFalse(os.path.exists(os.path.join(self.folder.name, "loop1.json")))
+        self.assertEqual(
+            self.commands[-1], ["sudo", "losetup", "--detach", "/dev/loop1"]
+        )
+
+    def test_SyncMethodsInherited(self):
+        # The asyncio entry points don't replace the synchronous BlockDevice API.
+        for name in ("setup", "mount", "umount"):
+            method = getattr(mount_utils.AsyncBlockDevice, name)
+            self.assertIs(method, getattr(mount_utils.BlockDevice, name))
+            self.assertFalse(asyncio.iscoroutinefunction(method))
+            self.assertTrue(
+                asyncio.iscoroutinefunction(
+                    getattr(mount_utils.AsyncBlockDevice, f"{name}_async")
+                )
+            )
+
+    def test_ConcurrentSetup(self):
+        devices = [self._device(f"image{n}.img") for n in range(1, 4)]
+
+        async def run_concurrently():
+            await asyncio.gather(*(bd.setup_async() for bd in devices))
+            await asyncio.gather(*(bd.umount_async() for bd in devices))
+
+        asyncio.run(run_concurrently())
+        # The losetup calls of all images were in flight at once.
+        self.assertEqual(self.max_running, 3)
+        self.assertEqual(
+            sorted(command[-1] for command in self.commands if command[1] == "lsblk"),
+            ["/dev/loop1", "/dev/loop2", "/dev/loop3"],
+        )
+
+    def test_NbdWaitForSlot(self):
+        redis_client = FakeAsyncRedis(server_type="redis")
+        bd = self._device("image1.qcow2")
+        bd.nbd_wait_timeout = 5
+        Path(bd.image_path).write_bytes(b"QFI\xfb" + bytes(1020))
+
+        async def free_slot(seconds):
+            await redis_client.delete("host-/dev/nbd4")
+
+        async def run():
+            for device_number in range(bd.MAX_NBD_DEVICES + 1):
+                await redis_client.set(f"host-/dev/nbd{device_number}", "other")
+            with patch.object(
+                mount_utils.BlockDevice, "_get_hostname", return_value="host"
+            ), patch(
+                "openrelik_worker_common.mount_utils.get_async_redis_client",
+                return_value=redis_client,
+            ), patch(
+                "openrelik_worker_common.mount_utils.asyncio.sleep",
+                side_effect=free_slot,
+            ):
+                self.assertEqual(await bd._get_free_nbd_device_async(), "/dev/nbd4")
+            self.assertEqual(
+                await redis_client.get("host-/dev/nbd4"), bd.redis_lock.local.token
+            )
+            self.assertEqual(await redis_client.llen("host-nbd-queue"), 0)
+            self.assertEqual(await redis_client.keys("host-nbd-waiter-*"), [])
+            bd._lease_task.cancel()
+
+        bd.redis_client = redis_client
+        asyncio.run(run())
+
+    def test_NbdWaitForSlotTimeout(self):
+        redis_client = FakeAsyncRedis(server_type="redis")
+        bd = self._device("image1.qcow2")
+        bd.nbd_wait_timeout = 0.1
+        bd.redis_client = redis_client
+
+        async def run():
+            for device_number in range(bd.MAX_NBD_DEVICES + 1):
+                await redis_client.set(f"host-/dev/nbd{device_number}", "other")
+            with patch.object(
+                mount_utils.BlockDevice, "_get_hostname", return_value="host"
+            ):
+                with self.assertRaises(RuntimeError):
+                    await bd._get_free_nbd_device_async()
+            self.assertIsNone(bd.redis_lock)
+            self.assertEqual(await redis_client.llen("host-nbd-queue"), 0)
+
+        asyncio.run(run())
+
+    def test_MountFailureCleansUp(self):
+        self.fail_mount = True
+        bd = self._device("image1.img")
+
+        async def run():
+            async with bd:
+                pass
+
+        with self.assertRaises(RuntimeError) as e:
+            asyncio.run(run())
+        self.assertEqual(
+            str(e.exception), "Error running mount on /dev/loop1p2: failed "
+        )
+        self.assertIsNone(bd.blkdevice)
+        self.assertEqual(os.listdir(self.mountroot), [])
+        self.assertEqual(
+            self.commands[-1], ["sudo", "losetup", "--detach", "/dev/loop1"]
+        )
+
+    def test_NbdLease(self):
+        redis_client = FakeAsyncRedis(server_type="redis")
+        bd = self._device("image1.qcow2")
+        Path(bd.image_path).write_bytes(b"QFI\xfb" + bytes(1020))
+
+        async def run():
+            await redis_client.set("host-/dev/nbd0", "other")
+            with patch.object(
+                mount_utils.BlockDevice, "_get_hostname", return_value="host"
+            ), patch(
+                "openrelik_worker_common.mount_utils.get_async_redis_client",
+                return_value=redis_client,
+            ):
+                await bd.setup_async()
+            self.assertEqual(bd.blkdevice, "/dev/nbd1")
+            self.assertEqual(
+                await redis_client.get("host-/dev/nbd1"), bd.redis_lock.local.token
+            )
+            self.assertFalse(bd._lease_task.done())
+            await bd.umount_async()
+            self.assertIsNone(await redis_client.get("host-/dev/nbd1"))
+
+        asyncio.run(run())
+        self.assertIsNone(bd._lease_task)
+        self.assertFalse(bd.lease_lost)
+        self.assertIn(
+            ["sudo", "qemu-nbd", "--read-only", "--format=qcow2", "--connect"]
+            + ["/dev/nbd1", bd.image_path],
+            self.commands,
+        )
+        self.assertEqual(
+            self.commands[-1], ["sudo", "qemu-nbd", "--disconnect", "/dev/nbd1"]
+        )
+
+
+class FakeRunnerDevice(unittest.TestCase):
+    """Test a full BlockDevice lifecycle on a FakeRunner."""
+
+    def test_SetupMountUmount(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        image_path = os.path.join(folder.name, "image.img")
+        Path(image_path).write_bytes(b"\0" * 1024)
+        lsblk = {
+            "blockdevices": [
+                {
+                    "name": "loopfake",
+                    "size": 2048,
+                    "children": [
+                        {"name": "loopfakep1", "size": 1024},
+                        {"name": "loopfakep2", "size": 1024},
+                    ],
+                }
+            ]
+        }
+        runner = FakeRunner()
+        runner.add(["/usr/bin/grep"])
+        runner.add(["sudo", "losetup"], stdout="/dev/loopfake\n")
+        runner.add(["sudo", "lsblk"], stdout=json.dumps(lsblk))
+        runner.add(
+            ["sudo", "blkid"],
+            stdout="DEVNAME=/dev/loopfakep1\nTYPE=ext4\n\nDEVNAME=/dev/loopfakep2",
+        )
+        runner.add(["sudo", "mount"])
+        runner.add(["sudo", "umount"])
+
+        bd = mount_utils.BlockDevice(image_path, min_partition_size=1, runner=runner)
+        bd.mountroot = folder.name
+        bd.registry_dir = folder.name
+        with CommandTimer() as timer, patch("shutil.which", return_value=True):
+            bd.setup()
+            mountpoints = bd.mount()
+            self.assertEqual(bd.partitions, ["/dev/loopfakep1"])
+            self.assertEqual(len(mountpoints), 1)
+            bd.umount()
+        self.assertEqual(
+            {
+                program: timing["count"]
+                for program, timing in timer.summary()["programs"].items()
+            },
+            {"grep": 1, "losetup": 2, "lsblk": 1, "blkid": 1, "mount": 1, "umount": 1},
+        )
+
+        self.assertEqual(
+            [command[:2] for command in runner.commands],
+            [
+                ["/usr/bin/grep", "-E"],
+                ["sudo", "losetup"],
+                ["sudo", "lsblk"],
+                ["sudo", "blkid"],
+                ["sudo", "mount"],
+                ["sudo", "umount"],
+                ["sudo", "losetup"],
+            ],
+        )
+        self.assertEqual(runner.commands[-1][-2:], ["--detach", "/dev/loopfake"])
+        self.assertEqual(os.listdir(folder.name), ["image.img"])
+
+    def test_AsyncRequiredModulesLoaded(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        image_path = os.path.join(folder.name, "image.img")
+        Path(image_path).write_bytes(b"\0" * 1024)
+        runner = FakeRunner()
+        runner.add(["/usr/bin/grep"], returncode=1)
+        bd = mount_utils.AsyncBlockDevice(image_path, runner=runner)
+        with patch.object(
+            mount_utils.BlockDevice, "_required_modules_loaded"
+        ) as mock_sync:
+            with self.assertRaises(RuntimeError) as e:
+                asyncio.run(bd._required_modules_loaded_async())
+        mock_sync.assert_not_called()
+        self.assertIn("Required kernel module nbd is not loaded", str(e.exception))
+        self.assertEqual(
+            runner.commands, [["/usr/bin/grep", "-E", "^nbd\\s", "/proc/modules"]]
+        )
+
+        runner.add(["/usr/bin/grep"])
+        asyncio.run(bd._required_modules_loaded_async())
+
+
 if __name__ == "__main__":
     unittest.main()
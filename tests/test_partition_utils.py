@@ -0,0 +1,392 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import struct
+import tempfile
+import unittest
+import uuid
+import zlib
+from unittest.mock import patch
+
+from openrelik_worker_common import mount_utils, partition_utils
+
+LINUX_FS_GUID = "0fc63daf-8483-4772-8e79-3d47de4741e4"
+ESP_GUID = "c12a7328-f81f-11d2-ba4b-00a0c93ec93b"
+
+
+def _mbr_entry(partition_type, start_lba, sectors, status=0):
+    return struct.pack(
+        "<B3sB3sII", status, b"", partition_type, b"", start_lba, sectors
+    )
+
+
+def _mbr(entries):
+    sector = bytearray(512)
+    for index, entry in enumerate(entries):
+        sector[446 + index * 16 : 446 + (index + 1) * 16] = entry
+    sector[510:512] = b"\x55\xaa"
+    return bytes(sector)
+
+
+def _write_qcow2(path, size, clusters, backing_file=None):
+    """Writes a version 2 qcow2 image with 512 byte clusters.
+
+    Args:
+        clusters (dict): guest cluster index to raw bytes, or to ("zlib", bytes) for
+            a compressed cluster.
+    """
+    cluster_size = 512
+    l2_table = [0] * 64
+    data = bytearray()
+    data_offset = 3 * cluster_size
+    for index, content in sorted(clusters.items()):
+        host_offset = data_offset + len(data)
+        if isinstance(content, tuple):
+            compressor = zlib.compressobj(wbits=-12)
+            compressed = compressor.compress(content[1]) + compressor.flush()
+            l2_table[index] = (1 << 62) | host_offset
+            data += compressed
+        else:
+            l2_table[index] = (1 << 63) | host_offset
+            data += content
+        data += bytes(-len(data) % cluster_size)
+
+    backing = (backing_file or "").encode()
+    header = struct.pack(
+        ">4sIQIIQIIQQIIQ",
+        b"QFI\xfb",
+        2,
+        104 if backing else 0,
+        len(backing),
+        9,
+        size,
+        0,
+        1,
+        cluster_size,
+        0,
+        0,
+        0,
+        0,
+    )
+    header = header.ljust(104, b"\0") + backing
+    with open(path, "wb") as fh:
+        fh.write(header.ljust(cluster_size, b"\0"))
+        fh.write(struct.pack(">Q", (1 << 63) | 2 * cluster_size).ljust(512, b"\0"))
+        fh.write(struct.pack(">64Q", *l2_table))
+        fh.write(data)
+
+
+class PartitionUtils(unittest.TestCase):
+    """Test the partition table parser."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def _write(self, name, content, size=1024 * 1024):
+        path = os.path.join(self.folder.name, name)
+        with open(path, "wb") as fh:
+            fh.write(content)
+            fh.truncate(size)
+        return path
+
+    def test_Qcow2Partitions(self):
+        partitions = partition_utils.read_partitions(
+            "./test_data/image_with_partitions.qcow2"
+        )
+        self.assertEqual(
+            [(p.number, p.offset, p.size, p.type_id) for p in partitions],
+            [(1, 512, 524288, "0x83"), (2, 524800, 523776, "0x83")],
+        )
+
+        # The ext4 superblock magic is read through the cluster map.
+        with partition_utils.open_image(
+            "./test_data/image_with_partitions.qcow2"
+        ) as image:
+            self.assertIsInstance(image, partition_utils.Qcow2Image)
+            for partition in partitions:
+                self.assertEqual(image.read(partition.offset + 1080, 2), b"\x53\xef")
+
+    def test_MbrWithLogicalPartitions(self):
+        image = bytearray(
+            _mbr(
+                [
+                    _mbr_entry(0x83, 2048, 100, status=0x80),
+                    _mbr_entry(0x05, 4096, 1000),
+                ]
+            )
+        )
+        image += bytes(4096 * 512 - len(image))
+        # First EBR: logical partition at +2 and a link to the next EBR at +200.
+        image += _mbr([_mbr_entry(0x07, 2, 50), _mbr_entry(0x05, 200, 100)])
+        image += bytes(199 * 512)
+        image += _mbr([_mbr_entry(0x83, 2, 60)])
+        path = self._write("mbr.img", bytes(image), size=6000 * 512)
+
+        partitions = partition_utils.read_partitions(path)
+        self.assertEqual(
+            [(p.number, p.offset, p.size, p.type_id) for p in partitions],
+            [
+                (1, 2048 * 512, 100 * 512, "0x83"),
+                (5, 4098 * 512, 50 * 512, "0x07"),
+                (6, 4298 * 512, 60 * 512, "0x83"),
+            ],
+        )
+        self.assertTrue(partitions[0].bootable)
+        self.assertEqual(partitions[0].scheme, "mbr")
+
+    def test_Gpt(self):
+        entries = bytearray(128 * 128)
+        for index, (type_guid, first, last, name) in enumerate(
+            [(ESP_GUID, 2048, 4095, "EFI"), (LINUX_FS_GUID, 4096, 8191, "root")]
+        ):
+            entries[index * 128 : (index + 1) * 128] = (
+                uuid.UUID(type_guid).bytes_le
+                + uuid.uuid4().bytes_le
+                + struct.pack("<QQQ", first, last, 0)
+                + name.encode("utf-16-le").ljust(72, b"\0")
+            )
+        header = b"EFI PART".ljust(72, b"\0") + struct.pack("<QII", 2, 128, 128)
+        image = _mbr([_mbr_entry(0xEE, 1, 10000)]) + header.ljust(512, b"\0")
+        path = self._write("gpt.img", image + entries, size=10240 * 512)
+
+        partitions = partition_utils.read_partitions(path)
+        self.assertEqual(
+            [(p.number, p.offset, p.size, p.type_id, p.name) for p in partitions],
+            [
+                (1, 2048 * 512, 2048 * 512, ESP_GUID, "EFI"),
+                (2, 4096 * 512, 4096 * 512, LINUX_FS_GUID, "root"),
+            ],
+        )
+        self.assertEqual(partitions[1].to_dict()["scheme"], "gpt")
+
+    def test_NoPartitionTable(self):
+        self.assertEqual(
+            partition_utils.read_partitions("./test_data/image_vfat.img"), []
+        )
+        self.assertEqual(
+            partition_utils.read_partitions("./test_data/image_without_partitions.img"),
+            [],
+        )
+        # Entries pointing past the end of the image are not a partition table.
+        path = self._write("bogus.img", _mbr([_mbr_entry(0x83, 1, 1 << 30)]))
+        self.assertEqual(partition_utils.read_partitions(path), [])
+
+    def test_SelectPartitions(self):
+        selected = partition_utils.select_partitions(
+            "./test_data/image_with_partitions.qcow2", 524288
+        )
+        self.assertEqual([p.number for p in selected], [1])
+
+        selected = partition_utils.select_partitions(
+            "./test_data/image_without_partitions.img", 1
+        )
+        self.assertEqual([(p.number, p.scheme) for p in selected], [(0, "none")])
+        self.assertEqual(
+            partition_utils.select_partitions(
+                "./test_data/image_without_partitions.img", 2 * 1024 * 1024
+            ),
+            [],
+        )
+
+    def test_Qcow2CompressedAndBacking(self):
+        backing = self._write("backing.img", b"B" * 2048, size=4096)
+        path = os.path.join(self.folder.name, "overlay.qcow2")
+        _write_qcow2(
+            path,
+            4096,
+            {0: b"A" * 512, 2: ("zlib", b"C" * 512)},
+            backing_file=os.path.basename(backing),
+        )
+        with partition_utils.open_image(path) as image:
+            self.assertEqual(image.read(0, 512), b"A" * 512)
+            self.assertEqual(image.read(500, 24), b"A" * 12 + b"B" * 12)
+            self.assertEqual(image.read(1024, 512), b"C" * 512)
+            self.assertEqual(image.read(2048, 16), bytes(16))
+            self.assertEqual(len(image.read(4000, 512)), 96)
+
+    def test_Qcow2Unsupported(self):
+        path = self._write("v1.qcow", struct.pack(">4sI", b"QFI\xfb", 1))
+        with self.assertRaises(RuntimeError) as e:
+            partition_utils.open_image(path)
+        self.assertEqual(
+            str(e.exception),
+            f"Error reading qcow2 image {path}: unsupported version 1",
+        )
+
+    def test_Qcow2BackingFileRejected(self):
+        path = os.path.join(self.folder.name, "overlay.qcow2")
+        outside = self._write("../outside.img", b"X" * 512, size=4096)
+        self.addCleanup(os.remove, outside)
+        for backing_file in ("/etc/passwd", "../outside.img", "overlay.qcow2"):
+            _write_qcow2(path, 4096, {}, backing_file=backing_file)
+            with self.assertRaises(RuntimeError):
+                partition_utils.open_image(path)
+
+    def test_Qcow2TruncatedL1Table(self):
+        path = os.path.join(self.folder.name, "truncated.qcow2")
+        _write_qcow2(path, 4096, {})
+        with open(path, "r+b") as fh:
+            # Point the 1 entry L1 table past the end of the image.
+            fh.seek(40)
+            fh.write(struct.pack(">Q", 1 << 20))
+        with self.assertRaises(RuntimeError) as e:
+            partition_utils.open_image(path)
+        self.assertIn("L1 table outside of the image", str(e.exception))
+
+    def test_Qcow2L2Cache(self):
+        path = os.path.join(self.folder.name, "image.qcow2")
+        _write_qcow2(path, 4096, {0: b"A" * 512, 1: b"B" * 512})
+        with patch.object(partition_utils, "QCOW2_L2_CACHE_BYTES", 512):
+            with partition_utils.open_image(path) as image:
+                self.assertEqual(image.read(0, 1024), b"A" * 512 + b"B" * 512)
+                # Only one 512 byte L2 table fits, the older one is evicted.
+                image._l2_table(0)
+                self.assertEqual(list(image._l2_cache), [0])
+                self.assertEqual(image.read(512, 4), b"BBBB")
+                self.assertEqual(list(image._l2_cache), [1024])
+
+        # The L1 table points to an L2 table past the end of the image.
+        with open(path, "r+b") as fh:
+            fh.seek(512)
+            fh.write(struct.pack(">Q", (1 << 63) | 1 << 20))
+        with partition_utils.open_image(path) as image:
+            with self.assertRaises(RuntimeError) as e:
+                image.read(0, 512)
+        self.assertIn("L2 table at 1048576 outside of the image", str(e.exception))
+
+    def test_GptInvalidEntryArray(self):
+        header = b"EFI PART".ljust(72, b"\0")
+        for entries in ((2, 0xFFFFFFFF, 0xFFFFFFFF), (1 << 60, 128, 128)):
+            image = _mbr([_mbr_entry(0xEE, 1, 10000)]) + (
+                header + struct.pack("<QII", *entries)
+            ).ljust(512, b"\0")
+            path = self._write("gpt.img", image)
+            with self.assertRaises(RuntimeError):
+                partition_utils.read_partitions(path)
+
+    def test_UnsupportedImageFormats(self):
+        for name, content in (
+            ("disk.vmdk", b"KDMV"),
+            ("disk.vhd", bytes(1024) + b"conectix" + bytes(504)),
+            ("disk.vhdx", b"vhdxfile"),
+            ("disk.vdi", bytes(64) + b"\x7f\x10\xda\xbe"),
+        ):
+            path = self._write(name, content, size=1536)
+            with self.assertRaises(RuntimeError) as e:
+                partition_utils.select_partitions(path, 1)
+            self.assertIn("unsupported image format", str(e.exception))
+            with self.assertRaises(RuntimeError):
+                partition_utils.PartitionReader(path, 0, 512)
+
+
+class PartitionReaderTest(unittest.TestCase):
+    """Test the PartitionReader."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.content = bytes(range(256)) * 64
+        self.path = os.path.join(self.folder.name, "disk.img")
+        with open(self.path, "wb") as fh:
+            fh.write(b"\xff" * 8192 + self.content + b"\xee" * 4096)
+
+    def _check_reader(self, reader):
+        self.assertEqual(reader.read(10), self.content[:10])
+        self.assertEqual(reader.tell(), 10)
+        reader.seek(-6, io.SEEK_END)
+        self.assertEqual(reader.read(), self.content[-6:])
+        self.assertEqual(reader.read(10), b"")
+        self.assertEqual(reader.pread(100, 50), self.content[100:150])
+        self.assertEqual(reader.pread(len(self.content) - 2, 10), self.content[-2:])
+
+        reader.seek(1000)
+        buffer = bytearray(2000)
+        self.assertEqual(reader.readinto(buffer), 2000)
+        self.assertEqual(bytes(buffer), self.content[1000:3000])
+
+        reader.seek(0)
+        buffered = io.BufferedReader(reader, buffer_size=1024)
+        self.assertEqual(buffered.read(), self.content)
+        buffered.detach()
+
+    def test_Pread(self):
+        with partition_utils.PartitionReader(
+            self.path, 8192, len(self.content)
+        ) as reader:
+            self._check_reader(reader)
+            with self.assertRaises(RuntimeError):
+                reader.view(0, 10)
+
+    def test_Mmap(self):
+        # The partition does not start on an allocation granularity boundary.
+        path = os.path.join(self.folder.name, "unaligned.img")
+        with open(path, "wb") as fh:
+            fh.write(b"\xff" * 512 + self.content)
+        with partition_utils.PartitionReader(
+            path, 512, len(self.content), use_mmap=True
+        ) as reader:
+            self._check_reader(reader)
+            view = reader.view(256, 512)
+            self.assertIsInstance(view, memoryview)
+            self.assertEqual(view, self.content[256:768])
+            view.release()
+
+    def test_Qcow2Partition(self):
+        image_path = "./test_data/image_with_partitions.qcow2"
+        partition = partition_utils.read_partitions(image_path)[1]
+        with partition_utils.PartitionReader.from_partition(
+            image_path, partition
+        ) as reader:
+            self.assertEqual(reader.pread(1080, 2), b"\x53\xef")
+        with self.assertRaises(RuntimeError):
+            partition_utils.PartitionReader.from_partition(
+                image_path, partition, use_mmap=True
+            )
+
+    def test_FromBlockDevice(self):
+        sysfs = os.path.join(self.folder.name, "sys")
+        os.makedirs(os.path.join(sysfs, "loop0", "loop0p1"))
+        for name, value in (("start", 16), ("size", len(self.content) // 512)):
+            with open(os.path.join(sysfs, "loop0", "loop0p1", name), "w") as fh:
+                fh.write(f"{value}\n")
+        block_device = mount_utils.BlockDevice(self.path)
+        block_device.blkdevice = "/dev/loop0"
+        block_device.SYSFS_BLOCK_PATH = sysfs
+
+        with partition_utils.PartitionReader.from_block_device(
+            block_device, "/dev/loop0p1"
+        ) as reader:
+            self.assertEqual(reader.read(), self.content)
+        with self.assertRaises(RuntimeError):
+            partition_utils.PartitionReader.from_block_device(
+                block_device, "/dev/loop0p2"
+            )
+
+        with open(self.path, "r+b") as fh:
+            fh.write(b"KDMV")
+        with self.assertRaises(RuntimeError):
+            partition_utils.PartitionReader.from_block_device(
+                block_device, "/dev/loop0p1"
+            )
+
+    def test_OutsideImage(self):
+        with self.assertRaises(RuntimeError):
+            partition_utils.PartitionReader(self.path, 8192, 1 << 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
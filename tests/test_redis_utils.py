@@ -0,0 +1,132 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+from fakeredis import aioredis
+
+from openrelik_worker_common import redis_utils
+
+
+class RedisUtils(unittest.TestCase):
+    """Test the shared Redis connection pools."""
+
+    def setUp(self):
+        server = fakeredis.FakeServer()
+
+        def sync_pool(url):
+            return redis_utils._CountingConnectionPool(
+                connection_class=fakeredis.FakeConnection, server=server
+            )
+
+        def async_pool(url):
+            return redis_utils._CountingAsyncConnectionPool(
+                connection_class=aioredis.FakeConnection, server=server
+            )
+
+        for patcher in (
+            patch.object(
+                redis_utils._CountingConnectionPool, "from_url", side_effect=sync_pool
+            ),
+            patch.object(
+                redis_utils._CountingAsyncConnectionPool,
+                "from_url",
+                side_effect=async_pool,
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        redis_utils.reset_pools()
+        self.addCleanup(redis_utils.reset_pools)
+
+    def test_ClientsSharePool(self):
+        url = "redis://:secret@redis:6379/0"
+        clients = [redis_utils.get_redis_client(url) for _ in range(3)]
+        other = redis_utils.get_redis_client("redis://redis:6379/1")
+        self.assertIs(clients[0].connection_pool, clients[2].connection_pool)
+        self.assertIsNot(clients[0].connection_pool, other.connection_pool)
+
+        for n, client in enumerate(clients):
+            client.set(f"key{n}", n)
+            pipe = client.pipeline()
+            pipe.get(f"key{n}")
+            pipe.ttl(f"key{n}")
+            self.assertEqual(pipe.execute(), [str(n).encode(), -1])
+
+        stats = redis_utils.connection_stats()
+        self.assertEqual(
+            stats["redis://:***@redis:6379/0"],
+            {
+                "clients": 3,
+                "pools": 1,
+                "checkouts": 6,
+                "connections_created": 1,
+                "connections_reused": 5,
+                "in_use": 0,
+                "idle": 1,
+            },
+        )
+        self.assertEqual(stats["redis://redis:6379/1"]["checkouts"], 0)
+
+    @patch.dict(os.environ, {"REDIS_URL": "redis://env:6379/0"})
+    def test_DefaultUrl(self):
+        redis_utils.get_redis_client()
+        self.assertEqual(list(redis_utils.connection_stats()), ["redis://env:6379/0"])
+
+    def test_AsyncClientsSharePoolPerLoop(self):
+        url = "redis://redis:6379/0"
+
+        async def run():
+            first = redis_utils.get_async_redis_client(url)
+            second = redis_utils.get_async_redis_client(url)
+            self.assertIs(first.connection_pool, second.connection_pool)
+            await first.set("key", 1)
+            await first.aclose()
+            # Closing a client leaves the shared pool open.
+            self.assertEqual(await second.get("key"), b"1")
+
+        asyncio.run(run())
+        asyncio.run(run())
+        stats = redis_utils.connection_stats()[url]
+        self.assertEqual(stats["clients"], 4)
+        self.assertEqual(stats["pools"], 2)
+        self.assertEqual(stats["connections_created"], 2)
+        self.assertEqual(stats["connections_reused"], 2)
+
+    def test_AsyncClientNeedsLoop(self):
+        with self.assertRaises(RuntimeError):
+            redis_utils.get_async_redis_client("redis://redis:6379/0")
+
+    def test_ForkedChildStartsWithoutPools(self):
+        client = redis_utils.get_redis_client("redis://redis:6379/0")
+        client.ping()
+        pid = os.fork()
+        if pid == 0:
+            child = redis_utils.get_redis_client("redis://redis:6379/0")
+            same_pool = child.connection_pool is client.connection_pool
+            stats = redis_utils.connection_stats()["redis://redis:6379/0"]
+            os._exit(0 if not same_pool and stats["clients"] == 1 else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(
+            redis_utils.connection_stats()["redis://redis:6379/0"]["clients"], 1
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()